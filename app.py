@@ -1,17 +1,23 @@
 import os
 import sys
 import json
-import re
-import shutil
-import subprocess
+import time
+import functools
 import logging
 from logging.handlers import RotatingFileHandler
-from flask import Flask, render_template, request, jsonify, send_file
-from main import run_analysis
+from flask import Flask, Response, render_template, request, jsonify, send_file
+from main import run_analysis, find_resumable_run, load_search_entries, forget_project, project_root, project_for_root
+from jobs import JobManager, MemoryJobStore, RedisJobStore
 from code_loader import load_code_files
-from db import codebase_files, chunks, analysis_results
-from bson import json_util
-import redis
+from folder_scanner import FolderScanner, FOLDER_SCAN_DEPTH
+from repo_manager import RepoManager, GitError, is_remote, project_key
+from db import codebase_files, chunks, analysis_results, file_contents, runs
+from metrics import REGISTRY
+from services import redis_client, health
+from cache import compress_value, decompress_value
+from output import read_ndjson_page, ndjson_path
+from bson import json_util, ObjectId
+import search_index
 
 # === Setup Logging ===
 LOG_DIR = os.path.join(os.getcwd(), "logs")
@@ -38,126 +44,313 @@ werkzeug_logger.addHandler(file_handler)
 
 # === Flask App ===
 app = Flask(__name__)
-#redis_client = redis.StrictRedis(host='localhost', port=6379, db=0)
-redis_client = redis.StrictRedis(host=os.getenv('REDIS_HOST', 'localhost'), port=6379, db=0)
 
-BASE_TEMP_DIR = os.path.join(os.getcwd(), "temp")
-os.makedirs(BASE_TEMP_DIR, exist_ok=True)
+# Background analysis jobs; job state lives in Redis unless JOB_STORE=memory
+job_store = MemoryJobStore() if os.getenv("JOB_STORE", "redis") == "memory" else RedisJobStore()
+job_manager = JobManager(job_store)
+
+# Folder trees for /fetch, with directory listings cached until their mtime changes
+folder_scanner = FolderScanner()
+
+def forget_evicted_checkout(checkout_dir, projects):
+    """
+    Drops the stored analysis and search index of the projects whose latest run
+    analyzed the evicted `checkout_dir`; projects analyzed in a newer checkout since keep theirs.
+    """
+    for project in projects:
+        root = project_root(project)
+        if root == checkout_dir or root.startswith(checkout_dir + os.sep):
+            logging.info(f"Checkout {checkout_dir} was evicted, dropping the stored analysis of {project}")
+            forget_project(project)
+
+# Mirrors and checkouts of remote repositories, keyed by owner/repo/branch/commit
+repo_manager = RepoManager(on_evict=forget_evicted_checkout)
+
+# Default and largest number of documents per page of /db/<collection>
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Default and largest number of hits returned by /search
+DEFAULT_SEARCH_RESULTS = 10
+MAX_SEARCH_RESULTS = 100
+
+PAGEABLE_COLLECTIONS = {
+    "codebase_files": codebase_files,
+    "chunks": chunks,
+    "analysis_results": analysis_results,
+    "runs": runs
+}
 
 def serialize_cursor(cursor):
     return json.loads(json_util.dumps(cursor))
 
+def collection_page(collection, limit=DEFAULT_PAGE_SIZE, after=None, fields=None):
+    """
+    One page of `collection` in `_id` order, starting after the `_id` given as `after`.
+
+    Keyset pagination keeps every page an index range scan instead of a growing skip.
+
+    Returns:
+        dict: {"items": [...], "next": cursor for the next page or None}.
+    """
+    query = {}
+    if after:
+        query["_id"] = {"$gt": ObjectId(after) if ObjectId.is_valid(after) else after}
+    projection = dict.fromkeys(fields, 1) if fields else None
+    docs = list(collection.find(query, projection).sort([("_id", 1)]).limit(limit + 1))
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    return {"items": serialize_cursor(docs), "next": str(docs[-1]["_id"]) if has_more else None}
+
 @app.route("/")
 def index():
     logging.info("Accessed index page")
     return render_template("index.html")
 
-def get_folder_structure(path):
-    logging.info(f"Getting folder structure for: {path}")
-    folder_dict = {"name": os.path.basename(path), "type": "folder", "children": []}
-    try:
-        for entry in os.listdir(path):
-            full_path = os.path.join(path, entry)
-            if os.path.isdir(full_path):
-                folder_dict["children"].append(get_folder_structure(full_path))
-            else:
-                folder_dict["children"].append({"name": entry, "type": "file"})
-    except Exception as e:
-        logging.error(f"Error reading folder structure: {e}")
-        folder_dict["error"] = str(e)
+def get_folder_structure(path, subpath="", max_depth=FOLDER_SCAN_DEPTH):
+    logging.info(f"Getting folder structure for: {path} {subpath}".rstrip())
+    folder_dict = folder_scanner.scan(path, subpath, max_depth)
+    if folder_dict.get("error"):
+        logging.error(f"Error reading folder structure: {folder_dict['error']}")
     return folder_dict
 
+def resolve_repo(full_url):
+    """
+    Resolves a repository URL to its branch, sub-directory and current commit.
+
+    Returns:
+        tuple: (spec, None) or (None, error message).
+    """
+    try:
+        return repo_manager.resolve(full_url), None
+    except (GitError, ValueError) as e:
+        logging.error(f"Resolving {full_url} failed: {e}")
+        return None, str(e)
+
 def clone_repo_and_get_subpath(full_url):
-    logging.info(f"Cloning repo from: {full_url}")
-    match = re.match(r"https://github\.com/([^/]+/[^/]+)(/tree/([^/]+)(/.+)?)?", full_url)
-    if not match:
-        return None, None, "Invalid GitHub URL format"
-
-    repo_path = match.group(1)
-    branch = match.group(3) if match.group(3) else "master"
-    subdir = match.group(4)[1:] if match.group(4) else ""
-
-    repo_url = f"https://github.com/{repo_path}.git"
-    repo_name = repo_path.split("/")[-1]
-    repo_dir = os.path.join(BASE_TEMP_DIR, repo_name)
-
-    if not os.path.exists(repo_dir):
-        try:
-            subprocess.run(["git", "clone", "-b", branch, "--depth", "1", repo_url, repo_dir], check=True)
-            logging.info(f"Repo cloned to: {repo_dir}")
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Git clone failed: {e}")
-            return None, None, f"Git clone failed: {str(e)}"
-
-    final_path = os.path.join(repo_dir, subdir)
-    if not os.path.exists(final_path):
-        logging.warning(f"Subpath '{subdir}' does not exist in repo")
-        return None, None, f"Subpath '{subdir}' does not exist in repo"
-
-    return final_path, repo_dir, None
+    """
+    Checks out the commit (and sub-directory) a repository URL currently points to.
+
+    Returns:
+        tuple: (local path, spec, None) or (None, None, error message).
+    """
+    spec, err = resolve_repo(full_url)
+    if err:
+        return None, None, err
+    try:
+        final_path = repo_manager.checkout(spec)
+    except GitError as e:
+        logging.error(f"Checkout of {full_url} failed: {e}")
+        return None, None, str(e)
+    logging.info(f"{full_url} checked out at {spec['commit'][:12]} in {final_path}")
+    return final_path, spec, None
+
+def analysis_cache_key(path, spec=None):
+    # Remote analyses are keyed by commit, so a new push is analyzed again
+    if spec is not None:
+        return f"analysis:{spec['remote']}@{spec['commit']}:{spec['subdir']}"
+    return f"analysis:{path}"
 
 @app.route("/fetch", methods=["POST"])
 def fetch_structure():
     path = request.form["repo_path"]
+    max_depth = request.form.get("depth", FOLDER_SCAN_DEPTH, type=int)
     logging.info(f"Fetching structure for: {path}")
 
-    if path.startswith("http://") or path.startswith("https://"):
+    if is_remote(path):
         subpath, _, err = clone_repo_and_get_subpath(path)
         if err:
             logging.error(f"Fetch error: {err}")
             return jsonify({"error": err}), 400
-        folder_tree = get_folder_structure(subpath)
+        root = subpath
     else:
-        folder_tree = get_folder_structure(path)
+        root = path
 
-    return jsonify({"structure": folder_tree})
+    folder_tree = get_folder_structure(root, max_depth=max_depth)
+    # Folders cut off by the depth limit are expanded through /fetch/subtree with this root
+    return jsonify({"structure": folder_tree, "root": root})
+
+@app.route("/fetch/subtree")
+def fetch_subtree():
+    root = request.args.get("root", "")
+    subpath = request.args.get("path", "")
+    max_depth = request.args.get("depth", FOLDER_SCAN_DEPTH, type=int)
+    if not os.path.isdir(root):
+        return jsonify({"error": f"Path '{root}' does not exist"}), 400
+    try:
+        return jsonify({"structure": get_folder_structure(root, subpath, max_depth), "root": root})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+def run_analysis_job(path, incremental=False, resume=False, progress=None, spec=None):
+    """
+    Background job body: checks out `spec` (as resolved from a repository URL)
+    if given, runs the analysis and caches the result.
+    """
+    if spec is None:
+        return _analyze_path(path, path, incremental, resume, progress)
+    # The checkout can't be evicted while it's being analyzed
+    with repo_manager.lease(spec) as final_path:
+        return _analyze_path(path, final_path, incremental, resume, progress, spec)
+
+def _analyze_path(path, final_path, incremental, resume, progress, spec=None):
+    # A repository's stored analysis is kept per branch, so each new commit updates it
+    project = project_key(spec) if spec is not None else final_path
+    resume_run_id = None
+    if resume:
+        resume_run_id = find_resumable_run(project)
+        if resume_run_id is None:
+            raise ValueError(f"No interrupted run to resume for '{path}'")
+
+    json_path, result = run_analysis(final_path, incremental=incremental, progress=progress,
+                                     resume_run_id=resume_run_id, project_key=project,
+                                     commit=spec["commit"] if spec is not None else None)
+    logging.info(f"Analysis complete. Result at: {json_path}")
+
+    # Only the location and overview are kept; file entries are served page by page from /summary
+    summary = {
+        "json_path": json_path,
+        "ndjson_path": ndjson_path(json_path),
+        "project_overview": result["project_overview"]
+    }
+    redis_client().set(analysis_cache_key(path, spec), compress_value(json.dumps(summary)))
+
+    return summary
 
 @app.route("/analyze", methods=["POST"])
 def analyze():
     path = request.json["repo_path"]
-    logging.info(f"Analyzing: {path}")
-    cache_key = f"analysis:{path}"
+    incremental = bool(request.json.get("incremental", False))
+    resume = bool(request.json.get("resume", False))
+    logging.info(f"Analyzing: {path} (incremental={incremental}, resume={resume})")
 
-    cached_result = redis_client.get(cache_key)
-    if cached_result:
-        logging.info("Returning cached result")
-        cached_data = json.loads(cached_result)
-        return jsonify({
-            "status": "cached",
-            "json_path": cached_data["json_path"],
-            "json_data": cached_data["json_data"]
-        })
-
-    if path.startswith("http://") or path.startswith("https://"):
-        final_path, _, err = clone_repo_and_get_subpath(path)
+    spec = None
+    if is_remote(path):
+        spec, err = resolve_repo(path)
         if err:
-            logging.error(f"Analysis error: {err}")
             return jsonify({"error": err}), 400
-    else:
-        final_path = path
-
-    if not os.path.exists(final_path):
-        msg = f"Path '{final_path}' does not exist"
+    elif not os.path.exists(path):
+        msg = f"Path '{path}' does not exist"
         logging.error(msg)
         return jsonify({"error": msg}), 400
+    cache_key = analysis_cache_key(path, spec)
+
+    # Incremental and resumed runs exist to pick up new work, so they never reuse the cached summary
+    cached_result = None if incremental or resume else redis_client().get(cache_key)
+    if cached_result:
+        cached_data = json.loads(decompress_value(cached_result))
+        # Entries cached before summaries were paginated hold the whole result, and
+        # summaries of evicted checkouts are gone; analyze again
+        if "ndjson_path" in cached_data and os.path.exists(cached_data["ndjson_path"]):
+            logging.info("Returning cached result")
+            return jsonify(dict(cached_data, status="cached"))
+
+    # Concurrent requests for the same project (any commit of the same branch) join the job already in
+    # flight, since runs of one project must not overlap
+    flight_key = f"analysis:{project_key(spec)}" if spec is not None else cache_key
+    job_id, joined = job_manager.submit_once(flight_key, run_analysis_job, path, incremental=incremental,
+                                             resume=resume, spec=spec)
+    if joined:
+        logging.info(f"Joined analysis job {job_id} already in flight for {path}")
+    else:
+        logging.info(f"Queued analysis job {job_id} for {path}")
+
+    return jsonify({"status": "queued", "job_id": job_id, "joined": joined}), 202
+
+def job_summary(record):
+    """Job record without the per-file progress map, which can be large."""
+    summary = dict(record)
+    if summary.get("progress"):
+        summary["progress"] = {k: v for k, v in summary["progress"].items() if k != "files"}
+    return summary
 
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    record = job_manager.get(job_id)
+    if record is None:
+        return jsonify({"error": f"Unknown job '{job_id}'"}), 404
+    return jsonify(job_summary(record))
+
+@app.route("/jobs/<job_id>/files")
+def job_files(job_id):
+    record = job_manager.get(job_id)
+    if record is None:
+        return jsonify({"error": f"Unknown job '{job_id}'"}), 404
+    progress = record.get("progress") or {}
+    return jsonify({"job_id": job_id, "state": record["state"], "files": progress.get("files", {})})
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    logging.warning(f"Cancelling job {job_id}")
+    record = job_manager.cancel(job_id)
+    if record is None:
+        return jsonify({"error": f"Unknown job '{job_id}'"}), 404
+    return jsonify(job_summary(record))
+
+@app.route("/health")
+def health_check():
+    status = health()
+    return jsonify(status), 200 if status["ok"] else 503
+
+@app.route("/metrics")
+def metrics():
+    return Response(REGISTRY.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/runs/<run_id>/metrics")
+def run_metrics(run_id):
+    run = runs().find_one({"_id": run_id}, {"metrics": 1, "status": 1})
+    if run is None:
+        return jsonify({"error": f"Unknown run '{run_id}'"}), 404
+    return jsonify({"run_id": run_id, "status": run.get("status"), "metrics": run.get("metrics")})
+
+@app.route("/summary")
+def summary_page():
+    path = request.args.get("path", "")
+    if path.endswith(".json"):
+        path = ndjson_path(path)
+    if os.path.basename(path) != "final_summary.ndjson" or not os.path.isfile(path):
+        return jsonify({"error": f"No analysis summary at '{path}'"}), 404
     try:
-        json_path, result = run_analysis(final_path)
-        logging.info(f"Analysis complete. Result at: {json_path}")
-    except Exception as e:
-        logging.exception("Analysis failed")
-        return jsonify({"error": str(e)}), 500
+        cursor = request.args.get("cursor", type=int)
+        page = read_ndjson_page(path, cursor, request.args.get("limit", 100, type=int))
+    except (ValueError, OSError) as e:
+        return jsonify({"error": f"Invalid cursor: {e}"}), 400
+    return jsonify(page)
 
-    redis_client.set(cache_key, json.dumps({
-        "json_path": json_path,
-        "json_data": result
-    }))
+@app.route("/search")
+def search():
+    """Top-k files, classes and methods of an analyzed project matching `q`."""
+    path = request.args.get("path", "")
+    query = request.args.get("q", "").strip()
+    if os.path.basename(path).startswith("final_summary."):
+        path = os.path.dirname(path)  # The summary's path identifies its project too
+    if not query:
+        return jsonify({"error": "Missing query 'q'"}), 400
+    k = max(1, min(request.args.get("k", DEFAULT_SEARCH_RESULTS, type=int), MAX_SEARCH_RESULTS))
 
-    return jsonify({
-        "status": "complete",
-        "json_path": json_path,
-        "json_data": result
-    })
+    # A checkout directory stands for the project (branch) last analyzed in it
+    project = project_for_root(path)
+    # Built from the stored results on first use, e.g. after a restart
+    index = search_index.get(project)
+    if index is None and analysis_results().find_one({"project": project}, {"_id": 1}) is not None:
+        index = search_index.load(project, functools.partial(load_search_entries, project))
+    if index is None or not len(index):
+        return jsonify({"error": f"No analysis results for '{path}'"}), 404
+    started = time.perf_counter()
+    try:
+        hits = index.search(query, k, request.args.get("mode"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"query": query, "hits": hits, "took_ms": round((time.perf_counter() - started) * 1000, 2)})
+
+@app.route("/db/<name>")
+def db_page(name):
+    collection = PAGEABLE_COLLECTIONS.get(name)
+    if collection is None:
+        return jsonify({"error": f"Unknown collection '{name}'"}), 404
+    limit = max(1, min(request.args.get("limit", DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    fields = [f for f in request.args.get("fields", "").split(",") if f]
+    return jsonify(collection_page(collection(), limit, request.args.get("after"), fields))
 
 @app.route("/download_json")
 def download_json():
@@ -167,20 +360,25 @@ def download_json():
 
 @app.route("/refresh_db")
 def refresh_db():
+    """First page of each collection; use /db/<collection>?after=<next> for the rest."""
     logging.info("Refreshing database data")
-    return jsonify({
-        "codebase_files": serialize_cursor(codebase_files.find()),
-        "chunks": serialize_cursor(chunks.find()),
-        "analysis_results": serialize_cursor(analysis_results.find())
-    })
+    pages = {name: collection_page(PAGEABLE_COLLECTIONS[name]())
+             for name in ("codebase_files", "chunks", "analysis_results")}
+    response = {name: page["items"] for name, page in pages.items()}
+    response["next"] = {name: page["next"] for name, page in pages.items()}
+    return jsonify(response)
 
 @app.route("/clear_db", methods=["POST"])
 def clear_db():
     logging.warning("Clearing MongoDB and Redis")
-    codebase_files.delete_many({})
-    chunks.delete_many({})
-    analysis_results.delete_many({})
-    redis_client.flushdb()
+    codebase_files().delete_many({})
+    chunks().delete_many({})
+    analysis_results().delete_many({})
+    file_contents().delete_many({})
+    # Without the runs, a later resume can't pick up a run whose chunks are gone
+    runs().delete_many({})
+    redis_client().flushdb()
+    search_index.clear()
     return jsonify({"status": "cleared"})
 
 if __name__ == "__main__":
@@ -0,0 +1,389 @@
+"""
+Offline benchmarks for the analysis pipeline. No OpenAI key, MongoDB or Redis needed.
+
+Usage:
+    python benchmark.py concurrency --chunks 200 --latency 0.05 --levels 1,2,4,8,16
+    python benchmark.py chunking --corpus path/to/repo
+    python benchmark.py summary --files 5000 --dirs 200
+    python benchmark.py e2e --files 200 --lines 200 --latency 0.05 --failure-rate 0.02
+    python benchmark.py startup --repeat 5
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from scheduler import run_ordered, PROMPT_OVERHEAD_TOKENS
+from chunker import chunk_code, code_units, count_tokens
+from code_loader import iter_code_files
+from summarizer import HierarchicalSummarizer, SUMMARY_MAX_PROMPT_TOKENS
+
+
+def bench_concurrency(num_chunks, latency, levels):
+    """
+    Measures chunk throughput of `run_ordered` for each concurrency level, with
+    `offline.FakeLLM` answering the chunk prompts after a fixed `latency`.
+
+    Returns:
+        list: One dict per level with wall time and chunks per second.
+    """
+    from offline import FakeLLM
+    from llm_analyzer import prompt_template
+
+    jobs = [{"filename": f"file_{i}.py", "chunk": f"print({i})\n" * 20} for i in range(num_chunks)]
+    report = []
+
+    for level in levels:
+        llm = FakeLLM(latency)
+        start = time.perf_counter()
+        results = [result for _, result in run_ordered(
+            jobs, lambda job: llm.invoke(prompt_template.format(filename=job["filename"], code_chunk=job["chunk"])),
+            max_in_flight=level)]
+        elapsed = time.perf_counter() - start
+
+        # Results must come back in submission order regardless of concurrency
+        assert [json.loads(r)["filename"] for r in results] == [j["filename"] for j in jobs]
+
+        report.append({
+            "max_in_flight": level,
+            "wall_time_s": round(elapsed, 3),
+            "chunks_per_s": round(num_chunks / elapsed, 1)
+        })
+
+    return report
+
+
+def _legacy_chunks(text):
+    """The previous fixed-size splitter: 2,000 characters with 200 overlap."""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200,
+                                              separators=["\n\n", "\n", " ", ""])
+    return splitter.split_text(text)
+
+
+def _split_units(text, units, chunk_texts):
+    """
+    Counts the units (classes/functions/methods) that don't fit entirely inside one chunk.
+    """
+    spans = []
+    cursor = 0
+    for chunk in chunk_texts:
+        start = text.find(chunk, max(0, cursor - len(chunk)))
+        if start < 0:
+            start = cursor
+        spans.append((start, start + len(chunk)))
+        cursor = start + len(chunk)
+    return sum(1 for lo, hi in units if not any(s <= lo and hi <= e for s, e in spans))
+
+
+def bench_chunking(corpus):
+    """
+    Compares the token-aware chunker with the legacy character splitter on a corpus.
+
+    Returns:
+        dict: Chunk count, total billed tokens (chunk + prompt overhead) and the
+              rate of split units, per chunker.
+    """
+    chunkers = {"token_aware": lambda text, filename: chunk_code(text, filename)}
+    try:
+        _legacy_chunks("")
+        chunkers["legacy_2000_chars"] = lambda text, filename: _legacy_chunks(text)
+    except ImportError:
+        print("[WARN] langchain not installed, skipping the legacy splitter")
+
+    report = {name: {"chunks": 0, "tokens": 0, "units": 0, "split_units": 0} for name in chunkers}
+    for file in iter_code_files(corpus):
+        units = code_units(file["content"], file["filename"])
+        for name, chunker in chunkers.items():
+            chunk_texts = chunker(file["content"], file["filename"])
+            row = report[name]
+            row["chunks"] += len(chunk_texts)
+            row["tokens"] += sum(count_tokens(c) + PROMPT_OVERHEAD_TOKENS for c in chunk_texts)
+            row["units"] += len(units)
+            row["split_units"] += _split_units(file["content"], units, chunk_texts)
+
+    for row in report.values():
+        row["split_rate"] = round(row["split_units"] / row["units"], 3) if row["units"] else 0.0
+    return report
+
+
+class RecordingLLM:
+    """
+    Stub chat model for the summarizer that records the token size of every prompt.
+    """
+
+    def __init__(self):
+        self.prompt_tokens = []
+
+    def invoke(self, prompt):
+        self.prompt_tokens.append(count_tokens(prompt))
+        return "Synthetic summary of this part of the codebase."
+
+
+def bench_summary(num_files, num_dirs, max_prompt_tokens=SUMMARY_MAX_PROMPT_TOKENS):
+    """
+    Runs the hierarchical project summary over synthetic file entries.
+
+    Returns:
+        dict: Number of LLM calls and the largest and total prompt sizes.
+    """
+    files = [{
+        "filename": f"module_{i}.py",
+        "file_path": f"pkg_{i % num_dirs // 10}/sub_{i % num_dirs}/module_{i}.py",
+        "description": f"Handles part {i} of the domain logic.",
+        "classes": [{"name": f"Service{i}", "description": "Coordinates requests for this module.",
+                     "methods": [{"description": f"Processes item {j} and persists the outcome."}
+                                 for j in range(5)]}]
+    } for i in range(num_files)]
+
+    llm = RecordingLLM()
+    start = time.perf_counter()
+    HierarchicalSummarizer(llm, max_prompt_tokens=max_prompt_tokens).summarize(files)
+    return {
+        "llm_calls": len(llm.prompt_tokens),
+        "max_prompt_tokens": max(llm.prompt_tokens),
+        "total_prompt_tokens": sum(llm.prompt_tokens),
+        "wall_time_s": round(time.perf_counter() - start, 3)
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def bench_e2e(num_files, lines_per_file, languages, latency, failure_rate, max_in_flight=None, seed=0,
+              rate_limit_rate=0.0, timeout_rate=0.0, capacity=None, malformed_rate=0.0):
+    """
+    Runs `run_analysis` end to end on a synthetic repository, with `offline.FakeLLM`
+    and in-memory MongoDB/Redis stand-ins. The fake model can inject 429s and
+    timeouts (`rate_limit_rate`, `timeout_rate`) and rate limit calls above a
+    concurrency `capacity`, to exercise the adaptive limiter, and return malformed
+    JSON (`malformed_rate`) to exercise output repair.
+
+    Returns:
+        dict: Wall time, chunk throughput, LLM calls and latency, DB round-trips and peak RSS.
+    """
+    from offline import FakeLLM, offline_services, synthetic_repo
+    from main import run_analysis
+    from metrics import RunMetrics
+    from scheduler import AdaptiveLimiter, MAX_IN_FLIGHT
+
+    llm = FakeLLM(latency=latency, failure_rate=failure_rate, seed=seed, rate_limit_rate=rate_limit_rate,
+                  timeout_rate=timeout_rate, capacity=capacity, malformed_rate=malformed_rate)
+    limiter = AdaptiveLimiter(max_limit=max_in_flight or MAX_IN_FLIGHT)
+    metrics = RunMetrics(registry=None)
+    with tempfile.TemporaryDirectory() as repo:
+        synthetic_repo(repo, num_files, lines_per_file, languages, seed=seed)
+        with offline_services(llm) as (database, redis_client):
+            start = time.perf_counter()
+            run_analysis(repo, max_in_flight=max_in_flight, metrics=metrics, limiter=limiter)
+            elapsed = time.perf_counter() - start
+
+    report = metrics.report()
+    latency_stats = report["observations"].get("llm_latency_seconds", {})
+    chunks = metrics.counter("chunks_analyzed") + metrics.counter("chunks_failed")
+    return {
+        "wall_time_s": round(elapsed, 3),
+        "chunks": chunks,
+        "chunks_per_s": round(chunks / elapsed, 1),
+        "chunks_failed": metrics.counter("chunks_failed"),
+        "llm_calls": llm.calls,
+        "llm_failures": llm.failures,
+        "llm_rate_limited": llm.rate_limited,
+        "llm_timeouts": llm.timeouts,
+        "chunks_deferred": metrics.counter("chunks_deferred"),
+        "llm_malformed": llm.malformed,
+        "parse_repaired": metrics.counter("parse_repaired"),
+        "parse_reasked": metrics.counter("parse_reasked"),
+        "json_parse_failures": metrics.counter("json_parse_failures"),
+        "final_concurrency_limit": round(limiter.limit, 2),
+        "llm_p50_s": latency_stats.get("p50"),
+        "llm_p99_s": latency_stats.get("p99"),
+        "db_round_trips": database.round_trips,
+        "redis_round_trips": redis_client.round_trips,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": {stage: row["seconds"] for stage, row in report["stages"].items()}
+    }
+
+
+# Tracked results and whether a higher value is worse (1) or better (-1)
+TRACKED_RESULTS = {"wall_time_s": 1, "chunks_per_s": -1, "peak_rss_mb": 1, "db_round_trips": 1}
+
+# Number of previous runs with the same parameters the new result is compared to
+BASELINE_RUNS = 5
+
+# The repository root: subprocesses run there, wherever the benchmark was started from
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                             cwd=REPO_DIR)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def find_regressions(history_path, params, results, tolerance):
+    """
+    Compares `results` with the median of the last runs recorded with the same `params`.
+
+    Returns:
+        list: One message per tracked result that got worse by more than `tolerance` (a fraction).
+    """
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path, encoding="utf-8") as f:
+        previous = [entry for entry in map(json.loads, filter(str.strip, f)) if entry["params"] == params]
+    previous = previous[-BASELINE_RUNS:]
+    if not previous:
+        return []
+
+    regressions = []
+    for name, direction in TRACKED_RESULTS.items():
+        baseline = statistics.median(entry["results"][name] for entry in previous)
+        change = (results[name] - baseline) / baseline if baseline else 0.0
+        if change * direction > tolerance:
+            regressions.append(f"{name}: {results[name]} vs baseline {baseline} ({change:+.1%})")
+    return regressions
+
+
+def record_history(history_path, params, results):
+    """Appends one benchmark result to the JSON Lines history file."""
+    entry = {"timestamp": time.time(), "commit": _git_commit(), "params": params, "results": results}
+    with open(history_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+# Run in a fresh interpreter so nothing is already imported
+_STARTUP_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter() - start
+first_request = None
+if {serve}:
+    {module}.app.test_client().get("/")
+    first_request = time.perf_counter() - start
+print(json.dumps({{"import_s": imported, "first_request_s": first_request,
+                  "langchain_loaded": any(m.startswith("langchain") for m in sys.modules)}}))
+"""
+
+
+def bench_startup(modules, repeat):
+    """
+    Measures the import time of each module in fresh interpreters and, for `app`,
+    the cold start up to the first served request.
+
+    Returns:
+        dict: Per module, the median import and first-request times over `repeat`
+              runs and whether importing it loaded LangChain.
+    """
+    report = {}
+    for module in modules:
+        samples = []
+        for _ in range(repeat):
+            probe = _STARTUP_PROBE.format(module=module, serve=module == "app")
+            # The probe imports the app's modules, which are only importable from the repository root
+            out = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True,
+                                 cwd=REPO_DIR)
+            samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        first_requests = [s["first_request_s"] for s in samples if s["first_request_s"] is not None]
+        report[module] = {
+            "import_s": round(statistics.median(s["import_s"] for s in samples), 3),
+            "first_request_s": round(statistics.median(first_requests), 3) if first_requests else None,
+            "langchain_loaded": any(s["langchain_loaded"] for s in samples)
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    conc = sub.add_parser("concurrency", help="Throughput of concurrent chunk analysis")
+    conc.add_argument("--chunks", type=int, default=200)
+    conc.add_argument("--latency", type=float, default=0.05, help="Fake LLM latency per call (s)")
+    conc.add_argument("--levels", default="1,2,4,8,16", help="Comma-separated max-in-flight values")
+
+    chunking = sub.add_parser("chunking", help="Chunk count, tokens and split-method rate per chunker")
+    chunking.add_argument("--corpus", default=".", help="Directory of source files to chunk")
+
+    summary = sub.add_parser("summary", help="Prompt sizes of the hierarchical project summary")
+    summary.add_argument("--files", type=int, default=5000)
+    summary.add_argument("--dirs", type=int, default=200)
+    summary.add_argument("--max-prompt-tokens", type=int, default=SUMMARY_MAX_PROMPT_TOKENS)
+
+    e2e = sub.add_parser("e2e", help="End-to-end run_analysis on a synthetic repo with offline services")
+    e2e.add_argument("--files", type=int, default=200)
+    e2e.add_argument("--lines", type=int, default=200, help="Lines per synthetic file")
+    e2e.add_argument("--languages", default="py,java,js", help="Comma-separated extensions (py, java, js)")
+    e2e.add_argument("--latency", type=float, default=0.05, help="Fake LLM latency per call (s)")
+    e2e.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of fake LLM calls that fail")
+    e2e.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of fake LLM calls answered with a 429")
+    e2e.add_argument("--timeout-rate", type=float, default=0.0, help="Fraction of fake LLM calls that time out")
+    e2e.add_argument("--capacity", type=int, default=None,
+                     help="Concurrent fake LLM calls above which calls are answered with a 429")
+    e2e.add_argument("--malformed-rate", type=float, default=0.0,
+                     help="Fraction of fake LLM analyses returned as malformed JSON")
+    e2e.add_argument("--max-in-flight", type=int, default=None)
+    e2e.add_argument("--seed", type=int, default=0)
+    e2e.add_argument("--history", default="benchmark_history.jsonl", help="JSON Lines file of past results")
+    e2e.add_argument("--tolerance", type=float, default=0.15, help="Allowed slowdown before failing (fraction)")
+    e2e.add_argument("--no-record", action="store_true", help="Don't append this result to the history")
+
+    startup = sub.add_parser("startup", help="Import time and cold start in fresh interpreters")
+    startup.add_argument("--modules", default="llm_analyzer,main,app", help="Comma-separated modules to import")
+    startup.add_argument("--repeat", type=int, default=5)
+
+    args = parser.parse_args()
+
+    if args.command == "concurrency":
+        levels = [int(x) for x in args.levels.split(",")]
+        for row in bench_concurrency(args.chunks, args.latency, levels):
+            print(f"max_in_flight={row['max_in_flight']:>3}  "
+                  f"wall={row['wall_time_s']:>7.3f}s  throughput={row['chunks_per_s']:>7.1f} chunks/s")
+    elif args.command == "chunking":
+        for name, row in bench_chunking(args.corpus).items():
+            print(f"{name:<18} chunks={row['chunks']:>6}  tokens={row['tokens']:>9}  "
+                  f"split_units={row['split_units']}/{row['units']} ({row['split_rate']:.1%})")
+    elif args.command == "summary":
+        row = bench_summary(args.files, args.dirs, args.max_prompt_tokens)
+        print(f"llm_calls={row['llm_calls']}  max_prompt_tokens={row['max_prompt_tokens']} "
+              f"(limit {args.max_prompt_tokens})  total_prompt_tokens={row['total_prompt_tokens']}  "
+              f"wall={row['wall_time_s']}s")
+    elif args.command == "e2e":
+        params = {"files": args.files, "lines": args.lines, "languages": args.languages, "latency": args.latency,
+                  "failure_rate": args.failure_rate, "max_in_flight": args.max_in_flight, "seed": args.seed,
+                  "rate_limit_rate": args.rate_limit_rate, "timeout_rate": args.timeout_rate,
+                  "capacity": args.capacity, "malformed_rate": args.malformed_rate}
+        row = bench_e2e(args.files, args.lines, args.languages.split(","), args.latency, args.failure_rate,
+                        args.max_in_flight, args.seed, args.rate_limit_rate, args.timeout_rate, args.capacity,
+                        args.malformed_rate)
+        print(json.dumps(row, indent=2))
+
+        regressions = find_regressions(args.history, params, row, args.tolerance)
+        if not args.no_record:
+            record_history(args.history, params, row)
+        for message in regressions:
+            print(f"[REGRESSION] {message}")
+        if regressions:
+            sys.exit(1)
+    elif args.command == "startup":
+        for module, row in bench_startup(args.modules.split(","), args.repeat).items():
+            first_request = f"{row['first_request_s']:.3f}s" if row["first_request_s"] is not None else "-"
+            print(f"{module:<14} import={row['import_s']:.3f}s  first_request={first_request}  "
+                  f"langchain_loaded={row['langchain_loaded']}")
+
+
+if __name__ == "__main__":
+    main()
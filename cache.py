@@ -1,45 +1,291 @@
 import redis  # Redis library for connecting to a Redis server
-import os 
-from dotenv import load_dotenv  
-import json  
+import os
+from dotenv import load_dotenv
+import base64
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import services
 
 # Load environment variables from a .env file
 load_dotenv()
 
-# Establish a connection to the Redis server
-# Redis is an in-memory data store used here for caching purposes
-redis_client = redis.StrictRedis(
-    host=os.getenv("REDIS_HOST", "localhost"),  # Host of the Redis server (default to localhost)
-    port=6379,  # Default Redis port
-    db=0,  # Default database index (Redis has multiple databases, 0 is the default one)
-    decode_responses=True  # Automatically decode responses from Redis as strings
-)
+# Chunk cache settings
+CHUNK_CACHE_BACKEND = os.getenv("CHUNK_CACHE_BACKEND", "redis")  # redis | memory | disk | none
+CHUNK_CACHE_TTL = int(os.getenv("CHUNK_CACHE_TTL", str(7 * 24 * 3600)))  # Seconds, 0 = never expire
+CHUNK_CACHE_MAX_ENTRIES = int(os.getenv("CHUNK_CACHE_MAX_ENTRIES", "100000"))  # LRU bound for memory/disk
+CHUNK_CACHE_DIR = os.getenv("CHUNK_CACHE_DIR", os.path.join(os.getcwd(), "cache"))
+# Share of CHUNK_CACHE_MAX_ENTRIES the disk cache evicts beyond the bound, so it rescans its directory rarely
+CHUNK_CACHE_EVICT_HEADROOM = float(os.getenv("CHUNK_CACHE_EVICT_HEADROOM", "0.1"))
+# Values at least this many characters long are stored gzip-compressed (0 disables compression)
+CACHE_COMPRESS_MIN_SIZE = int(os.getenv("CACHE_COMPRESS_MIN_SIZE", "512"))
+
+_COMPRESSED_PREFIX = "gz:"
 
-# Function to cache the result of a code analysis in Redis
-def cache_result(chunk_id, result):
+
+def compress_value(value, min_size=CACHE_COMPRESS_MIN_SIZE):
     """
-    Caches the analysis result for a given code chunk.
+    Gzips `value` if it's at least `min_size` characters long.
 
-    Args:
-        chunk_id (str): The identifier for the code chunk.
-        result (dict): The analysis result in JSON format (a dictionary).
+    The compressed bytes are base64-encoded behind a "gz:" marker, so entries stay
+    text and work with Redis clients that decode responses. Raw JSON never starts
+    with the marker, so uncompressed entries written earlier are still readable.
     """
-    # Store the result in Redis, with the key being "analysis:{chunk_id}" and the value being the JSON-encoded result
-    redis_client.set(f"analysis:{chunk_id}", json.dumps(result))
+    if not min_size or len(value) < min_size:
+        return value
+    packed = gzip.compress(value.encode("utf-8"), compresslevel=6)
+    return _COMPRESSED_PREFIX + base64.b64encode(packed).decode("ascii")
+
+
+def decompress_value(value):
+    """Reverses `compress_value`; other values are returned unchanged."""
+    if value is None or not value.startswith(_COMPRESSED_PREFIX):
+        return value
+    return gzip.decompress(base64.b64decode(value[len(_COMPRESSED_PREFIX):], validate=True)).decode("utf-8")
+
 
-# Function to retrieve the cached result from Redis
-def get_cached_result(chunk_id):
+def chunk_cache_key(prompt_template, model_name, code_chunk):
     """
-    Retrieves the cached analysis result for a given code chunk.
+    Builds a content-addressed cache key for a chunk analysis.
+
+    The key only depends on what the model actually sees, so moving or renaming
+    a file doesn't invalidate its cached results.
 
     Args:
-        chunk_id (str): The identifier for the code chunk.
+        prompt_template (str): The raw prompt template text.
+        model_name (str): The LLM model name.
+        code_chunk (str): The chunk of source code.
 
     Returns:
-        dict or None: The cached analysis result (as a dictionary), or None if no cached result exists.
+        str: The cache key, e.g. "chunk:<sha256>".
+    """
+    digest = hashlib.sha256()
+    for part in (prompt_template, model_name, code_chunk):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")  # Separator so ("ab", "c") and ("a", "bc") differ
+    return f"chunk:{digest.hexdigest()}"
+
+
+class RedisCacheBackend:
+    """
+    Stores cache entries in Redis, relying on key expiry for the TTL. Uses the
+    shared client from `services` unless one is given.
+    """
+
+    def __init__(self, client=None, ttl=CHUNK_CACHE_TTL):
+        self._client = client
+        self.ttl = ttl
+
+    @property
+    def client(self):
+        return self._client if self._client is not None else services.redis_client()
+
+    def get(self, key):
+        try:
+            return self.client.get(key)
+        except redis.RedisError as e:
+            # A cache outage should never fail the analysis, only make it slower
+            print(f"[WARN] Redis cache read failed: {e}")
+            return None
+
+    def set(self, key, value):
+        try:
+            self.client.set(key, value, ex=self.ttl or None)
+        except redis.RedisError as e:
+            print(f"[WARN] Redis cache write failed: {e}")
+
+    def delete(self, key):
+        try:
+            self.client.delete(key)
+        except redis.RedisError as e:
+            print(f"[WARN] Redis cache delete failed: {e}")
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache with TTL, suitable for tests and single-process runs."""
+
+    def __init__(self, max_entries=CHUNK_CACHE_MAX_ENTRIES, ttl=CHUNK_CACHE_TTL, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, value), oldest first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = self._clock() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class DiskCacheBackend:
+    """
+    Stores one file per entry under `directory`. File mtimes double as the LRU
+    clock: reads touch the file, and once writes take the entry count past
+    `max_entries` the least recently used entries are evicted, down to
+    `headroom` below the bound.
+
+    The entry count is kept in memory (counted once, on the first write), so
+    the directory is only scanned when an eviction is due.
+    """
+
+    def __init__(self, directory=CHUNK_CACHE_DIR, max_entries=CHUNK_CACHE_MAX_ENTRIES, ttl=CHUNK_CACHE_TTL,
+                 headroom=CHUNK_CACHE_EVICT_HEADROOM):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.headroom = headroom
+        self._lock = threading.Lock()
+        self._count = None  # Entries on disk, counted on the first write
+        os.makedirs(directory, exist_ok=True)
+
+    def _entries(self):
+        return [e for e in os.scandir(self.directory) if e.name.endswith(".json")]
+
+    def _path(self, key):
+        return os.path.join(self.directory, key.replace(":", "_") + ".json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if self.ttl and time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                self._removed(1)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                value = f.read()
+            os.utime(path)  # Mark as recently used
+            return value
+        except OSError:
+            return None
+
+    def set(self, key, value):
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        added = not os.path.exists(path)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(value)
+        os.replace(tmp_path, path)  # Atomic so concurrent readers never see half a file
+        with self._lock:
+            if self._count is None:
+                self._count = len(self._entries())
+            elif added:
+                self._count += 1
+            if self._count > self.max_entries:
+                self._evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            return
+        self._removed(1)
+
+    def _removed(self, count):
+        with self._lock:
+            if self._count is not None:
+                self._count = max(0, self._count - count)
+
+    def _evict(self):
+        # Called with the lock held; the scan also corrects the count for other writers
+        entries = self._entries()
+        overflow = len(entries) - self.max_entries
+        if overflow > 0:
+            overflow += int(self.max_entries * self.headroom)
+            entries.sort(key=lambda e: e.stat().st_mtime)
+            for entry in entries[:overflow]:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+        self._count = len(entries) - max(0, overflow)
+
+
+class ChunkCache:
+    """
+    Caches raw LLM responses for chunks, counting hits and misses since the
+    process started (and per run, in the `metrics` passed to `get`).
+    Large entries are stored compressed (see `compress_value`).
+    """
+
+    def __init__(self, backend, compress_min_size=CACHE_COMPRESS_MIN_SIZE):
+        self.backend = backend
+        self.compress_min_size = compress_min_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, metrics=None):
+        """
+        Returns the cached analysis (raw JSON text) for `key`, or None.
+
+        Args:
+            metrics (RunMetrics): If given, the hit or miss is also counted there
+                ("cache_hits" / "cache_misses"), so concurrent runs keep separate counts.
+        """
+        value = None
+        if self.backend is not None:
+            try:
+                value = decompress_value(self.backend.get(key))
+            except (ValueError, OSError, EOFError) as e:
+                print(f"[WARN] Dropping corrupt cache entry {key}: {e}")
+                self.backend.delete(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if metrics is not None:
+            metrics.incr("cache_misses" if value is None else "cache_hits")
+        return value
+
+    def put(self, key, value):
+        """
+        Stores the raw JSON text of a successful analysis under `key`.
+        """
+        if self.backend is not None:
+            self.backend.set(key, compress_value(value, self.compress_min_size))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
+
+
+def build_chunk_cache(backend_name=CHUNK_CACHE_BACKEND):
+    """
+    Creates a ChunkCache for the given backend name ("redis", "memory", "disk" or "none").
     """
-    # Retrieve the cached result from Redis using the key "analysis:{chunk_id}"
-    cached = redis_client.get(f"analysis:{chunk_id}")
-    
-    # If a result is found, parse the JSON and return it; otherwise, return None
-    return json.loads(cached) if cached else None
+    if backend_name == "redis":
+        return ChunkCache(RedisCacheBackend())
+    if backend_name == "memory":
+        return ChunkCache(MemoryCacheBackend())
+    if backend_name == "disk":
+        return ChunkCache(DiskCacheBackend())
+    if backend_name == "none":
+        return ChunkCache(None)
+    raise ValueError(f"Unknown chunk cache backend: {backend_name}")
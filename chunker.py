@@ -1,26 +1,230 @@
-from langchain.text_splitter import RecursiveCharacterTextSplitter  # Importing the text splitter from Langchain
+import os
+import re
+import functools
+
+# Target size of a chunk, in model tokens. Units (classes, functions, methods) are
+# packed together up to this budget and only split when a single unit exceeds it.
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "1500"))
+
+# tiktoken encoding used to measure chunks (the one used by gpt-3.5-turbo)
+TOKEN_ENCODING = "cl100k_base"
+
+# Lines that start a class/function/method, per language, including one-line bodies (`void f() { g(); }`)
+_DECLARATION_PATTERNS = {
+    '.py': r'^\s*(?:async\s+def|def|class)\s+\w+',
+    '.rb': r'^\s*(?:def|class|module)\s+[\w:.]+',
+    '.java': r'^\s*(?:(?:public|private|protected|static|final|abstract|synchronized|native|default)\s+)*'
+             r'(?:(?:class|interface|enum|record)\s+\w+|(?!\s*(?:else|return|new|throw)\b)'
+             r'[\w<>\[\],.?\s]+\s+\w+\s*\((?:[^;]*$|[^;{]*\)[^;{]*\{.*\}\s*$))',
+    '.cs': r'^\s*(?:(?:public|private|protected|internal|static|sealed|abstract|virtual|override|async|partial|readonly)\s+)*'
+           r'(?:(?:class|interface|enum|struct|record)\s+\w+|(?!\s*(?:else|return|new|throw)\b)'
+           r'[\w<>\[\],.?\s]+\s+\w+\s*\((?:[^;]*$|[^;{]*\)[^;{]*\{.*\}\s*$))',
+    '.js': r'^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?(?:function\b|class\b)'
+           r'|^\s*(?:export\s+)?(?:const|let|var)\s+\w+\s*=\s*(?:async\s*)?(?:\([^)]*\)\s*=>|\w+\s*=>|function\b)'
+           r'|^\s*(?:static\s+)?(?:async\s+)?(?!if\b|for\b|while\b|switch\b|catch\b)\w+\s*\([^)]*\)\s*\{',
+    '.go': r'^(?:func|type)\s',
+    '.c': r'^(?!\s)(?!(?:if|for|while|switch|return|else)\b)[\w\*\s:<>,&~]+'
+          r'(?:\([^;]*\)\s*(?:const\s*)?\{?\s*$|\([^;{]*\)\s*(?:const\s*)?\{.*\}\s*$)'
+          r'|^\s*(?:class|struct|namespace)\s+\w+',
+    '.php': r'^\s*(?:(?:abstract|final|public|private|protected|static)\s+)*(?:function|class|interface|trait)\s+\w+',
+}
+_DECLARATION_PATTERNS['.ts'] = _DECLARATION_PATTERNS['.js']
+_DECLARATION_PATTERNS['.cpp'] = _DECLARATION_PATTERNS['.c']
+
+# Languages where nesting is expressed by indentation rather than braces
+_INDENT_LANGUAGES = {'.py', '.rb'}
+
+# Decorators, annotations and comments directly above a declaration belong to it
+_PREAMBLE_PATTERN = re.compile(r'^\s*(?:@|#|//|/\*|\*|///)')
+
+_STRIP_FOR_BRACES = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|//.*$')
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception:
+        # tiktoken may be missing or unable to fetch its vocabulary offline
+        return None
+
+
+def count_tokens(text):
+    """
+    Counts the model tokens in `text`, falling back to ~4 characters per token
+    when the tiktoken encoding is unavailable.
+    """
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def line_depths(lines, ext):
+    """
+    Returns the nesting depth at the start of each line: indentation levels for
+    Python/Ruby, brace depth for the C-family languages.
+    """
+    if ext in _INDENT_LANGUAGES:
+        widths = [len(line) - len(line.lstrip(" \t")) for line in lines if line.strip()]
+        unit = min((w for w in widths if w > 0), default=4)
+        return [(len(line) - len(line.lstrip(" \t"))) // unit for line in lines]
+
+    depths = []
+    depth = 0
+    for line in lines:
+        depths.append(depth)
+        code = _STRIP_FOR_BRACES.sub("", line)
+        depth = max(0, depth + code.count("{") - code.count("}"))
+    return depths
+
+
+def declarations(lines, ext, max_depth=1, depths=None):
+    """
+    Returns (line index, depth) of each line declaring a class/function/method
+    at most `max_depth` levels deep (None for any depth).
+    """
+    pattern = _DECLARATION_PATTERNS.get(ext)
+    if pattern is None:
+        return []
+
+    regex = re.compile(pattern)
+    if depths is None:
+        depths = line_depths(lines, ext)
+    return [(i, depths[i]) for i, line in enumerate(lines)
+            if (max_depth is None or depths[i] <= max_depth) and regex.match(line)]
+
+
+def _segment_starts(lines, ext):
+    """
+    Returns the line indexes where a top-level or member-level unit starts,
+    including the decorators/annotations/comments right above it.
+    """
+    starts = []
+    # Depth 0 is a top-level unit, depth 1 a member of a class/module
+    for i, _ in declarations(lines, ext):
+        start = i
+        while start > 0 and lines[start - 1].strip() and _PREAMBLE_PATTERN.match(lines[start - 1]):
+            start -= 1
+        if not starts or start > starts[-1]:
+            starts.append(start)
+    return starts
+
+
+def _segments(lines, ext):
+    """
+    Splits the file into consecutive line ranges, one per class/function/method
+    (the code before the first declaration forms its own segment).
+    """
+    boundaries = [0] + [s for s in _segment_starts(lines, ext) if s > 0] + [len(lines)]
+    return [(lo, hi) for lo, hi in zip(boundaries, boundaries[1:]) if hi > lo]
+
+
+def _split_oversized(lines, lo, hi, max_tokens):
+    """
+    Splits a single unit that doesn't fit in the budget, preferring blank lines
+    as break points and falling back to individual lines.
+    """
+    blocks = []
+    start = lo
+    for i in range(lo, hi):
+        if not lines[i].strip() and i > start:
+            blocks.append((start, i + 1))
+            start = i + 1
+    if start < hi:
+        blocks.append((start, hi))
+
+    pieces = []
+    for block_lo, block_hi in blocks:
+        if count_tokens("".join(lines[block_lo:block_hi])) <= max_tokens:
+            pieces.append((block_lo, block_hi))
+        else:
+            pieces.extend((i, i + 1) for i in range(block_lo, block_hi))
+    return _pack(lines, pieces, max_tokens)
+
+
+def _pack(lines, ranges, max_tokens):
+    """
+    Greedily merges consecutive line ranges while they fit in `max_tokens`.
+    """
+    packed = []
+    current_lo, current_hi, current_tokens = None, None, 0
+    for lo, hi in ranges:
+        tokens = count_tokens("".join(lines[lo:hi]))
+        if current_lo is not None and current_tokens + tokens <= max_tokens:
+            current_hi = hi
+            current_tokens += tokens
+            continue
+        if current_lo is not None:
+            packed.append((current_lo, current_hi))
+        current_lo, current_hi, current_tokens = lo, hi, tokens
+    if current_lo is not None:
+        packed.append((current_lo, current_hi))
+    return packed
+
+
+def chunk_spans(text, filename=None, max_tokens=CHUNK_MAX_TOKENS):
+    """
+    Computes chunk boundaries as (start, end) character offsets into `text`.
+
+    The file is cut into class/function/method units for the languages in
+    `code_loader.SUPPORTED_EXTENSIONS`, and consecutive units are packed together
+    up to `max_tokens`. Units are only split when one alone exceeds the budget.
+    Chunks don't overlap.
+
+    Args:
+        text (str): The source code.
+        filename (str): Used to pick the language from the extension.
+        max_tokens (int): Maximum size of a chunk in model tokens.
+
+    Returns:
+        list: (start, end) offsets of each chunk, in order.
+    """
+    if not text:
+        return []
+
+    lines = text.splitlines(keepends=True)
+    ext = os.path.splitext(filename or "")[1].lower()
+
+    ranges = []
+    for lo, hi in _segments(lines, ext):
+        if count_tokens("".join(lines[lo:hi])) > max_tokens:
+            ranges.extend(_split_oversized(lines, lo, hi, max_tokens))
+        else:
+            ranges.append((lo, hi))
+
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    return [(offsets[lo], offsets[hi]) for lo, hi in _pack(lines, ranges, max_tokens)]
+
+
+def code_units(text, filename):
+    """
+    Returns the (start, end) character offsets of each class/function/method unit.
+    Used to measure how often a chunker splits a unit across chunks.
+    """
+    lines = text.splitlines(keepends=True)
+    ext = os.path.splitext(filename)[1].lower()
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    starts = set(_segment_starts(lines, ext))
+    return [(offsets[lo], offsets[hi]) for lo, hi in _segments(lines, ext) if lo in starts]
+
 
 # Function to chunk the code into smaller parts for analysis
-def chunk_code(text, chunk_size=2000, chunk_overlap=200):
+def chunk_code(text, filename=None, max_tokens=CHUNK_MAX_TOKENS):
     """
-    Splits a large block of text (code) into smaller chunks of a specified size
-    with some overlap between consecutive chunks.
+    Splits a block of source code into token-bounded chunks along syntax boundaries.
 
     Args:
         text (str): The source code or text to be chunked.
-        chunk_size (int): The maximum size (in characters) of each chunk. Default is 2000.
-        chunk_overlap (int): The number of overlapping characters between consecutive chunks. Default is 200.
+        filename (str): The file name, used to detect the language.
+        max_tokens (int): The maximum size (in model tokens) of each chunk.
 
     Returns:
-        list: A list of text chunks with the specified size and overlap.
-    """
-    
-    # Initialize the RecursiveCharacterTextSplitter with the given parameters
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,  # Maximum size of each chunk
-        chunk_overlap=chunk_overlap,  # Number of characters to overlap between consecutive chunks
-        separators=["\n\n", "\n", " ", ""]  # Define the splitting points: prefer splitting at newlines, then spaces
-    )
-
-    # Use the splitter to divide the input text into chunks and return the result
-    return splitter.split_text(text)
+        list: A list of text chunks.
+    """
+    return [text[start:end] for start, end in chunk_spans(text, filename, max_tokens)]
@@ -1,4 +1,7 @@
-import os  
+import os
+import hashlib
+import mmap
+import fnmatch
 
 # Supported code file extensions. These are the types of files we want to process.
 SUPPORTED_EXTENSIONS = {'.py', '.java', '.js', '.ts', '.go', '.cpp', '.c', '.cs', '.rb', '.php'}
@@ -9,52 +12,238 @@ IGNORED_DIRS = {
     '.idea', '.vscode', 'build', 'dist', 'venv', 'env'  # IDE and virtual environment folders
 }
 
-def load_code_files(directory):
+# Files larger than this (in bytes) are skipped entirely; generated or vendored code is rarely worth analyzing
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", str(1024 * 1024)))
+
+# Files larger than this (in bytes) are memory-mapped instead of read into a buffer
+MMAP_THRESHOLD = int(os.getenv("MMAP_THRESHOLD", str(256 * 1024)))
+
+# Number of leading bytes inspected for binary/minified detection
+SNIFF_BYTES = 8192
+
+# Average line length above which a file is treated as minified
+MINIFIED_LINE_LENGTH = 300
+
+
+def content_hash(content):
     """
-    Walks through a directory and returns a list of supported code files (with content).
+    Returns the SHA-256 hex digest of a file's text content.
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def is_binary(sample):
+    """
+    Returns True if the sampled bytes look like a binary file (contain a NUL byte).
+    """
+    return b"\0" in sample
+
+
+def is_minified(filename, sample):
+    """
+    Returns True if the file looks minified or bundled (e.g. app.min.js).
 
     Args:
-        directory (str): The root directory to begin the file search.
+        filename (str): The file name.
+        sample (bytes): The first bytes of the file.
+    """
+    if ".min." in filename.lower():
+        return True
+    if len(sample) < SNIFF_BYTES:
+        return False  # Small files are never worth flagging
+    return len(sample) / (sample.count(b"\n") + 1) > MINIFIED_LINE_LENGTH
+
+
+class GitignoreRules:
+    """
+    A minimal `.gitignore` matcher covering the common syntax: comments, negation (`!`),
+    directory-only patterns (`dir/`), anchored patterns (`/build`, `src/gen`) and `**/`.
+
+    Rules are accumulated per directory as the walk descends, so nested `.gitignore`
+    files extend (and can override) the rules of their parents.
+    """
+
+    def __init__(self, rules=()):
+        self.rules = list(rules)  # (base_dir, pattern, negate, dir_only, anchored)
+
+    def extend(self, base_dir):
+        """
+        Returns a new rule set with the `.gitignore` found in `base_dir` (if any) appended.
+        """
+        path = os.path.join(base_dir, ".gitignore")
+        if not os.path.isfile(path):
+            return self
+
+        rules = list(self.rules)
+        try:
+            with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return self
+
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            anchored = "/" in line
+            rules.append((base_dir, line.lstrip("/"), negate, dir_only, anchored))
+        return GitignoreRules(rules)
+
+    def ignored(self, path, is_dir):
+        """
+        Returns True if `path` is excluded by the rules (the last matching rule wins).
+        """
+        result = False
+        name = os.path.basename(path)
+        for base_dir, pattern, negate, dir_only, anchored in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if anchored:
+                rel_path = os.path.relpath(path, base_dir).replace(os.sep, "/")
+                matched = fnmatch.fnmatchcase(rel_path, pattern) or (
+                    pattern.startswith("**/") and fnmatch.fnmatchcase(rel_path, pattern[3:]))
+            else:
+                matched = fnmatch.fnmatchcase(name, pattern)
+            if matched:
+                result = not negate
+        return result
+
+
+def skip_dir(name, path, rules):
+    """
+    Returns True if the walk shouldn't descend into directory `name` (at `path`):
+    ignored folders, test folders and paths excluded by `rules`.
+    """
+    name = name.lower()
+    return name in IGNORED_DIRS or 'test' in name or rules.ignored(path, is_dir=True)
+
+
+def _read_text(full_path, size, mmap_threshold):
+    """
+    Reads a file as UTF-8 text, memory-mapping it when it is larger than `mmap_threshold`.
 
     Returns:
-        list: A list of dictionaries, each containing the filename, full path, and file content.
+        str or None: The file content, or None if the file is binary or minified.
+    """
+    filename = os.path.basename(full_path)
+    with open(full_path, "rb") as f:
+        if size >= mmap_threshold and size > 0:
+            # Decode straight from the mapping instead of copying the file into a bytes buffer first
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                sample = mm[:SNIFF_BYTES]
+                if is_binary(sample) or is_minified(filename, sample):
+                    return None
+                content = str(mm, "utf-8")
+        else:
+            data = f.read()
+            sample = data[:SNIFF_BYTES]
+            if is_binary(sample) or is_minified(filename, sample):
+                return None
+            content = data.decode("utf-8")
+
+    # Normalize newlines the same way text-mode reads do
+    return content.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def iter_code_files(directory, max_file_size=MAX_FILE_SIZE, mmap_threshold=MMAP_THRESHOLD,
+                    respect_gitignore=True, fingerprints=None):
+    """
+    Walks through a directory and lazily yields supported code files (with content).
+
+    Only one file's content is held at a time, so the caller can start processing
+    the first file while the walk is still in progress.
+
+    Args:
+        directory (str): The root directory to begin the file search.
+        max_file_size (int): Files larger than this many bytes are skipped.
+        mmap_threshold (int): Files at least this large are read through mmap.
+        respect_gitignore (bool): Whether to prune paths excluded by `.gitignore` files.
+        fingerprints (dict): Full path -> (size, mtime) stored for it by an earlier
+            run. Files whose size and mtime still match are not read: they are
+            yielded with `content` and `content_hash` set to None.
+
+    Yields:
+        dict: The filename, full path, file content and its fingerprint
+              (size, mtime and content hash).
     """
-    code_files = []  # List to store dictionaries with code file information
-    
+    rules_by_dir = {}
+
     # os.walk generates the file tree, iterating over each directory, subdirectory, and file
     for root, dirs, files in os.walk(directory):
-        # Clean up dirs in-place to avoid descending into ignored directories (like test, .git, etc.)
-        dirs[:] = [
-            d for d in dirs
-            if d.lower() not in IGNORED_DIRS and 'test' not in d.lower()
-        ]
-        
         # Skip the directory if it contains 'test' in its path
         if 'test' in root.lower():
+            dirs[:] = []
             continue  # Skip the entire directory if it's related to tests
 
+        rules = rules_by_dir.pop(root, GitignoreRules())
+        if respect_gitignore:
+            rules = rules.extend(root)
+
+        # Clean up dirs in-place to avoid descending into ignored directories (like test, .git, etc.)
+        dirs[:] = [d for d in dirs if not skip_dir(d, os.path.join(root, d), rules)]
+        for d in dirs:
+            rules_by_dir[os.path.join(root, d)] = rules
+
         # Iterate over all files in the current directory
         for file in files:
             file_lower = file.lower()  # Convert the file name to lowercase for case-insensitive comparison
             file_ext = os.path.splitext(file)[1].lower()  # Extract and lower-case the file extension
 
             # Check if the file has a supported extension and doesn't belong to a test-related file
-            if file_ext in SUPPORTED_EXTENSIONS and 'test' not in file_lower:
-                full_path = os.path.join(root, file)  # Get the full path of the file
-
-                try:
-                    # Open and read the file content
-                    with open(full_path, "r", encoding="utf-8") as f:
-                        content = f.read()
-
-                    # Add the file's information to the list
-                    code_files.append({
-                        "filename": file,  # Store the file name
-                        "path": full_path,  # Store the full file path
-                        "content": content  # Store the content of the file
-                    })
-                except Exception as e:
-                    # If an error occurs (e.g., file read error), log it and skip the file
-                    print(f"Skipped {full_path}: {e}")
-    
-    return code_files  # Return the list of code files with their content
+            if file_ext not in SUPPORTED_EXTENSIONS or 'test' in file_lower:
+                continue
+
+            full_path = os.path.join(root, file)  # Get the full path of the file
+            if rules.ignored(full_path, is_dir=False):
+                continue
+
+            try:
+                stat = os.stat(full_path)
+                if stat.st_size > max_file_size:
+                    print(f"Skipped {full_path}: larger than {max_file_size} bytes")
+                    continue
+
+                if fingerprints and fingerprints.get(full_path) == (stat.st_size, stat.st_mtime):
+                    # Unchanged since it was stored: not worth reading and hashing again
+                    yield {"filename": file, "path": full_path, "content": None, "size": stat.st_size,
+                           "mtime": stat.st_mtime, "content_hash": None}
+                    continue
+
+                content = _read_text(full_path, stat.st_size, mmap_threshold)
+                if content is None:
+                    print(f"Skipped {full_path}: binary or minified")
+                    continue
+
+                yield {
+                    "filename": file,  # Store the file name
+                    "path": full_path,  # Store the full file path
+                    "content": content,  # Store the content of the file
+                    "size": stat.st_size,  # Fingerprint used for incremental re-analysis
+                    "mtime": stat.st_mtime,
+                    "content_hash": content_hash(content)
+                }
+            except Exception as e:
+                # If an error occurs (e.g., file read error), log it and skip the file
+                print(f"Skipped {full_path}: {e}")
+
+
+def load_code_files(directory, **kwargs):
+    """
+    Walks through a directory and returns a list of supported code files (with content).
+
+    Prefer `iter_code_files` for large trees; this loads every file into memory at once.
+
+    Args:
+        directory (str): The root directory to begin the file search.
+        **kwargs: Passed through to `iter_code_files`.
+
+    Returns:
+        list: A list of dictionaries, each containing the filename, full path, file content
+              and its fingerprint (size, mtime and content hash).
+    """
+    return list(iter_code_files(directory, **kwargs))
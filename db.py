@@ -1,12 +1,199 @@
-from pymongo import MongoClient
+from pymongo import UpdateOne, ASCENDING
+from bson import ObjectId
 import os
+import time
+import threading
 
-# Use the service name 'mongo' as the host when running inside Docker
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://mongo:27017/")
+import services
 
-client = MongoClient(MONGO_URI)
-db = client["code_analysis"]
+# Buffered writes are flushed once this many operations are pending...
+WRITE_BATCH_SIZE = int(os.getenv("MONGO_WRITE_BATCH_SIZE", "500"))
+# ...or when the oldest pending operation is older than this many seconds
+WRITE_FLUSH_INTERVAL = float(os.getenv("MONGO_WRITE_FLUSH_INTERVAL", "2.0"))
 
-codebase_files = db["codebase_files"]
-chunks = db["chunks"]
-analysis_results = db["analysis_results"]
+
+# Collections are looked up on each call so the client is only created on first use
+def codebase_files():
+    return services.mongo_db()["codebase_files"]
+
+
+def chunks():
+    return services.mongo_db()["chunks"]
+
+
+def analysis_results():
+    return services.mongo_db()["analysis_results"]
+
+
+def file_contents():
+    """File text stored once per content hash."""
+    return services.mongo_db()["file_contents"]
+
+
+def runs():
+    """One document per analysis run, used to resume interrupted runs."""
+    return services.mongo_db()["runs"]
+
+
+def release_contents(refs):
+    """
+    Drops references to stored file content (`refs` maps a content hash to the
+    number of deleted files that used it) and deletes the content no file uses
+    any more.
+
+    The delete itself re-checks the reference count, so content that another
+    run stored again in the meantime is kept.
+    """
+    if not refs:
+        return
+    file_contents().bulk_write([UpdateOne({"_id": content_hash}, {"$inc": {"refs": -count}})
+                                for content_hash, count in refs.items()], ordered=False)
+    # Content stored before references were counted has no count of its own, so the files are checked too
+    still_used = set(codebase_files().distinct("content_hash", {"content_hash": {"$in": list(refs)}}))
+    file_contents().delete_many({"_id": {"$in": [h for h in refs if h not in still_used]}, "refs": {"$lte": 0}})
+
+
+_indexes_created = False
+
+
+def ensure_indexes():
+    """
+    Creates the indexes used by the analysis pipeline queries (once per process).
+    """
+    global _indexes_created
+    if _indexes_created:
+        return
+    codebase_files().create_index([("project", ASCENDING), ("file_path", ASCENDING)])
+    codebase_files().create_index([("content_hash", ASCENDING)])
+    chunks().create_index([("file_id", ASCENDING), ("chunk_number", ASCENDING)])
+    chunks().create_index([("processed", ASCENDING)])
+    chunks().create_index([("project", ASCENDING)])
+    chunks().create_index([("project", ASCENDING), ("status", ASCENDING)])
+    runs().create_index([("project_path", ASCENDING), ("started_at", ASCENDING)])
+    analysis_results().create_index([("chunk_id", ASCENDING)])
+    analysis_results().create_index([("file_id", ASCENDING)])
+    analysis_results().create_index([("project", ASCENDING), ("file_path", ASCENDING), ("chunk_number", ASCENDING)])
+    _indexes_created = True
+
+
+class BulkWriter:
+    """
+    Buffers inserts and updates and sends them with unordered `insert_many` /
+    `bulk_write` calls, flushing on a size or time threshold.
+
+    Documents get their `_id` when they are buffered, so callers can reference
+    them before they reach the database. An `$set` on a document that is still
+    buffered is applied in memory instead of costing another round-trip.
+
+    Use as a context manager so pending writes are flushed on exit. With
+    `metrics` (a `metrics.RunMetrics`), flushes are timed as the "mongo_write" stage.
+    """
+
+    def __init__(self, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL, metrics=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.metrics = metrics
+        self._lock = threading.RLock()
+        self._inserts = {}  # collection name -> (collection, {_id: doc}) in insertion order
+        self._updates = {}  # collection name -> (collection, [UpdateOne])
+        self._contents = {}  # content hash -> [content, or None if already sent; references added]
+        self._pending = 0
+        self._oldest = None
+        self._stored_hashes = set()  # Content already sent by this writer
+        self.round_trips = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        return False
+
+    def insert(self, collection, doc):
+        """
+        Buffers `doc` for insertion into `collection` and returns its `_id`.
+        """
+        with self._lock:
+            doc.setdefault("_id", ObjectId())
+            self._inserts.setdefault(collection.name, (collection, {}))[1][doc["_id"]] = doc
+            self._added()
+            return doc["_id"]
+
+    def set_fields(self, collection, doc_id, fields):
+        """
+        Buffers `{"$set": fields}` on the document with `_id` `doc_id`.
+        """
+        with self._lock:
+            pending = self._inserts.get(collection.name)
+            if pending is not None and doc_id in pending[1]:
+                pending[1][doc_id].update(fields)  # Still buffered: no extra operation needed
+                return
+            self._updates.setdefault(collection.name, (collection, []))[1].append(
+                UpdateOne({"_id": doc_id}, {"$set": fields}))
+            self._added()
+
+    def upsert(self, collection, query, fields):
+        """
+        Buffers `{"$set": fields}` on the document matching `query`, inserting
+        it if there is none.
+        """
+        with self._lock:
+            self._updates.setdefault(collection.name, (collection, []))[1].append(
+                UpdateOne(query, {"$set": fields}, upsert=True))
+            self._added()
+
+    def store_content(self, content_hash, content):
+        """
+        Buffers an upsert storing `content` once under its hash in `file_contents`,
+        and a reference to it for the file being stored (see `release_contents`).
+        Call once per stored file.
+        """
+        with self._lock:
+            pending = self._contents.get(content_hash)
+            if pending is not None:
+                pending[1] += 1
+                return
+            # The content itself is only sent the first time this writer sees it
+            self._contents[content_hash] = [None if content_hash in self._stored_hashes else content, 1]
+            self._stored_hashes.add(content_hash)
+            self._added()
+
+    def _added(self):
+        self._pending += 1
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        if self._pending >= self.batch_size or time.monotonic() - self._oldest >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes every buffered operation: all inserts first, then all updates,
+        so updates always find the documents they target.
+        """
+        with self._lock:
+            inserts, updates = self._inserts, self._updates
+            self._inserts, self._updates = {}, {}
+            self._pending, self._oldest = 0, None
+
+            contents, self._contents = self._contents, {}
+            if contents:
+                collection = file_contents()
+                updates.setdefault(collection.name, (collection, []))[1].extend(
+                    UpdateOne({"_id": content_hash}, {"$setOnInsert": {"content": content}, "$inc": {"refs": refs}},
+                              upsert=True) if content is not None
+                    else UpdateOne({"_id": content_hash}, {"$inc": {"refs": refs}})
+                    for content_hash, (content, refs) in contents.items())
+
+            started, round_trips = time.perf_counter(), self.round_trips
+            for collection, docs in inserts.values():
+                if docs:
+                    collection.insert_many(list(docs.values()), ordered=False)
+                    self.round_trips += 1
+            for collection, ops in updates.values():
+                if ops:
+                    collection.bulk_write(ops, ordered=False)
+                    self.round_trips += 1
+
+            if self.metrics is not None and self.round_trips > round_trips:
+                self.metrics.add_stage("mongo_write", time.perf_counter() - started)
+                self.metrics.incr("mongo_round_trips", self.round_trips - round_trips)
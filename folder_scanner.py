@@ -0,0 +1,135 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from code_loader import GitignoreRules, skip_dir
+
+# Folder levels returned by one /fetch; deeper folders are expanded on demand
+FOLDER_SCAN_DEPTH = int(os.getenv("FOLDER_SCAN_DEPTH", "3"))
+
+# Top-level sub-folders are scanned in parallel with this many threads
+FOLDER_SCAN_WORKERS = int(os.getenv("FOLDER_SCAN_WORKERS", "8"))
+
+# Directory listings kept in the scan cache (LRU)
+FOLDER_CACHE_MAX_ENTRIES = int(os.getenv("FOLDER_CACHE_MAX_ENTRIES", "20000"))
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class FolderScanner:
+    """
+    Builds the folder tree shown by /fetch with `os.scandir`, skipping what the
+    loader skips (`IGNORED_DIRS`, test folders and `.gitignore` rules).
+
+    Trees stop at `max_depth` levels; deeper folders are returned with
+    `"children": null` and `"truncated": true` and can be expanded later by
+    scanning their `path`.
+
+    Each directory listing is cached and reused as long as the directory's mtime
+    and its `.gitignore` mtime are unchanged, so repeated scans of the same repo
+    cost one `stat` per directory instead of a listing.
+    """
+
+    def __init__(self, max_workers=FOLDER_SCAN_WORKERS, max_entries=FOLDER_CACHE_MAX_ENTRIES):
+        self.max_workers = max_workers
+        self.max_entries = max_entries
+        self._listings = OrderedDict()  # (path, rules) -> (validators, child rules, [(name, is_dir)])
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _listing(self, path, rules):
+        """
+        Returns the rules for `path`'s children and its visible (name, is_dir)
+        entries, folders first.
+        """
+        key = (path, tuple(rules.rules))
+        validators = (_mtime(path), _mtime(os.path.join(path, ".gitignore")))
+        with self._lock:
+            cached = self._listings.get(key)
+            if cached is not None and cached[0] == validators:
+                self._listings.move_to_end(key)
+                self.hits += 1
+                return cached[1], cached[2]
+            self.misses += 1
+
+        child_rules = rules.extend(path)
+        entries = []
+        with os.scandir(path) as it:
+            for entry in it:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if is_dir and skip_dir(entry.name, entry.path, child_rules):
+                    continue
+                if not is_dir and child_rules.ignored(entry.path, is_dir=False):
+                    continue
+                entries.append((entry.name, is_dir))
+        entries.sort(key=lambda e: (not e[1], e[0].lower()))
+
+        with self._lock:
+            self._listings[key] = (validators, child_rules, entries)
+            self._listings.move_to_end(key)
+            while len(self._listings) > self.max_entries:
+                self._listings.popitem(last=False)
+        return child_rules, entries
+
+    def _node(self, path, rel_path, rules, depth, pool=None):
+        node = {"name": os.path.basename(path) or path, "type": "folder", "path": rel_path, "children": []}
+        if depth <= 0:
+            node["children"] = None
+            node["truncated"] = True
+            return node
+
+        try:
+            child_rules, entries = self._listing(path, rules)
+        except OSError as e:
+            node["error"] = str(e)
+            return node
+
+        def child(name):
+            child_rel = f"{rel_path}/{name}" if rel_path else name
+            return self._node(os.path.join(path, name), child_rel, child_rules, depth - 1)
+
+        dirs = [name for name, is_dir in entries if is_dir]
+        subtrees = dict(zip(dirs, pool.map(child, dirs) if pool is not None else map(child, dirs)))
+        for name, is_dir in entries:
+            node["children"].append(subtrees[name] if is_dir else {"name": name, "type": "file"})
+        return node
+
+    def _rules_for(self, root, path):
+        # The .gitignore files of every folder from `root` down to `path`'s parent apply to it
+        rules = GitignoreRules()
+        directory = root
+        for part in os.path.relpath(path, root).split(os.sep):
+            if part == ".":
+                break
+            rules = rules.extend(directory)
+            directory = os.path.join(directory, part)
+        return rules
+
+    def scan(self, root, subpath="", max_depth=FOLDER_SCAN_DEPTH):
+        """
+        Returns the folder tree of `root`/`subpath`, `max_depth` levels deep.
+
+        Args:
+            root (str): The repository (or project) directory.
+            subpath (str): Folder inside `root` to expand, as given in a node's `path`.
+            max_depth (int): Number of folder levels to list.
+
+        Raises:
+            ValueError: If `subpath` points outside of `root`.
+        """
+        root = os.path.abspath(root)
+        path = os.path.abspath(os.path.join(root, subpath))
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError(f"'{subpath}' is outside of '{root}'")
+
+        rel_path = os.path.relpath(path, root).replace(os.sep, "/")
+        rules = self._rules_for(root, path)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return self._node(path, "" if rel_path == "." else rel_path, rules, max_depth, pool)
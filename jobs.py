@@ -0,0 +1,414 @@
+"""
+Background analysis jobs for the app: a job manager running analyses on a
+thread pool inside the app process, job records and progress in a shared store
+(Redis, or memory for tests) and single-flight claims so identical requests
+join one job.
+
+Jobs run on threads rather than on a process pool or a Redis-backed worker
+queue: an analysis spends its time waiting on LLM and MongoDB round-trips, and
+the progress reporter, cancel events and search index it updates live in the
+app process. The consequence is that jobs don't outlive the process that
+queued them. When an instance restarts, its queued and running jobs are gone:
+their records stay "queued"/"running" until `JOB_TTL` and their single-flight
+leases expire within `SINGLE_FLIGHT_TTL`, after which the next request for the
+project starts a new job. Stored chunks and runs survive in MongoDB, so that
+job can continue the interrupted run (`"resume": true`) instead of starting over.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import services
+from main import AnalysisCancelled
+
+# Number of analyses that can run at the same time in this process
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+
+# How long finished job records are kept in Redis (seconds)
+JOB_TTL = int(os.getenv("JOB_TTL", str(24 * 3600)))
+
+# Lease of a single-flight claim (seconds). The process holding it renews it every third of
+# this while the job is queued or running, so a claim of a process that died expires soon after
+SINGLE_FLIGHT_TTL = int(os.getenv("SINGLE_FLIGHT_TTL", "60"))
+
+# Minimum interval between progress writes to the job store (seconds)
+PROGRESS_FLUSH_INTERVAL = 1.0
+
+QUEUED, RUNNING, COMPLETE, FAILED, CANCELLED = "queued", "running", "complete", "failed", "cancelled"
+
+
+class MemoryJobStore:
+    """Keeps job records in a dict; used for tests and single-process deployments."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._cancelled = set()
+        self._lock = threading.Lock()
+
+    def save(self, job_id, record):
+        with self._lock:
+            self._jobs[job_id] = json.loads(json.dumps(record))  # Store a detached copy
+
+    def load(self, job_id):
+        with self._lock:
+            record = self._jobs.get(job_id)
+            if record is None:
+                return None
+            record = json.loads(json.dumps(record))
+            record["cancel_requested"] = record.get("cancel_requested") or job_id in self._cancelled
+            return record
+
+    def request_cancel(self, job_id):
+        with self._lock:
+            self._cancelled.add(job_id)
+
+
+class RedisJobStore:
+    """
+    Keeps job records in Redis so every app instance can report on every job.
+    Uses the shared client from `services` unless one is given.
+
+    Only the instance running a job rewrites its record; a cancel requested
+    through any instance is kept under a key of its own (`job:<id>:cancel`), so
+    the running job's next progress write can't overwrite it.
+    """
+
+    def __init__(self, client=None, ttl=JOB_TTL):
+        self._client = client
+        self.ttl = ttl
+
+    @property
+    def client(self):
+        return self._client if self._client is not None else services.redis_client()
+
+    def save(self, job_id, record):
+        self.client.set(f"job:{job_id}", json.dumps(record), ex=self.ttl)
+
+    def load(self, job_id):
+        raw = self.client.get(f"job:{job_id}")
+        if not raw:
+            return None
+        record = json.loads(raw)
+        record["cancel_requested"] = bool(record.get("cancel_requested") or self.client.get(f"job:{job_id}:cancel"))
+        return record
+
+    def request_cancel(self, job_id):
+        self.client.set(f"job:{job_id}:cancel", "1", ex=self.ttl)
+
+
+class SingleFlight:
+    """
+    Records which job is in flight for a key, so concurrent requests for the same
+    work join one job instead of each starting their own.
+
+    Claims are Redis keys set with NX, shared by every app instance. Without
+    Redis (`use_redis=False`), or while it's unreachable, claims fall back to
+    a dict in this process.
+
+    A claim is a lease of `ttl` seconds: a heartbeat thread renews the claims
+    this process holds until they are released, so the claim of a process that
+    died expires within `ttl` and the next request for its key starts a new job.
+    """
+
+    # Deletes the claim only if it still belongs to the releasing job
+    _RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+    # Extends the lease only if the claim still belongs to the renewing job
+    _RENEW_SCRIPT = ("if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('expire', KEYS[1], ARGV[2]) "
+                     "end return 0")
+
+    def __init__(self, client=None, use_redis=True, ttl=SINGLE_FLIGHT_TTL, clock=time.time):
+        self._client = client
+        self.use_redis = use_redis
+        self.ttl = ttl
+        self._clock = clock
+        self._local = {}  # key -> (job_id, expires at)
+        self._held = {}  # key -> job_id of the claims this process holds and renews
+        self._heartbeat = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        return self._client if self._client is not None else services.redis_client()
+
+    def claim(self, key, job_id):
+        """
+        Claims `key` for `job_id` unless another job holds it.
+
+        Returns:
+            str: The id of the job holding the claim (`job_id` if it was free).
+        """
+        if self.use_redis:
+            try:
+                if self.client.set(f"inflight:{key}", job_id, nx=True, ex=self.ttl):
+                    self._hold(key, job_id)
+                    return job_id
+                holder = self.client.get(f"inflight:{key}")
+                # The claim may have expired or been released in between
+                return holder if holder is not None else self.claim(key, job_id)
+            except Exception as e:
+                logging.warning(f"Single-flight claim through Redis failed, using a local claim: {e}")
+
+        with self._lock:
+            holder, expires = self._local.get(key, (None, 0))
+            if holder is not None and expires > self._clock():
+                return holder
+            # Free, or the lease ran out without being renewed
+            self._local[key] = (job_id, self._clock() + self.ttl)
+        self._hold(key, job_id)
+        return job_id
+
+    def release(self, key, job_id):
+        """Releases `key` if `job_id` still holds it."""
+        with self._lock:
+            if self._held.get(key) == job_id:
+                del self._held[key]
+            if self._local.get(key, (None, 0))[0] == job_id:
+                del self._local[key]
+        if self.use_redis:
+            try:
+                self.client.eval(self._RELEASE_SCRIPT, 1, f"inflight:{key}", job_id)
+            except Exception as e:
+                logging.warning(f"Single-flight release through Redis failed: {e}")
+
+    def _hold(self, key, job_id):
+        with self._lock:
+            self._held[key] = job_id
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._beat, name="single-flight-heartbeat", daemon=True)
+                self._heartbeat.start()
+
+    def _beat(self):
+        while True:
+            time.sleep(self.ttl / 3)
+            self.renew()
+
+    def renew(self):
+        """Extends the lease of every claim this process holds by `ttl` seconds."""
+        with self._lock:
+            held = dict(self._held)
+            local = {key for key, job_id in held.items() if self._local.get(key, (None, 0))[0] == job_id}
+            for key in local:
+                self._local[key] = (held[key], self._clock() + self.ttl)
+        if not self.use_redis:
+            return
+        for key, job_id in held.items():
+            if key in local:
+                continue  # Claimed while Redis was unreachable
+            try:
+                if not self.client.eval(self._RENEW_SCRIPT, 1, f"inflight:{key}", job_id, self.ttl):
+                    logging.warning(f"Single-flight claim of {key} by job {job_id} expired before it was renewed")
+            except Exception as e:
+                logging.warning(f"Single-flight renewal through Redis failed: {e}")
+
+
+class JobProgress:
+    """
+    Progress reporter handed to `run_analysis`. Tracks per-file chunk counts,
+    estimates the remaining time and periodically writes a snapshot to the store.
+    """
+
+    def __init__(self, manager, job_id):
+        self._manager = manager
+        self._job_id = job_id
+        self._lock = threading.Lock()
+        self._files = {}  # path -> [chunks done, chunks queued]
+        self._chunks_queued = 0
+        self._chunks_done = 0
+        self._walk_done = False
+        self._started_at = time.time()
+        self._last_flush = 0.0
+        self._last_cancel_check = 0.0
+
+    def chunk_queued(self, path):
+        with self._lock:
+            self._files.setdefault(path, [0, 0])[1] += 1
+            self._chunks_queued += 1
+        self._flush()
+
+    def chunk_done(self, path):
+        with self._lock:
+            self._files.setdefault(path, [0, 0])[0] += 1
+            self._chunks_done += 1
+        self._flush()
+
+    def walk_done(self):
+        with self._lock:
+            self._walk_done = True
+        self._flush(force=True)
+
+    def cancelled(self):
+        # The local flag is free to check; the shared store is polled at most once per interval
+        now = time.time()
+        check_store = now - self._last_cancel_check >= PROGRESS_FLUSH_INTERVAL
+        if check_store:
+            self._last_cancel_check = now
+        return self._manager.cancel_requested(self._job_id, check_store=check_store)
+
+    def snapshot(self):
+        """
+        Returns the current progress as a JSON-serializable dict.
+        """
+        with self._lock:
+            elapsed = time.time() - self._started_at
+            eta = None
+            # Before the walk finishes the total is a lower bound, so the ETA is optimistic
+            if self._chunks_done:
+                remaining = self._chunks_queued - self._chunks_done
+                eta = round(elapsed / self._chunks_done * remaining, 1)
+            return {
+                "files_seen": len(self._files),
+                "files_done": sum(1 for done, queued in self._files.values() if done == queued),
+                "chunks_queued": self._chunks_queued,
+                "chunks_done": self._chunks_done,
+                "walk_done": self._walk_done,
+                "elapsed_seconds": round(elapsed, 1),
+                "eta_seconds": eta,
+                "files": {path: {"chunks_done": done, "chunks_total": queued}
+                          for path, (done, queued) in self._files.items()}
+            }
+
+    def _flush(self, force=False):
+        now = time.time()
+        if not force and now - self._last_flush < PROGRESS_FLUSH_INTERVAL:
+            return
+        self._last_flush = now
+        self._manager.update(self._job_id, progress=self.snapshot())
+
+
+class JobManager:
+    """
+    Runs analyses in the background and records their state in a job store.
+
+    The work itself is I/O-bound (LLM and database round-trips), so jobs run on a
+    thread pool; the store can be shared (Redis) so any instance can serve status
+    and cancellation requests.
+    """
+
+    def __init__(self, store, max_workers=JOB_WORKERS, flights=None):
+        self.store = store
+        self.flights = flights if flights is not None else SingleFlight(use_redis=isinstance(store, RedisJobStore))
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis-job")
+        self._lock = threading.Lock()
+        self._cancel_events = {}  # job_id -> threading.Event for jobs owned by this process
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queues `fn(*args, progress=JobProgress, **kwargs)` and returns the new job id.
+
+        The return value of `fn` is stored as the job's result.
+        """
+        job_id = uuid.uuid4().hex
+        self._submit(job_id, fn, args, kwargs)
+        return job_id
+
+    def submit_once(self, key, fn, *args, **kwargs):
+        """
+        Like `submit`, but while a job submitted for `key` is queued or running,
+        returns that job's id instead of starting another one. The claim on `key`
+        is a lease renewed while the job is queued or running (see `SingleFlight`),
+        so if the process owning the job dies, the claim is taken over once it expires.
+
+        Returns:
+            tuple: (job id, True if an existing job was joined).
+        """
+        job_id = uuid.uuid4().hex
+        holder = self.flights.claim(key, job_id)
+        if holder != job_id:
+            record = self.get(holder)
+            # No record yet means the holder is still being submitted
+            if record is None or record["state"] in (QUEUED, RUNNING):
+                return holder, True
+            # The holder finished without releasing its claim: take it over
+            self.flights.release(key, holder)
+            holder = self.flights.claim(key, job_id)
+            if holder != job_id:
+                return holder, True
+
+        self._submit(job_id, fn, args, kwargs, flight_key=key)
+        return job_id, False
+
+    def _submit(self, job_id, fn, args, kwargs, flight_key=None):
+        self.store.save(job_id, {
+            "job_id": job_id,
+            "state": QUEUED,
+            "created_at": time.time(),
+            "progress": None,
+            "result": None,
+            "error": None,
+            "cancel_requested": False
+        })
+        with self._lock:
+            self._cancel_events[job_id] = threading.Event()
+        self._pool.submit(self._run, job_id, fn, args, kwargs, flight_key)
+
+    def _run(self, job_id, fn, args, kwargs, flight_key=None):
+        try:
+            self._run_job(job_id, fn, args, kwargs)
+        finally:
+            if flight_key is not None:
+                self.flights.release(flight_key, job_id)
+
+    def _run_job(self, job_id, fn, args, kwargs):
+        if self.cancel_requested(job_id):
+            self.update(job_id, state=CANCELLED, finished_at=time.time())
+            return
+
+        progress = JobProgress(self, job_id)
+        self.update(job_id, state=RUNNING, started_at=time.time())
+        try:
+            result = fn(*args, progress=progress, **kwargs)
+            self.update(job_id, state=COMPLETE, result=result, progress=progress.snapshot(),
+                        finished_at=time.time())
+        except AnalysisCancelled:
+            logging.info(f"Job {job_id} cancelled")
+            self.update(job_id, state=CANCELLED, progress=progress.snapshot(), finished_at=time.time())
+        except Exception as e:
+            logging.exception(f"Job {job_id} failed")
+            self.update(job_id, state=FAILED, error=str(e), progress=progress.snapshot(),
+                        finished_at=time.time())
+        finally:
+            with self._lock:
+                self._cancel_events.pop(job_id, None)
+
+    def get(self, job_id):
+        return self.store.load(job_id)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            record = self.store.load(job_id) or {"job_id": job_id}
+            record.update(fields)
+            self.store.save(job_id, record)
+
+    def cancel(self, job_id):
+        """
+        Requests cancellation. Running jobs stop after their in-flight chunks finish.
+
+        Returns:
+            dict or None: The job record, or None if the job doesn't exist.
+        """
+        record = self.get(job_id)
+        if record is None:
+            return None
+        if record["state"] in (QUEUED, RUNNING):
+            # Stored apart from the record, which the job's own instance keeps rewriting
+            self.store.request_cancel(job_id)
+            with self._lock:
+                event = self._cancel_events.get(job_id)
+            if event is not None:
+                event.set()
+        return self.get(job_id)
+
+    def cancel_requested(self, job_id, check_store=True):
+        with self._lock:
+            event = self._cancel_events.get(job_id)
+        if event is not None and event.is_set():
+            return True
+        if not check_store:
+            return False
+        # The cancel may have been requested through another app instance
+        record = self.store.load(job_id)
+        return bool(record and record["cancel_requested"])
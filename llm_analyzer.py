@@ -1,121 +1,340 @@
-import os
 import json
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from langchain_community.callbacks import get_openai_callback
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
 import re
+import threading
+import time
+import functools
 from collections import Counter
+from chunker import count_tokens
+from scheduler import (AdaptiveLimiter, classify_error, backoff_delay, TRANSIENT_ERRORS, RATE_LIMITED, TIMEOUT,
+                       RATE_LIMIT_RETRIES)
+from summarizer import HierarchicalSummarizer
+from output_parser import parse_batch
+import services
+from services import MODEL_NAME
 
 
 # === Setup ===
 load_dotenv()
-openai_api_key = os.getenv("OPENAI_API_KEY")
 
 # === Prompt Template ===
-prompt_template = PromptTemplate.from_template("""
-You are an expert AI code analyzer. Analyze the following source code and extract structured metadata.
+# Plain str.format templates, so building prompts doesn't need LangChain.
+# Line counts, imports, annotations, signatures and complexity are extracted locally
+# (see `static_analysis`), so the model is only asked for descriptions.
+prompt_template = """
+You are an expert AI code analyzer. Describe what the following source code does.
 Output must be strictly in valid JSON format with no extra text. Follow this structure:
 
 {{
   "filename": "{filename}",
   "description": "Brief description of what this file or class does",
-  "lines_of_code": <number of lines in the full code>,
-  "key_imports": ["..."],
   "classes": [
     {{
       "name": "ClassName",
-      "annotations": ["..."],
       "description": "What the class does",
       "methods": [
         {{
-          "signature": "full method signature",
-          "description": "what the method does",
-          "complexity": {{
-            "level": "Low | Medium | High"
-          }}
+          "signature": "method signature as written in the code",
+          "description": "what the method does"
         }}
       ]
     }}
   ]
 }}
 
+Imports and simple accessors were left out of the code. Put functions outside any class in a class named "<module>".
 Only include the actual content inside the JSON brackets. Do not explain anything outside it.
 
 Code:
 {code_chunk}
-""")
+"""
+
+# === Batch Prompt Template ===
+# Several small files share one copy of the instructions instead of one request each
+batch_prompt_template = """
+You are an expert AI code analyzer. Describe what each of the source files below does.
+Output must be strictly a valid JSON array with no extra text, containing exactly one object per file,
+in the same order as the files. Each object must follow this structure:
+
+{{
+  "filename": "<the file name given in the FILE header>",
+  "description": "Brief description of what this file or class does",
+  "classes": [
+    {{
+      "name": "ClassName",
+      "description": "What the class does",
+      "methods": [
+        {{
+          "signature": "method signature as written in the code",
+          "description": "what the method does"
+        }}
+      ]
+    }}
+  ]
+}}
+
+Imports and simple accessors were left out of the code. Put functions outside any class in a class named "<module>".
+Only include the JSON array. Do not explain anything outside it.
+
+{files_block}
+"""
+
+# === Repair Prompt Template ===
+# Sent when a response can't be parsed even after local repair; the code isn't sent again
+repair_prompt_template = """
+Your previous answer could not be parsed ({error}). Return it again as strictly valid JSON with no extra text,
+following this structure:
+{{"filename": "{filename}", "description": "...", "classes": [{{"name": "...", "description": "...", "methods": [{{"signature": "...", "description": "..."}}]}}]}}
+
+Previous answer:
+{response}
+"""
+
+# Longest previous answer (in characters) quoted in a repair prompt
+REPAIR_MAX_RESPONSE_CHARS = 12000
 
 # === LLM Setup ===
-llm = ChatOpenAI(
-    openai_api_key=openai_api_key,
-    temperature=0.3,
-    model_name="gpt-3.5-turbo"
-)
-chain = LLMChain(llm=llm, prompt=prompt_template)
+# The chat model is created by `services` on first use, which also defers importing LangChain
+def use_llm(new_llm):
+    """
+    Replaces the model used for chunk analysis and summaries (e.g. with `offline.FakeLLM`).
+
+    Returns:
+        The previously used model (None if none was created yet), so it can be restored.
+    """
+    return services.registry.override("llm", new_llm)
+
+
+# Requests go through an adaptive limiter, which backs off on rate limits and timeouts.
+# Analysis runs pass their own (capped at the run's max_in_flight); everything else uses this one.
+default_limiter = AdaptiveLimiter()
+
+
+def _response_headers(response):
+    # OpenAI chat models created with include_response_headers=True expose the rate-limit headers here
+    return (getattr(response, "response_metadata", None) or {}).get("headers")
+
+
+def _complete(prompt, limiter=None, metrics=None):
+    """
+    Sends `prompt` through `limiter`. With `metrics`, the time spent waiting for
+    the limiter is observed as `llm_queue_seconds` and the request itself as
+    `llm_latency_seconds`.
+    """
+    limiter = limiter or default_limiter
+    queued = time.perf_counter()
+
+    def invoke():
+        sent = time.perf_counter()
+        if metrics is not None:
+            metrics.observe("llm_queue_seconds", sent - queued)
+        response = services.llm().invoke(prompt)
+        if metrics is not None:
+            metrics.observe("llm_latency_seconds", time.perf_counter() - sent)
+        return response
+
+    response = limiter.call(invoke, headers_of=_response_headers)
+    # Chat models return a message object, plain LLMs a string
+    return getattr(response, "content", response)
+
+
+class _LimitedLLM:
+    """
+    Model wrapper for the summarizer: calls go through `default_limiter`, and rate limits
+    and timeouts are retried with backoff.
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    def invoke(self, prompt):
+        attempt = 0
+        while True:
+            try:
+                return default_limiter.call(lambda: self.llm.invoke(prompt), headers_of=_response_headers)
+            except Exception as e:
+                if classify_error(e) not in TRANSIENT_ERRORS or attempt >= RATE_LIMIT_RETRIES:
+                    raise
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+
+
+def llm_error(error):
+    """
+    The "Error: <kind>: <message>" string returned for a failed request, with the
+    kind from `scheduler.classify_error`.
+    """
+    return f"Error: {classify_error(error)}: {error}"
+
+
+def error_kind(result):
+    """Kind of a failed result built by `llm_error`, or None if `result` isn't one."""
+    if not (isinstance(result, str) and result.startswith("Error: ")):
+        return None
+    kind = result[len("Error: "):].split(":", 1)[0]
+    return kind if kind in TRANSIENT_ERRORS else "error"
+
+
+def _record_error(metrics, error):
+    if metrics is None:
+        return
+    metrics.incr("llm_errors")
+    kind = classify_error(error)
+    if kind == RATE_LIMITED:
+        metrics.incr("llm_rate_limited")
+    elif kind == TIMEOUT:
+        metrics.incr("llm_timeouts")
+
+
+def _openai_callback():
+    # Imported here with the model itself rather than when this module loads
+    from langchain_community.callbacks import get_openai_callback
+    return get_openai_callback()
+
 
 total_input_tokens = 0
 total_output_tokens = 0
+batch_prompt_tokens_saved = 0  # Instruction tokens not re-sent thanks to batching
+_token_lock = threading.Lock()  # analyze_chunk runs on several worker threads
 
 # === Analyze Single Chunk ===
-def analyze_chunk(filename, code_chunk):
+def _record_call(metrics, cb, limiter=None):
     global total_input_tokens, total_output_tokens
+    with _token_lock:
+        total_input_tokens += cb.prompt_tokens or 0
+        total_output_tokens += cb.completion_tokens or 0
+    if metrics is not None:
+        metrics.set_gauge("llm_concurrency_limit", (limiter or default_limiter).limit)
+        metrics.incr("llm_requests")
+        metrics.incr("prompt_tokens", cb.prompt_tokens or 0)
+        metrics.incr("completion_tokens", cb.completion_tokens or 0)
+
+
+def analyze_chunk(filename, code_chunk, metrics=None, limiter=None):
+    """
+    Analyzes one code chunk.
+
+    Args:
+        metrics (RunMetrics): If given, records the call's latency, tokens and errors.
+        limiter (AdaptiveLimiter): The run's limiter; `default_limiter` if not given.
+
+    Returns:
+        str: The raw LLM response, or "Error: <kind>: ..." if the request failed
+             (see `llm_error`).
+    """
     try:
-        with get_openai_callback() as cb:
-            response = chain.run({
-                "filename": filename,
-                "code_chunk": code_chunk
-            })
-            total_input_tokens += cb.prompt_tokens or 0
-            total_output_tokens += cb.completion_tokens or 0
+        with _openai_callback() as cb:
+            response = _complete(prompt_template.format(filename=filename, code_chunk=code_chunk), limiter, metrics)
+        _record_call(metrics, cb, limiter)
         print(f"[TOKENS] {filename} → Prompt: {cb.prompt_tokens}, Completion: {cb.completion_tokens}")
         return response
     except Exception as e:
+        _record_error(metrics, e)
         print(f"[ERROR] Failed to analyze {filename}: {str(e)}")
-        return f"Error: {str(e)}"
-    
-import re
-from collections import Counter
+        return llm_error(e)
 
-def generate_project_purpose_with_llm(file_summaries, llm):
+
+def reask_chunk(filename, response, error, metrics=None, limiter=None):
     """
-    Uses LLM to generate a clear, 2-3 line natural project purpose from structured file summaries.
+    Asks the LLM to turn its unparseable `response` for `filename` into valid
+    JSON, with a short prompt that quotes the response instead of the code.
+
+    Returns:
+        str: The raw LLM response, or "Error: <kind>: ..." if the request failed.
     """
-    text_blob = []
+    try:
+        with _openai_callback() as cb:
+            response = _complete(repair_prompt_template.format(
+                filename=filename, error=error, response=response[:REPAIR_MAX_RESPONSE_CHARS]), limiter, metrics)
+        _record_call(metrics, cb, limiter)
+        print(f"[TOKENS] {filename} (repair) → Prompt: {cb.prompt_tokens}, Completion: {cb.completion_tokens}")
+        return response
+    except Exception as e:
+        _record_error(metrics, e)
+        print(f"[ERROR] Failed to repair the analysis of {filename}: {str(e)}")
+        return llm_error(e)
 
-    for file in file_summaries:
-        desc = file.get("description", "")
-        text_blob.append(f"File: {file['filename']}\n{desc}")
-        for cls in file.get("classes", []):
-            class_desc = cls.get("description", "")
-            text_blob.append(f"Class: {cls['name']}\n{class_desc}")
-            for method in cls.get("methods", []):
-                method_desc = method.get("description", "")
-                if method_desc:
-                    text_blob.append(method_desc)
 
-    full_context = "\n".join(text_blob)
+# === Analyze Batch of Small Files ===
+def _format_files_block(items):
+    return "\n".join(f"=== FILE {i + 1}: {filename} ===\n{code}" for i, (filename, code) in enumerate(items))
 
-    prompt = f"""
-You are an expert software analyst. Given the following structured metadata from source code files, write a clear, natural, 2–3 line project purpose description.
 
-Only describe what this project is about — don't explain structure or implementation.
+def _parse_batch_response(response, items):
+    results, status = parse_batch(response, [filename for filename, _ in items])
+    return [json.dumps(result) for result in results], status
 
-Metadata:
-{full_context}
 
-Project Purpose:
-"""
+def analyze_batch(items, metrics=None, limiter=None):
+    """
+    Analyzes several (filename, code_chunk) pairs in a single request.
+
+    Falls back to one `analyze_chunk` call per item when the batch request fails
+    or its response isn't a JSON array matching the items. A rate limit, timeout
+    or overloaded server instead fails every item with the same error, so the
+    caller can retry the batch as a whole.
+
+    Args:
+        metrics (RunMetrics): If given, records the call's latency, tokens and errors.
+        limiter (AdaptiveLimiter): The run's limiter; `default_limiter` if not given.
+
+    Returns:
+        tuple: (JSON response for each item, in order; how the batch response
+               was parsed, `output_parser.OK` or `REPAIRED`, or None if the
+               items are the raw responses of single requests or errors)
+    """
+    global batch_prompt_tokens_saved
+    if len(items) == 1:
+        return [analyze_chunk(*items[0], metrics=metrics, limiter=limiter)], None
+
+    names = ", ".join(filename for filename, _ in items)
     try:
-        result = llm.invoke(prompt)
-        return result.strip()
+        with _openai_callback() as cb:
+            response = _complete(batch_prompt_template.format(files_block=_format_files_block(items)), limiter,
+                                 metrics)
+        _record_call(metrics, cb, limiter)
+        print(f"[TOKENS] batch({len(items)}) {names} → Prompt: {cb.prompt_tokens}, Completion: {cb.completion_tokens}")
+        results, status = _parse_batch_response(response, items)
     except Exception as e:
-        print(f"[ERROR] LLM purpose generation failed: {str(e)}")
-        return "This project provides backend functionality for a domain-specific application, including business logic and authentication."
+        if classify_error(e) in TRANSIENT_ERRORS:
+            # Splitting the batch would only multiply the requests hitting the limit
+            _record_error(metrics, e)
+            print(f"[WARN] Batch analysis of {names} failed: {e}")
+            return [llm_error(e)] * len(items), None
+        if metrics is not None:
+            metrics.incr("batch_fallbacks")
+        print(f"[WARN] Batch analysis failed for {names}, falling back to single requests: {e}")
+        return [analyze_chunk(filename, code, metrics=metrics, limiter=limiter) for filename, code in items], None
+
+    saved = (len(items) - 1) * prompt_overhead_tokens()
+    with _token_lock:
+        batch_prompt_tokens_saved += saved
+    if metrics is not None:
+        metrics.incr("batch_prompt_tokens_saved", saved)
+    return results, status
+
+
+@functools.lru_cache(maxsize=None)
+def prompt_overhead_tokens():
+    """
+    Number of tokens the single-chunk instructions add around the code.
+    """
+    return count_tokens(prompt_template.format(filename="", code_chunk=""))
+
+def generate_project_purpose_with_llm(file_summaries, llm, cache=None):
+    """
+    Uses LLM to generate a clear, 2-3 line natural project purpose from structured file summaries.
+
+    Large projects are summarized per directory first and reduced up the tree
+    (see `summarizer.HierarchicalSummarizer`) so no prompt outgrows the context window.
+    """
+    summarizer = HierarchicalSummarizer(llm, cache=cache, model_name=MODEL_NAME)
+    purpose = summarizer.summarize(file_summaries)
+    print(f"[SUMMARY] Project purpose built with {summarizer.llm_calls} LLM calls")
+    return purpose
 
 
-def build_final_output(merged_results):
+def build_final_output(merged_results, cache=None):
     total_classes = 0
     total_lines = 0
     file_count = len(merged_results)
@@ -125,7 +344,8 @@ def build_final_output(merged_results):
         total_lines += file.get("lines_of_code", 0)
 
     # Use LLM to generate a proper project purpose
-    project_purpose_description = generate_project_purpose_with_llm(merged_results, llm)
+    project_purpose_description = generate_project_purpose_with_llm(merged_results, _LimitedLLM(services.llm()),
+                                                                    cache=cache)
 
     return {
         "files": merged_results,
@@ -1,98 +1,746 @@
-from collections import defaultdict
+import functools
+import itertools
 import json
 import os
-from code_loader import load_code_files
-from chunker import chunk_code
-from llm_analyzer import analyze_chunk, build_final_output  # Import final output builder
-from db import codebase_files, chunks, analysis_results
-
-
-# Function to merge analysis results by filename
-def merge_results_by_filename(results):
-    merged = {}
-
-    for result in results:
-        filename = result["filename"]
-
-        if filename not in merged:
-            merged[filename] = {
-                "filename": filename,
-                "description": result.get("description", ""),
-                "lines_of_code": result.get("lines_of_code", 0),
-                "key_imports": set(result.get("key_imports", [])),
-                "classes": []
-            }
-
-        merged[filename]["key_imports"].update(result.get("key_imports", []))
-
-        for new_class in result.get("classes", []):
-            existing_class = next((cls for cls in merged[filename]["classes"]
-                                   if cls["name"] == new_class["name"]), None)
-            if existing_class:
-                existing_class["annotations"] = list(set(existing_class.get("annotations", []) + new_class.get("annotations", [])))
-                existing_class["methods"].extend(new_class.get("methods", []))
-            else:
-                merged[filename]["classes"].append(new_class)
+import time
+import uuid
+from collections import Counter
+from code_loader import iter_code_files
+from chunker import chunk_spans, count_tokens
+from llm_analyzer import analyze_chunk, analyze_batch, reask_chunk, build_final_output, prompt_template, MODEL_NAME, error_kind  # Import final output builder
+from output_parser import parse_analysis, OutputParseError
+from db import (codebase_files, chunks, analysis_results, file_contents, runs, BulkWriter, ensure_indexes,
+                release_contents)
+from scheduler import (run_ordered, retry_call, default_budget, PROMPT_OVERHEAD_TOKENS, LLM_MAX_RETRIES,
+                       RATE_LIMIT_RETRIES, TRANSIENT_ERRORS, MAX_IN_FLIGHT, AdaptiveLimiter)
+from cache import build_chunk_cache, chunk_cache_key
+from merger import ResultMerger
+from metrics import RunMetrics
+from output import write_json_summary, write_ndjson_summary, ndjson_path
+import static_analysis
+import search_index
 
-    for file_data in merged.values():
-        file_data["key_imports"] = list(file_data["key_imports"])
+# Chunk-level cache of LLM responses, keyed by prompt, model and chunk content
+chunk_cache = build_chunk_cache()
 
-    return list(merged.values())
+# Small single-chunk files are packed into one request of up to this many code tokens (0 disables batching)
+BATCH_MAX_TOKENS = int(os.getenv("LLM_BATCH_MAX_TOKENS", "3000"))
+BATCH_MAX_FILES = int(os.getenv("LLM_BATCH_MAX_FILES", "8"))
+# Only files up to this many tokens are batched; larger ones get a request of their own
+BATCH_FILE_MAX_TOKENS = int(os.getenv("LLM_BATCH_FILE_MAX_TOKENS", "500"))
 
 
-# Main function to run the analysis
-def run_analysis(project_path):
-    java_files = load_code_files(project_path)
-    raw_results = []
+class AnalysisCancelled(Exception):
+    """Raised when a run is cancelled through its progress reporter."""
+
+
+# Result of a chunk nothing had to be sent to the LLM for: all of it comes from static analysis
+_STATIC_ONLY = "{}"
+
+
+def _make_job(file, file_id, chunk_id, chunk_number, chunk, facts, trivial=False, single_chunk=False, attempts=0,
+              progress=None, metrics=None):
+    """
+    Builds the analysis job of one chunk. `chunk` is the code the LLM gets to see
+    (see `static_analysis.llm_view`) and `facts` the static facts of the chunk;
+    chunks left without code need no LLM request. Cache hits and misses are
+    counted in `metrics`.
+    """
+    if progress is not None:
+        progress.chunk_queued(file["file_path"])
+    static_only = trivial or not chunk.strip()
+    cache_key = None if static_only else chunk_cache_key(prompt_template, MODEL_NAME, chunk)
+
+    return {
+        "filename": file["filename"],
+        "file_id": file_id,
+        "file_path": file["file_path"],
+        "file_size": file.get("size", 0),
+        "chunk_id": chunk_id,
+        "chunk_number": chunk_number,
+        "chunk": chunk,
+        "tokens": count_tokens(chunk),
+        "single_chunk": single_chunk,
+        "attempts": attempts,  # Attempts made by earlier runs (when resuming)
+        "facts": facts,
+        "trivial": trivial,
+        "cache_key": cache_key,
+        "cached": _STATIC_ONLY if static_only else chunk_cache.get(cache_key, metrics)
+    }
+
 
-    codebase_files.delete_many({})
-    chunks.delete_many({})
-    analysis_results.delete_many({})
+def _static_facts(content, filename, metrics=None):
+    """
+    Returns the static facts of a file and whether it's trivial enough to skip the LLM.
+    """
+    if metrics is None:
+        facts = static_analysis.extract(content, filename)
+    else:
+        with metrics.stage("static_analysis"):
+            facts = static_analysis.extract(content, filename)
+    return facts, static_analysis.STATIC_SKIP_TRIVIAL and static_analysis.is_trivial(facts)
 
-    for file in java_files:
-        file_id = codebase_files.insert_one({
+
+def _chunk_view(content, start, end, facts, trivial):
+    """The code of a chunk that is sent to the LLM, and the chunk's static facts."""
+    view = "" if trivial else static_analysis.llm_view(content, start, end, facts)
+    return view, static_analysis.facts_for_span(facts, start, end)
+
+
+def _iter_chunk_jobs(code_files, writer, project_path, run_id, progress, metrics):
+    """
+    Stores each file and its chunks through `writer`, yielding one analysis job per chunk.
+
+    File text is stored once per content hash in `file_contents`; chunks only
+    keep their character offsets into it. Files and chunks are tagged with
+    `project_path` so runs of different projects never touch each other's data.
+    """
+    for file in code_files:
+        if progress is not None and progress.cancelled():
+            raise AnalysisCancelled()
+
+        with metrics.stage("chunking"):
+            spans = chunk_spans(file["content"], file["filename"])
+
+        writer.store_content(file["content_hash"], file["content"])
+        file_doc = {
+            "project": project_path,
             "filename": file["filename"],
             "file_path": file["path"],
-            "file_content": file["content"]
-        }).inserted_id
+            "size": file["size"],
+            "mtime": file["mtime"],
+            "content_hash": file["content_hash"],
+            "chunk_count": len(spans)  # Lets a resumed run tell whether all chunks were stored
+        }
+        file_id = writer.insert(codebase_files(), file_doc)
+        metrics.incr("files_loaded")
+        metrics.incr("chunks_created", len(spans))
 
-        file_chunks = chunk_code(file["content"])
+        facts, trivial = _static_facts(file["content"], file["filename"], metrics)
+        if trivial:
+            metrics.incr("static_only_files")
 
-        for i, chunk in enumerate(file_chunks):
-            chunk_id = chunks.insert_one({
+        for i, (start, end) in enumerate(spans):
+            chunk_id = writer.insert(chunks(), {
+                "project": project_path,
                 "file_id": file_id,
-                "chunk_content": chunk,
+                "run_id": run_id,
+                "content_hash": file["content_hash"],
+                "start": start,
+                "end": end,
                 "chunk_number": i,
-                "processed": False
-            }).inserted_id
+                "processed": False,
+                "status": "pending",
+                "attempts": 0
+            })
+
+            view, chunk_facts = _chunk_view(file["content"], start, end, facts, trivial)
+            if not view.strip():
+                metrics.incr("static_only_chunks")
+            yield _make_job(file_doc, file_id, chunk_id, i, view, chunk_facts, trivial=trivial,
+                            single_chunk=len(spans) == 1, progress=progress, metrics=metrics)
+
+    if progress is not None:
+        progress.walk_done()
+
+
+def _incomplete_files(project_path):
+    """
+    Returns the ids of stored files of `project_path` whose chunks or content
+    weren't all stored: a run stopped before all its buffered writes were flushed.
+    """
+    stored = Counter(doc["file_id"] for doc in chunks().find({"project": project_path}, {"file_id": 1}))
+    files = list(codebase_files().find({"project": project_path}, {"chunk_count": 1, "content_hash": 1}))
+    contents = set(file_contents().distinct("_id", {"_id": {"$in": [f["content_hash"] for f in files]}}))
+    return {f["_id"] for f in files
+            if f["content_hash"] not in contents
+            or f.get("chunk_count") is not None and stored[f["_id"]] != f["chunk_count"]}
+
+
+def _iter_pending_jobs(project_path, progress=None, skip=(), metrics=None):
+    """
+    Yields jobs for the stored chunks of `project_path` that were never processed
+    or that failed, whichever run created them, rebuilding their text from the
+    stored file content and offsets. Chunks of the files in `skip` (see
+    `_incomplete_files`) are left out.
+    """
+    pending = chunks().find({"project": project_path, "status": {"$ne": "processed"}}) \
+        .sort([("file_id", 1), ("chunk_number", 1)])
+
+    file_doc, content, facts, trivial = None, None, None, False
+    for doc in pending:
+        if progress is not None and progress.cancelled():
+            raise AnalysisCancelled()
+        if doc["file_id"] in skip:
+            continue  # Re-chunked from disk instead
+
+        # Chunks are sorted by file, so only the current file needs to be kept around
+        if file_doc is None or file_doc["_id"] != doc["file_id"]:
+            file_doc = codebase_files().find_one({"_id": doc["file_id"]})
+            content = file_contents().find_one({"_id": doc["content_hash"]})["content"]
+            facts, trivial = _static_facts(content, file_doc["filename"])
+
+        view, chunk_facts = _chunk_view(content, doc["start"], doc["end"], facts, trivial)
+        yield _make_job(file_doc, doc["file_id"], doc["_id"], doc["chunk_number"], view, chunk_facts,
+                        trivial=trivial, attempts=doc.get("attempts", 0), progress=progress, metrics=metrics)
+
+
+def _batch_jobs(jobs):
+    """
+    Groups uncached small single-chunk files into batch jobs ({"batch": [jobs]}),
+    passing every other job through unchanged.
+    """
+    batch, batch_tokens = [], 0
+    for job in jobs:
+        batchable = (BATCH_MAX_TOKENS and job["cached"] is None and job["single_chunk"]
+                     and job["tokens"] <= BATCH_FILE_MAX_TOKENS)
+        if not batchable:
+            yield job
+            continue
+
+        if batch and (batch_tokens + job["tokens"] > BATCH_MAX_TOKENS or len(batch) >= BATCH_MAX_FILES):
+            yield {"batch": batch}
+            batch, batch_tokens = [], 0
+        batch.append(job)
+        batch_tokens += job["tokens"]
+
+    if batch:
+        yield {"batch": batch}
+
+
+def _unbatch(job, results):
+    """
+    Pairs each chunk job of a (possibly batch) job with its (raw result, attempts).
+    """
+    return zip(job["batch"] if "batch" in job else [job], results)
+
+
+def _is_llm_error(result):
+    # analyze_chunk reports failures as an "Error: ..." string
+    return isinstance(result, str) and result.startswith("Error:")
+
+
+def _retries_for(result):
+    return RATE_LIMIT_RETRIES if error_kind(result) in TRANSIENT_ERRORS else LLM_MAX_RETRIES
+
+
+def _batch_failed(results):
+    # analyze_batch reports a batch request that hit a rate limit or timeout as an error for every item
+    return all(error_kind(result) in TRANSIENT_ERRORS for result in results)
+
+
+def _analyze_with_retry(filename, chunk, metrics=None, limiter=None):
+    return retry_call(lambda: analyze_chunk(filename, chunk, metrics=metrics, limiter=limiter), _is_llm_error,
+                      retries_for=_retries_for)
+
+
+def _parse_result(filename, result, metrics=None, limiter=None, parsed_as=None):
+    """
+    Parses and validates a chunk's LLM response, repairing it locally if needed.
+    A response that can't be repaired is sent back once with a short repair
+    prompt (without the code) instead of discarding the chunk.
+
+    `parsed_as` is how the response was already parsed, e.g. as part of a
+    repaired batch response; it's counted instead of the status of this parse.
+
+    Returns:
+        str: The validated analysis as JSON, or an "Error: ..." string.
+    """
+    if _is_llm_error(result):
+        return result
+    try:
+        parsed, status = parse_analysis(result, filename)
+        status = parsed_as or status
+    except OutputParseError as e:
+        print(f"[PARSE] Unparseable response for {filename}, asking for a repair: {e}")
+        repaired = reask_chunk(filename, result, e, metrics=metrics, limiter=limiter)
+        if _is_llm_error(repaired):
+            return repaired
+        try:
+            parsed, status = parse_analysis(repaired, filename)
+            status = "reasked"
+        except OutputParseError as e:
+            if metrics is not None:
+                metrics.incr("json_parse_failures")
+            return f"Error: invalid_output: {e}"
+    if metrics is not None:
+        metrics.incr(f"parse_{status}")
+    return json.dumps(parsed)
+
+
+def _analyze_job(job, metrics=None, limiter=None):
+    """
+    Analyzes a chunk or batch job through the run's `limiter`, retrying failed
+    chunks with backoff. A batch that hits rate limits or timeouts is retried as
+    a whole; only chunks that failed on their own are retried one by one.
+
+    Returns:
+        list: (validated JSON result or "Error: ...", attempts) for each chunk in the job.
+    """
+    if "batch" in job:
+        items = [(j["filename"], j["chunk"]) for j in job["batch"]]
+        (results, status), attempts = retry_call(lambda: analyze_batch(items, metrics=metrics, limiter=limiter),
+                                                 lambda outcome: _batch_failed(outcome[0]),
+                                                 retries=RATE_LIMIT_RETRIES)
+        if _batch_failed(results):
+            # Splitting the batch would only multiply the requests hitting the limit
+            results = [(r, attempts) for r in results]
+        else:
+            results = [_analyze_with_retry(j["filename"], j["chunk"], metrics, limiter) if _is_llm_error(r)
+                       else (r, attempts) for j, r in zip(job["batch"], results)]
+        return [(_parse_result(j["filename"], r, metrics, limiter, parsed_as=status), attempts)
+                for j, (r, attempts) in zip(job["batch"], results)]
+    if job["cached"] is not None:
+        return [(job["cached"], 0)]
+    result, attempts = _analyze_with_retry(job["filename"], job["chunk"], metrics, limiter)
+    return [(_parse_result(job["filename"], result, metrics, limiter), attempts)]
+
+
+def _job_priority(job):
+    # Chunks of the largest files are dispatched first so they don't end up in the tail
+    members = job["batch"] if "batch" in job else [job]
+    return max(j["file_size"] for j in members), max(j["tokens"] for j in members)
+
+
+def _job_cost(job):
+    if "batch" in job:
+        return sum(j["tokens"] for j in job["batch"]) + PROMPT_OVERHEAD_TOKENS
+    if job["cached"] is not None:
+        return None  # Cache hits never reach the LLM
+    return job["tokens"] + PROMPT_OVERHEAD_TOKENS
+
+
+def _stored_files(project, incomplete=()):
+    """
+    Returns the stored files of `project` by path, and the (size, mtime) of those
+    whose fingerprint can be trusted (all but `incomplete`) for `iter_code_files`.
+    """
+    stored = {
+        doc["file_path"]: doc
+        for doc in codebase_files().find({"project": project},
+                                         {"file_path": 1, "content_hash": 1, "size": 1, "mtime": 1})
+    }
+    fingerprints = {path: (doc.get("size"), doc.get("mtime")) for path, doc in stored.items()
+                    if doc["_id"] not in incomplete}
+    return stored, fingerprints
+
+
+def _iter_changed_files(code_files, previous, stale_ids, incomplete=()):
+    """
+    Yields the files that were added or modified since the previous run,
+    comparing each one with the fingerprint stored in `codebase_files` (`previous`,
+    by path; see `_stored_files`). Files the walk didn't read because their size
+    and mtime matched are unchanged; the others are compared by content hash.
+    Files in `incomplete` (see `_incomplete_files`) are yielded as if modified.
+
+    Ids of stored files that were modified or deleted are appended to `stale_ids`;
+    deleted files are only known once `code_files` has been fully consumed.
+    """
+    previous = dict(previous)
+
+    for file in code_files:
+        old = previous.pop(file["path"], None)
+        if old is not None and old["_id"] not in incomplete and \
+                (file["content_hash"] is None or old.get("content_hash") == file["content_hash"]):
+            continue  # Unchanged: keep its stored chunks and results
+        if old is not None:
+            stale_ids.append(old["_id"])
+        yield file
+
+    # Whatever is left no longer exists on disk
+    stale_ids.extend(doc["_id"] for doc in previous.values())
+
+
+def _drop_files(file_ids, index=None):
+    """
+    Deletes stored files together with their chunks, analysis results and any
+    file content no other file shares, and removes them from the search `index`.
+    """
+    if not file_ids:
+        return
+    if index is not None:
+        index.remove(chunks().distinct("_id", {"file_id": {"$in": file_ids}}))
+    refs = _content_refs({"_id": {"$in": file_ids}})
+    analysis_results().delete_many({"file_id": {"$in": file_ids}})
+    chunks().delete_many({"file_id": {"$in": file_ids}})
+    codebase_files().delete_many({"_id": {"$in": file_ids}})
+    release_contents(refs)
+
+
+def load_search_entries(project, root=None):
+    """
+    Yields (chunk id, file path relative to the project, analysis result) for
+    every stored result of `project`, to build its search index (see
+    `search_index.index_for`).
 
-            result = analyze_chunk(file["filename"], chunk)
+    Args:
+        root (str): The directory the project was last analyzed in; by default
+            `project_root(project)`.
+    """
+    root = root or project_root(project)
+    cursor = analysis_results().find({"project": project}, {"chunk_id": 1, "file_path": 1, "json_result": 1})
+    for doc in cursor:
+        yield doc["chunk_id"], os.path.relpath(doc["file_path"], root), doc["json_result"]
 
-            try:
-                json_result = json.loads(result)
 
-                analysis_results.insert_one({
-                    "chunk_id": chunk_id,
-                    "json_result": json_result
-                })
+def project_root(project):
+    """
+    Returns the directory the latest run of `project` analyzed: the project
+    itself for local directories, the checkout of its latest commit for
+    repositories analyzed under a project key (see `run_analysis`).
+    """
+    run = runs().find_one({"project_path": project}, {"root": 1}, sort=[("started_at", -1)])
+    return (run or {}).get("root") or project
 
-                chunks.update_one({"_id": chunk_id}, {"$set": {"processed": True}})
 
-                raw_results.append(json_result)
+def project_for_root(root):
+    """Returns the project last analyzed in the directory `root` (`root` itself if none was)."""
+    run = runs().find_one({"root": root}, {"project_path": 1}, sort=[("started_at", -1)])
+    return run["project_path"] if run is not None else root
 
-            except Exception as e:
-                print(f"[WARN] JSON decode failed for chunk {i} of {file['filename']}: {e}")
-                continue
 
-    # Merge results by file
-    merged_results = merge_results_by_filename(raw_results)
+def _rebase_project(project, root, metrics=None):
+    """
+    Points the stored file paths of `project` at `root` when its previous run
+    analyzed another directory (an older checkout of the same branch), so
+    unchanged files are recognized by their path relative to the project.
+    """
+    previous = project_root(project)
+    if previous == root:
+        return
+    with BulkWriter(metrics=metrics) as writer:
+        for collection in (codebase_files, analysis_results):
+            for doc in collection().find({"project": project}, {"file_path": 1}):
+                relative = os.path.relpath(doc["file_path"], previous)
+                writer.set_fields(collection(), doc["_id"], {"file_path": os.path.join(root, relative)})
+    print(f"[RUN] Moved stored files of {project} from {previous} to {root}")
+
+
+def forget_project(project):
+    """
+    Deletes everything stored for `project` and its search index, e.g. once the
+    checkout it was analyzed in is gone. Its runs are kept as history.
+    """
+    _drop_project(project)
+    search_index.drop(project)
+
+
+def _drop_project(project_path):
+    """
+    Deletes every stored file, chunk and analysis result of `project_path`, and
+    the file content no other project shares.
+    """
+    refs = _content_refs({"project": project_path})
+    analysis_results().delete_many({"project": project_path})
+    chunks().delete_many({"project": project_path})
+    codebase_files().delete_many({"project": project_path})
+    release_contents(refs)
+
+
+def _content_refs(query):
+    # File content is shared by every file (of any project) with the same hash
+    return Counter(doc["content_hash"] for doc in codebase_files().find(query, {"content_hash": 1}))
+
+
+def _merge_stored_results(merger, project_path):
+    """
+    Streams every stored chunk result of `project_path` into `merger`, ordered by
+    file path and chunk number.
+    """
+    stored = analysis_results().find({"project": project_path}, {"file_path": 1, "json_result": 1}) \
+        .sort([("file_path", 1), ("chunk_number", 1)])
+    for doc in stored:
+        merger.add(doc["file_path"], doc["json_result"])
+
+
+def find_resumable_run(project_path):
+    """
+    Returns the id of the latest run of `project_path` if it was interrupted or
+    left failed chunks behind, or None.
+    """
+    # Only the latest run counts: a later run supersedes whatever an older one left behind
+    run = runs().find_one({"project_path": project_path}, sort=[("started_at", -1)])
+    if run is None or (run["status"] == "complete" and not run.get("chunks_failed")):
+        return None
+    return run["_id"]
+
+
+def _process_jobs(jobs, writer, project, merger, max_in_flight, budget, progress, metrics, index=None,
+                  limiter=None, root=None):
+    """
+    Dispatches jobs, stores each chunk result and records per-chunk status,
+    attempts and failure reasons. Results are merged as they complete when a
+    `merger` is given, and added to the search `index` when one is given.
+
+    Time blocked on LLM results (latency not hidden by concurrency) is charged
+    to the "llm_wait" stage of `metrics`; producing the jobs is timed by its own
+    stages (file_walk, chunking, static_analysis, mongo_write).
+
+    Chunks that still hit rate limits or timeouts after their retries are
+    deferred and sent once more after all other chunks, when the limiter has
+    backed off, instead of being dropped.
+
+    Returns:
+        int: The number of failed chunks.
+    """
+    failed = 0
+
+    for final_pass in (False, True):
+        deferred = []
+        analyzed = run_ordered(_batch_jobs(jobs), functools.partial(_analyze_job, metrics=metrics, limiter=limiter),
+                               max_in_flight=max_in_flight, budget=budget, cost=_job_cost, priority=_job_priority,
+                               on_wait=functools.partial(metrics.add_stage, "llm_wait"))
+        for dispatched, results in analyzed:
+            for job, (result, attempts) in _unbatch(dispatched, results):
+                if progress is not None and progress.cancelled():
+                    raise AnalysisCancelled()
+
+                attempts += job["attempts"]
+                if not final_pass and error_kind(result) in TRANSIENT_ERRORS:
+                    deferred.append(dict(job, attempts=attempts))
+                    metrics.incr("chunks_deferred")
+                    continue
+
+                if progress is not None:
+                    progress.chunk_done(job["file_path"])
+                failed += _store_result(job, result, attempts, writer, project, merger, metrics, index, root)
+
+        if not deferred:
+            break
+        print(f"[RETRY] Sending {len(deferred)} chunks that hit rate limits or timeouts once more")
+        jobs = deferred
+
+    return failed
+
+
+def _store_result(job, result, attempts, writer, project, merger, metrics, index=None, root=None):
+    """
+    Stores the final result of a chunk job and merges it. Search index entries
+    get the file path relative to `root` (by default `project`).
+
+    Returns:
+        int: 1 if the chunk failed, else 0.
+    """
+    if attempts > 1:
+        metrics.incr("llm_retries", attempts - 1)
+    if _is_llm_error(result):
+        metrics.incr("chunks_failed")
+        writer.set_fields(chunks(), job["chunk_id"], {"status": "failed", "attempts": attempts, "error": result})
+        print(f"[WARN] Giving up on chunk {job['chunk_number']} of {job['filename']} after {attempts} attempts")
+        return 1
+
+    try:
+        # The LLM only describes the code; everything else comes from static analysis
+        json_result = static_analysis.combine(job["facts"], json.loads(result), trivial=job["trivial"])
+
+        if job["cached"] is None:
+            chunk_cache.put(job["cache_key"], result)
+        # Cached results may come from a file with another name or location
+        json_result["filename"] = job["filename"]
+
+        # Upserted, so a chunk analyzed again after a lost status update keeps one result
+        writer.upsert(analysis_results(), {"chunk_id": job["chunk_id"]}, {
+            "project": project,
+            "file_id": job["file_id"],
+            "file_path": job["file_path"],
+            "chunk_number": job["chunk_number"],
+            "json_result": json_result
+        })
+
+        writer.set_fields(chunks(), job["chunk_id"],
+                          {"processed": True, "status": "processed", "attempts": attempts, "error": None})
+
+        if merger is not None:
+            with metrics.stage("merge"):
+                merger.add(job["file_path"], json_result)
+        if index is not None:
+            with metrics.stage("search_index"):
+                index.add(job["chunk_id"], os.path.relpath(job["file_path"], root or project), json_result)
+        metrics.incr("chunks_analyzed")
+        return 0
+
+    except Exception as e:
+        metrics.incr("chunks_failed")
+        metrics.incr("json_parse_failures")
+        writer.set_fields(chunks(), job["chunk_id"],
+                          {"status": "failed", "attempts": attempts, "error": f"Invalid JSON: {e}"})
+        print(f"[WARN] JSON decode failed for chunk {job['chunk_number']} of {job['filename']}: {e}")
+        return 1
+
+
+# Main function to run the analysis
+def run_analysis(project_path, max_in_flight=None, budget=None, incremental=False, progress=None,
+                 resume_run_id=None, metrics=None, limiter=None, project_key=None, commit=None):
+    """
+    Analyzes every supported file under `project_path` and writes final_summary.json.
+
+    Chunks are sent to the LLM concurrently (bounded by `max_in_flight` and the
+    per-minute `budget`), but results are collected in file/chunk order so the
+    merged output is the same as a sequential run. Failed LLM calls are retried
+    with exponential backoff and jitter.
+
+    Files are loaded lazily, so analysis of the first chunks starts while the
+    directory walk is still in progress.
+
+    Stored files, chunks and results are scoped to `project_key` (by default
+    `project_path`), so different projects can be analyzed at the same time. Runs
+    of the same project must not overlap (see `jobs.JobManager.submit_once`). A
+    repository checkout is analyzed under a key that stays the same across
+    commits (see `repo_manager.project_key`), with the `commit` recorded on the
+    run, so an incremental run of a new commit reuses what the previous commit's
+    run stored.
+
+    With `incremental=True` the stored data of the previous run is kept: only
+    added or modified files (by content hash) are re-chunked and re-analyzed,
+    deleted files are dropped, and the summary is rebuilt from stored results.
+    Chunks of the project that earlier runs never processed or that failed are
+    analyzed again too.
+
+    With `resume_run_id` (see `find_resumable_run`) that run is continued: the
+    project's chunks that were never processed or failed are analyzed again, and
+    files the run never reached (or that changed since) are added as in
+    incremental mode.
+
+    `progress` is an optional reporter (see `jobs.JobProgress`) notified through
+    `chunk_queued(path)`, `chunk_done(path)` and `walk_done()`; when its
+    `cancelled()` returns True the run stops with AnalysisCancelled.
+
+    The summary is also written as final_summary.ndjson (see `output.write_ndjson_summary`).
+
+    Results are added to the project's search index (see `search_index`) as chunks finish.
+
+    Per-stage timings and counters are recorded in `metrics` (a new `RunMetrics`
+    by default), saved as run_metrics.json next to the summary and in the run document.
+
+    LLM requests go through `limiter`, by default a new `scheduler.AdaptiveLimiter`
+    that may grow up to `max_in_flight` concurrent requests.
+    """
+    if metrics is None:
+        metrics = RunMetrics()
+    ensure_indexes()
+    stale_ids = []
+    project = project_key or project_path
+
+    if resume_run_id is not None:
+        run = runs().find_one({"_id": resume_run_id})
+        if run is None:
+            raise ValueError(f"Unknown run '{resume_run_id}'")
+        run_id = resume_run_id
+        _rebase_project(project, project_path, metrics)
+        runs().update_one({"_id": run_id}, {"$set": {"status": "running", "resumed_at": time.time(),
+                                                   "root": project_path, "commit": commit}})
+    else:
+        if incremental:
+            _rebase_project(project, project_path, metrics)
+        run_id = uuid.uuid4().hex
+        runs().insert_one({
+            "_id": run_id,
+            "project_path": project,
+            "root": project_path,
+            "commit": commit,
+            "incremental": incremental,
+            "status": "running",
+            "started_at": time.time()
+        })
+
+        if not incremental:
+            _drop_project(project)
+    print(f"[RUN] {run_id} ({'resume' if resume_run_id else 'incremental' if incremental else 'full'})")
+
+    if budget is None:
+        budget = default_budget()
+    if limiter is None:
+        limiter = AdaptiveLimiter(max_limit=max_in_flight or MAX_IN_FLIGHT)
+
+    # Incremental and resumed runs merge from the database once everything is stored
+    reuses_stored = incremental or resume_run_id is not None
+    merger = None if reuses_stored else ResultMerger()
+
+    # The search index is updated as chunks finish; a full run starts it over
+    if not reuses_stored:
+        search_index.drop(project)
+    with metrics.stage("search_index"):
+        index = search_index.index_for(project, loader=functools.partial(load_search_entries, project, project_path))
+
+    try:
+        with BulkWriter(metrics=metrics) as writer:
+            if reuses_stored:
+                # Files whose chunks were only partly stored are chunked again from disk
+                incomplete = _incomplete_files(project)
+                if incomplete:
+                    print(f"[RESUME] {len(incomplete)} files were only partly stored, re-chunking them")
+                # Files whose size and mtime match what is stored aren't even read
+                previous, fingerprints = _stored_files(project, incomplete)
+                java_files = metrics.timed_iter("file_walk", iter_code_files(project_path, fingerprints=fingerprints))
+                # A resumed run also picks up files the interrupted run never reached
+                java_files = _iter_changed_files(java_files, previous, stale_ids, incomplete)
+            else:
+                java_files = metrics.timed_iter("file_walk", iter_code_files(project_path))
+            jobs = _iter_chunk_jobs(java_files, writer, project, run_id, progress, metrics)
+            if reuses_stored:
+                # Chunks earlier runs left pending or failed are retried, also when their file is unchanged
+                jobs = itertools.chain(_iter_pending_jobs(project, progress, skip=incomplete, metrics=metrics), jobs)
+
+            _process_jobs(jobs, writer, project, merger, max_in_flight, budget, progress, metrics, index, limiter,
+                          project_path)
+    except AnalysisCancelled:
+        runs().update_one({"_id": run_id}, {"$set": {"status": "cancelled", "finished_at": time.time(),
+                                                   "metrics": metrics.report()}})
+        raise
+    except Exception as e:
+        runs().update_one({"_id": run_id}, {"$set": {"status": "failed", "error": str(e), "finished_at": time.time(),
+                                                   "metrics": metrics.report()}})
+        raise
+
+    print(f"[MONGO] Buffered writes flushed in {writer.round_trips} round-trips")
+    print(f"[TOKENS] Run total → Prompt: {metrics.counter('prompt_tokens')}, "
+          f"Completion: {metrics.counter('completion_tokens')}, "
+          f"Saved by batching: {metrics.counter('batch_prompt_tokens_saved')}")
+
+    parsed = {status: metrics.counter(f"parse_{status}") for status in ("ok", "repaired", "reasked")}
+    parse_total = sum(parsed.values()) + metrics.counter("json_parse_failures")
+    parse_success_rate = round(sum(parsed.values()) / parse_total, 4) if parse_total else None
+    print(f"[PARSE] LLM responses → Valid: {parsed['ok']}, Repaired: {parsed['repaired']}, "
+          f"Re-asked: {parsed['reasked']}, Failed: {metrics.counter('json_parse_failures')}, "
+          f"Success rate: {parse_success_rate}")
+
+    hits, misses = metrics.counter("cache_hits"), metrics.counter("cache_misses")
+    hit_rate = round(hits / (hits + misses), 3) if hits + misses else 0.0
+    print(f"[CACHE] Chunk cache → Hits: {hits}, Misses: {misses}, Hit rate: {hit_rate}")
+
+    if stale_ids:
+        _drop_files(stale_ids, index)
+        print(f"[INCREMENTAL] Dropped {len(stale_ids)} modified/deleted files")
+
+    if reuses_stored:
+        # Chunks analyzed by earlier runs weren't redone, so merge everything that is stored
+        merger = ResultMerger()
+        with metrics.stage("merge"):
+            _merge_stored_results(merger, project)
+
+    # Merged results by file, with paths relative to the project
+    with metrics.stage("merge"):
+        merged_results = merger.results(relative_to=project_path)
 
     # Build final JSON output with project overview
-    final_output = build_final_output(merged_results)
+    with metrics.stage("summary"):
+        final_output = build_final_output(merged_results, cache=chunk_cache)
 
-    # Save to disk
+    # Save to disk, streamed one file entry at a time; the NDJSON copy backs the paginated /summary API
     output_path = os.path.join(project_path, "final_summary.json")
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(final_output, f, indent=2)
+    with metrics.stage("write_output"):
+        write_json_summary(output_path, final_output)
+        write_ndjson_summary(ndjson_path(output_path), final_output)
+
+    report = metrics.report()
+    with open(os.path.join(project_path, "run_metrics.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print("[METRICS] " + ", ".join(f"{stage}: {row['seconds']}s" for stage, row in report["stages"].items()))
+
+    # Counted over the whole project, so failures an earlier run left behind keep the run resumable
+    chunks_failed = chunks().count_documents({"project": project, "status": "failed"})
+    runs().update_one({"_id": run_id}, {"$set": {"status": "complete", "chunks_failed": chunks_failed,
+                                               "parse_success_rate": parse_success_rate,
+                                               "finished_at": time.time(), "metrics": report}})
 
     return output_path, final_output
@@ -0,0 +1,82 @@
+import os
+
+
+def _normalize_signature(signature):
+    # Overlapping or re-analyzed chunks report the same method with varying whitespace
+    return " ".join(signature.split())
+
+
+class ResultMerger:
+    """
+    Merges per-chunk analysis results into one entry per file as chunks complete.
+
+    Files are keyed by full path (so two `utils.py` in different directories stay
+    separate), classes by name and methods by normalized signature, all through
+    dicts, so each merge is linear in the size of the incoming result. Duplicate
+    methods reported by several chunks are kept once.
+    """
+
+    def __init__(self):
+        self._files = {}  # path -> {"entry": file entry, "imports": {}, "classes": {name: class state}}
+
+    def __len__(self):
+        return len(self._files)
+
+    def add(self, file_path, result):
+        """
+        Merges the analysis result of one chunk of `file_path`.
+        """
+        state = self._files.get(file_path)
+        if state is None:
+            state = self._files[file_path] = {
+                "entry": {
+                    "filename": result.get("filename") or os.path.basename(file_path),
+                    "file_path": file_path,
+                    "description": result.get("description", ""),
+                    "lines_of_code": result.get("lines_of_code", 0),
+                },
+                "imports": {},
+                "classes": {}
+            }
+        elif not state["entry"]["description"]:
+            state["entry"]["description"] = result.get("description", "")
+
+        # dicts double as insertion-ordered sets, which keeps the output deterministic
+        state["imports"].update(dict.fromkeys(result.get("key_imports", [])))
+
+        for new_class in result.get("classes", []):
+            name = new_class.get("name", "")
+            cls = state["classes"].get(name)
+            if cls is None:
+                cls = state["classes"][name] = {
+                    "entry": {k: v for k, v in new_class.items() if k not in ("annotations", "methods")},
+                    "annotations": {},
+                    "methods": {}
+                }
+            elif not cls["entry"].get("description"):
+                cls["entry"]["description"] = new_class.get("description", "")
+
+            cls["annotations"].update(dict.fromkeys(new_class.get("annotations", [])))
+            for method in new_class.get("methods", []):
+                key = _normalize_signature(method.get("signature", ""))
+                cls["methods"].setdefault(key, method)
+
+    def results(self, relative_to=None):
+        """
+        Returns the merged file entries in the order files were first seen.
+
+        Args:
+            relative_to (str): If given, `file_path` is reported relative to this directory.
+        """
+        merged = []
+        for file_path, state in self._files.items():
+            entry = dict(state["entry"])
+            if relative_to:
+                entry["file_path"] = os.path.relpath(file_path, relative_to)
+            entry["key_imports"] = list(state["imports"])
+            entry["classes"] = [
+                dict(cls["entry"], annotations=list(cls["annotations"]), methods=list(cls["methods"].values()))
+                for cls in state["classes"].values()
+            ]
+            merged.append(entry)
+        return merged
@@ -0,0 +1,196 @@
+import math
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Histogram buckets (seconds) used for every observed duration
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_PREFIX = "analyzer"
+
+
+def percentile(values, q):
+    """
+    Returns the q-th percentile (0-100) of `values` using nearest-rank, or None if empty.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class MetricsRegistry:
+    """
+    Process-wide totals across all runs, rendered in the Prometheus text format.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._stage_seconds = defaultdict(float)
+        self._stage_calls = defaultdict(int)
+        self._counters = defaultdict(int)
+        self._gauges = {}
+        self._histograms = {}  # name -> [bucket counts..., +Inf count, sum]
+
+    def add_stage(self, stage, seconds):
+        with self._lock:
+            self._stage_seconds[stage] += seconds
+            self._stage_calls[stage] += 1
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self._histograms.setdefault(name, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += value
+
+    def render_prometheus(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            lines.append(f"# TYPE {METRIC_PREFIX}_stage_seconds_total counter")
+            for stage, seconds in sorted(self._stage_seconds.items()):
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_total{{stage="{stage}"}} {seconds:.6f}')
+            lines.append(f"# TYPE {METRIC_PREFIX}_stage_calls_total counter")
+            for stage, calls in sorted(self._stage_calls.items()):
+                lines.append(f'{METRIC_PREFIX}_stage_calls_total{{stage="{stage}"}} {calls}')
+
+            for name, value in sorted(self._counters.items()):
+                lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+                lines.append(f"{METRIC_PREFIX}_{name}_total {value}")
+
+            for name, value in sorted(self._gauges.items()):
+                lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+                lines.append(f"{METRIC_PREFIX}_{name} {value:g}")
+
+            for name, histogram in sorted(self._histograms.items()):
+                metric = f"{METRIC_PREFIX}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {count}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram[-2]}')
+                lines.append(f"{metric}_sum {histogram[-1]:.6f}")
+                lines.append(f"{metric}_count {histogram[-2]}")
+        return "\n".join(lines) + "\n"
+
+
+# Shared by every run in this process and exposed by the /metrics endpoint
+REGISTRY = MetricsRegistry()
+
+
+class RunMetrics:
+    """
+    Metrics of a single analysis run: time spent per pipeline stage, event
+    counters, gauges (latest value, e.g. the concurrency limit) and observed
+    values (e.g. LLM latency) for percentiles. Everything is also forwarded to
+    the process-wide registry.
+
+    Thread-safe, so worker threads can record into the same run.
+    """
+
+    def __init__(self, registry=REGISTRY):
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self._stage_seconds = defaultdict(float)
+        self._stage_calls = defaultdict(int)
+        self._counters = defaultdict(int)
+        self._gauges = {}
+        self._observations = defaultdict(list)
+
+    def add_stage(self, stage, seconds):
+        with self._lock:
+            self._stage_seconds[stage] += seconds
+            self._stage_calls[stage] += 1
+        if self.registry is not None:
+            self.registry.add_stage(stage, seconds)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the enclosed block and adds it to stage `name`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def timed_iter(self, name, iterable):
+        """
+        Yields from `iterable`, charging the time spent producing each item to stage `name`.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_stage(name, time.perf_counter() - start)
+                return
+            self.add_stage(name, time.perf_counter() - start)
+            yield item
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+        if self.registry is not None:
+            self.registry.incr(name, amount)
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+        if self.registry is not None:
+            self.registry.set_gauge(name, value)
+
+    def observe(self, name, value):
+        with self._lock:
+            self._observations[name].append(value)
+        if self.registry is not None:
+            self.registry.observe(name, value)
+
+    def counter(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def report(self):
+        """
+        Returns the run's metrics as a JSON-serializable dict.
+        """
+        with self._lock:
+            return {
+                "started_at": self._started_at,
+                "wall_time_seconds": round(time.time() - self._started_at, 3),
+                "stages": {
+                    stage: {"seconds": round(seconds, 3), "calls": self._stage_calls[stage]}
+                    for stage, seconds in self._stage_seconds.items()
+                },
+                "counters": dict(self._counters),
+                "gauges": {name: round(value, 4) for name, value in self._gauges.items()},
+                "observations": {
+                    name: {
+                        "count": len(values),
+                        "mean": round(sum(values) / len(values), 4),
+                        "p50": round(percentile(values, 50), 4),
+                        "p90": round(percentile(values, 90), 4),
+                        "p99": round(percentile(values, 99), 4),
+                        "max": round(max(values), 4)
+                    }
+                    for name, values in self._observations.items() if values
+                }
+            }
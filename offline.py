@@ -0,0 +1,391 @@
+"""
+In-memory stand-ins for the OpenAI model, MongoDB and Redis, plus a synthetic
+repository generator, so the whole pipeline can run without any external service.
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import random
+import threading
+from contextlib import contextmanager
+
+import services
+
+_BATCH_FILE_HEADER = re.compile(r"^=== FILE \d+: (.+?) ===$", re.MULTILINE)
+_SINGLE_FILENAME = re.compile(r'"filename": "([^"]*)"')
+
+
+_CLASS_NAME = re.compile(r"\bclass\s+(\w+)")
+_FUNCTION = re.compile(r"^\s*(?:def\s+|public\s+\w+\s+|async\s+)?(\w+)\s*\([^)]*\)\s*[:{]", re.MULTILINE)
+
+
+def _analysis(filename, code):
+    # Descriptions only, like the prompts ask for; the rest comes from static analysis
+    methods = [{"signature": f"{name}()", "description": f"Synthetic description of {name}"}
+               for name in dict.fromkeys(_FUNCTION.findall(code)) if name not in ("if", "for", "while")]
+    return {
+        "filename": filename,
+        "description": f"Synthetic analysis of {filename}",
+        "classes": [{"name": name, "description": "Synthetic class", "methods": methods}
+                    for name in dict.fromkeys(_CLASS_NAME.findall(code))]
+    }
+
+
+# Marks the analyzer's repair prompt (see `llm_analyzer.repair_prompt_template`)
+_REPAIR_PROMPT = "Your previous answer could not be parsed"
+
+
+def _malformed(response, prompt):
+    # The defects models produce: code fences with trailing commas, cut-off output and plain prose
+    kind = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16) % 3
+    if kind == 0:
+        return f"```json\n{response[:-1]},{response[-1]}\n```"
+    if kind == 1:
+        return response[:max(1, len(response) * 2 // 3)]
+    return "Sorry, I can't produce JSON for this file."
+
+
+class FakeRateLimitError(Exception):
+    """The offline model's "429 Too Many Requests", shaped like the OpenAI client's."""
+
+    status_code = 429
+
+    def __init__(self, retry_after=None):
+        super().__init__("Error code: 429 - Rate limit reached (injected by the offline LLM)")
+        self.retry_after = retry_after
+
+
+class FakeLLM:
+    """
+    Deterministic stand-in for the chat model, answering the analyzer's prompts offline.
+
+    Chunk prompts get a minimal valid description JSON, batch prompts a JSON array
+    with one object per file and any other prompt (the summaries) a fixed text.
+    Every call sleeps for `latency` seconds and fails with probability
+    `failure_rate`, is rate limited (429) with probability `rate_limit_rate` or
+    times out with probability `timeout_rate`; which of these happens only depends
+    on the prompt, how often it was sent before and `seed`, so runs are
+    reproducible regardless of thread timing. With `capacity`, calls made while
+    that many are already in flight are rate limited too, like a provider's
+    concurrency limit. With probability `malformed_rate` an analysis comes back
+    malformed (see `_malformed`); repair prompts always get valid JSON.
+    """
+
+    def __init__(self, latency=0.05, failure_rate=0.0, seed=0, rate_limit_rate=0.0, timeout_rate=0.0,
+                 capacity=None, retry_after=0.05, malformed_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.timeout_rate = timeout_rate
+        self.capacity = capacity
+        self.malformed_rate = malformed_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.calls = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.timeouts = 0
+        self.malformed = 0
+        self.in_flight = 0
+        self._sent = {}  # prompt digest -> times sent
+        self._lock = threading.Lock()
+
+    def _injected_fault(self, prompt):
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        with self._lock:
+            attempt = self._sent.get(digest, 0)
+            self._sent[digest] = attempt + 1
+        draw = random.Random(f"{self.seed}:{digest}:{attempt}").random()
+        for fault, rate in (("failure", self.failure_rate), ("rate_limit", self.rate_limit_rate),
+                            ("timeout", self.timeout_rate), ("malformed", self.malformed_rate)):
+            if draw < rate:
+                return fault
+            draw -= rate
+        return None
+
+    def invoke(self, prompt):
+        with self._lock:
+            over_capacity = self.capacity is not None and self.in_flight >= self.capacity
+            self.in_flight += 1
+            self.calls += 1
+        try:
+            time.sleep(self.latency)
+            fault = "rate_limit" if over_capacity else self._injected_fault(prompt)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+        if fault == "failure":
+            with self._lock:
+                self.failures += 1
+            raise RuntimeError("Injected failure from the offline LLM")
+        if fault == "rate_limit":
+            with self._lock:
+                self.rate_limited += 1
+            raise FakeRateLimitError(retry_after=self.retry_after)
+        if fault == "timeout":
+            with self._lock:
+                self.timeouts += 1
+            raise TimeoutError("Request timed out (injected by the offline LLM)")
+
+        if _REPAIR_PROMPT in prompt:
+            match = _SINGLE_FILENAME.search(prompt)
+            return json.dumps(_analysis(match.group(1) if match else "unknown", ""))
+        names = _BATCH_FILE_HEADER.findall(prompt)
+        if names:
+            blocks = _BATCH_FILE_HEADER.split(prompt)[2::2]
+            response = json.dumps([_analysis(name, code) for name, code in zip(names, blocks)])
+        elif "Code:\n" in prompt:
+            match = _SINGLE_FILENAME.search(prompt)
+            response = json.dumps(_analysis(match.group(1) if match else "unknown", prompt.split("Code:\n", 1)[1]))
+        else:
+            return "Synthetic summary of this part of the codebase."
+        if fault == "malformed":
+            with self._lock:
+                self.malformed += 1
+            return _malformed(response, prompt)
+        return response
+
+
+def _matches(doc, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(_matches(doc, sub) for sub in condition):
+                return False
+            continue
+        value = doc.get(key)
+        if isinstance(condition, dict) and any(op.startswith("$") for op in condition):
+            for op, operand in condition.items():
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$gt" and (value is None or not value > operand):
+                    return False
+                if op == "$lte" and (value is None or not value <= operand):
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return dict(doc)
+    return {k: v for k, v in doc.items() if k == "_id" or projection.get(k)}
+
+
+class _Cursor:
+    # Like MongoDB, sorts on the whole documents and applies the projection to the results
+    def __init__(self, docs, projection=None):
+        self._docs = docs
+        self._projection = projection
+
+    def sort(self, keys):
+        for key, direction in reversed(keys):
+            self._docs.sort(key=lambda d: (d.get(key) is not None, d.get(key)), reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        self._docs = self._docs[:count]
+        return self
+
+    def __iter__(self):
+        return (_project(d, self._projection) for d in self._docs)
+
+
+class MemoryCollection:
+    """
+    Subset of a pymongo collection used by the pipeline, kept in a dict.
+
+    Every call counts as one round-trip in `round_trips`, shared by all collections
+    of a `MemoryDatabase`.
+    """
+
+    def __init__(self, name, database):
+        self.name = name
+        self.database = database
+        self.docs = {}
+
+    def _trip(self):
+        with self.database.lock:
+            self.database.round_trips += 1
+
+    def create_index(self, keys, **kwargs):
+        self._trip()
+
+    def insert_one(self, doc):
+        self._trip()
+        self.docs[doc.setdefault("_id", os.urandom(12).hex())] = doc
+
+    def insert_many(self, docs, ordered=True):
+        self._trip()
+        for doc in docs:
+            self.docs[doc.setdefault("_id", os.urandom(12).hex())] = doc
+
+    def _update(self, query, update, upsert=False):
+        doc = next((d for d in self.docs.values() if _matches(d, query)), None)
+        if doc is None:
+            if not upsert:
+                return
+            doc = {k: v for k, v in query.items() if not k.startswith("$")}
+            doc.update(update.get("$setOnInsert", {}))
+            self.docs[doc.setdefault("_id", os.urandom(12).hex())] = doc
+        doc.update(update.get("$set", {}))
+        for key, amount in update.get("$inc", {}).items():
+            doc[key] = doc.get(key, 0) + amount
+
+    def update_one(self, query, update, upsert=False):
+        self._trip()
+        self._update(query, update, upsert)
+
+    def bulk_write(self, requests, ordered=True):
+        self._trip()
+        for op in requests:
+            # pymongo's UpdateOne keeps its arguments in these attributes
+            self._update(op._filter, op._doc, op._upsert)
+
+    def find(self, query=None, projection=None):
+        self._trip()
+        return _Cursor([d for d in self.docs.values() if _matches(d, query or {})], projection)
+
+    def find_one(self, query=None, projection=None, sort=None):
+        cursor = self.find(query, projection)
+        if sort:
+            cursor.sort(sort)
+        return next(iter(cursor), None)
+
+    def count_documents(self, query):
+        self._trip()
+        return sum(1 for d in self.docs.values() if _matches(d, query))
+
+    def distinct(self, key, query=None):
+        self._trip()
+        return list(dict.fromkeys(d.get(key) for d in self.docs.values() if _matches(d, query or {})))
+
+    def delete_many(self, query):
+        self._trip()
+        for doc_id in [i for i, d in self.docs.items() if _matches(d, query)]:
+            del self.docs[doc_id]
+
+
+class MemoryDatabase:
+    """Creates `MemoryCollection`s on access and counts their round-trips."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.round_trips = 0
+        self._collections = {}
+
+    def __getitem__(self, name):
+        with self.lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(name, self)
+            return self._collections[name]
+
+
+class MemoryRedis:
+    """Subset of the redis client used by the caches and job store (string values, expiry)."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+        self.round_trips = 0
+
+    def get(self, key):
+        with self._lock:
+            self.round_trips += 1
+            value, expires = self._data.get(key, (None, None))
+            if expires is not None and expires <= time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self.round_trips += 1
+            self._data[key] = (value, time.time() + ex if ex else None)
+
+    def setex(self, key, ttl, value):
+        self.set(key, value, ex=ttl)
+
+    def delete(self, *keys):
+        with self._lock:
+            self.round_trips += 1
+            for key in keys:
+                self._data.pop(key, None)
+
+    def ping(self):
+        return True
+
+    def flushdb(self):
+        with self._lock:
+            self.round_trips += 1
+            self._data.clear()
+
+
+_PYTHON_METHOD = "    def {name}(self, value):\n        result = value * {i} + {seed}\n        return result\n\n"
+_JAVA_METHOD = ("    public int {name}(int value) {{\n        int result = value * {i} + {seed};\n"
+                "        return result;\n    }}\n\n")
+_JS_METHOD = "  {name}(value) {{\n    const result = value * {i} + {seed};\n    return result;\n  }}\n\n"
+
+_LANGUAGES = {
+    "py": ("import os\n\n\nclass {cls}:\n", _PYTHON_METHOD, ""),
+    "java": ("package synthetic;\n\nimport java.util.List;\n\npublic class {cls} {{\n", _JAVA_METHOD, "}}\n"),
+    "js": ("const path = require('path');\n\nclass {cls} {{\n", _JS_METHOD, "}}\n\nmodule.exports = {cls};\n"),
+}
+
+
+def synthetic_repo(directory, num_files=100, lines_per_file=200, languages=("py", "java", "js"),
+                   files_per_dir=20, seed=0):
+    """
+    Writes a reproducible synthetic code base of `num_files` files of about
+    `lines_per_file` lines each, cycling through `languages` ("py", "java", "js")
+    and grouping `files_per_dir` files per directory.
+
+    Returns:
+        int: Total number of bytes written.
+    """
+    rng = random.Random(seed)
+    written = 0
+    for i in range(num_files):
+        ext = languages[i % len(languages)]
+        header, method, footer = _LANGUAGES[ext]
+        cls = f"Module{i}"
+        parts = [header.format(cls=cls)]
+        lines, m = parts[0].count("\n"), 0
+        while lines < lines_per_file:
+            body = method.format(name=f"handle{m}", i=m, seed=rng.randint(0, 10 ** 6))
+            parts.append(body)
+            lines += body.count("\n")
+            m += 1
+        parts.append(footer.format(cls=cls))
+
+        sub_dir = os.path.join(directory, f"pkg_{i // (files_per_dir * 10)}", f"sub_{i // files_per_dir}")
+        os.makedirs(sub_dir, exist_ok=True)
+        with open(os.path.join(sub_dir, f"module_{i}.{ext}"), "w", encoding="utf-8") as f:
+            written += f.write("".join(parts))
+    return written
+
+
+@contextmanager
+def offline_services(llm, database=None, redis_client=None):
+    """
+    Points the service registry at `llm` and in-memory MongoDB/Redis stand-ins
+    for the duration of the block, restoring the previous services afterwards.
+
+    Yields:
+        tuple: The (MemoryDatabase, MemoryRedis) in use.
+    """
+    database = database if database is not None else MemoryDatabase()
+    redis_client = redis_client if redis_client is not None else MemoryRedis()
+    replacements = {"mongo": database, "redis": redis_client, "llm": llm}
+
+    previous = {name: services.registry.override(name, value) for name, value in replacements.items()}
+    try:
+        yield database, redis_client
+    finally:
+        for name, value in previous.items():
+            services.registry.override(name, value)
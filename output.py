@@ -0,0 +1,73 @@
+import json
+
+# Largest page of file entries served from a summary
+MAX_PAGE_SIZE = 500
+
+
+def ndjson_path(json_path):
+    """Path of the NDJSON copy written next to a final_summary.json."""
+    return json_path[:-len(".json")] + ".ndjson" if json_path.endswith(".json") else json_path + ".ndjson"
+
+
+def write_json_summary(path, final_output):
+    """
+    Writes `final_output` as JSON one file entry at a time, so the document is
+    never built as a single string. Each file entry goes on its own line.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{")
+        for i, (key, value) in enumerate(final_output.items()):
+            f.write(("," if i else "") + f"\n  {json.dumps(key)}: ")
+            if key != "files":
+                f.write(json.dumps(value))
+                continue
+            f.write("[")
+            for j, entry in enumerate(value):
+                f.write(("," if j else "") + "\n    " + json.dumps(entry))
+            f.write("\n  ]")
+        f.write("\n}\n")
+
+
+def write_ndjson_summary(path, final_output):
+    """
+    Writes `final_output` as NDJSON: a first line with everything but the file
+    entries (the project overview), then one line per file entry.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({k: v for k, v in final_output.items() if k != "files"}) + "\n")
+        for entry in final_output.get("files", []):
+            f.write(json.dumps(entry) + "\n")
+
+
+def read_ndjson_page(path, cursor=None, limit=100):
+    """
+    Reads one page of file entries from an NDJSON summary.
+
+    Args:
+        cursor (int): Byte offset returned as `next` by the previous page; None
+                      starts at the first file and also returns the header.
+        limit (int): Number of file entries to return (capped at MAX_PAGE_SIZE).
+
+    Returns:
+        dict: {"files": [...], "next": offset of the next page or None}, plus
+              "header" on the first page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    page = {}
+    with open(path, "rb") as f:
+        if cursor is None:
+            page["header"] = json.loads(f.readline())
+        else:
+            f.seek(cursor)
+
+        files = []
+        while len(files) < limit:
+            line = f.readline()
+            if not line:
+                break
+            files.append(json.loads(line))
+
+        page["files"] = files
+        position = f.tell()
+        page["next"] = position if f.readline() else None
+    return page
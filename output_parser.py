@@ -0,0 +1,219 @@
+"""
+Parses the analyzer's JSON responses: strips code fences and surrounding text,
+repairs common defects (trailing commas, smart quotes, Python literals, raw line
+breaks inside strings, output cut off mid-object) and validates the result
+against the structure `llm_analyzer.prompt_template` asks for.
+"""
+import re
+import json
+
+# How a response was parsed
+OK, REPAIRED = "ok", "repaired"
+
+# Truncated responses are cut back to at most this many earlier commas before giving up
+MAX_TRUNCATION_CUTS = 20
+
+_FENCE = re.compile(r"```[A-Za-z]*[ \t]*\n?(.*?)(?:```|$)", re.DOTALL)
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_CLOSERS = {"{": "}", "[": "]"}
+_STRING_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+_WORD = re.compile(r"\w+")
+
+
+class OutputParseError(ValueError):
+    """Raised when a response is not valid JSON of the expected structure, even after repair."""
+
+
+def extract_json(text):
+    """
+    Returns the JSON part of a model response: the contents of the first code
+    fence if there is one, from the first "{" or "[" up to the matching last
+    "}" or "]" (or the end, if the response was cut off).
+    """
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return text.strip()
+    start = min(starts)
+    end = text.rfind(_CLOSERS[text[start]])
+    return text[start:end + 1] if end > start else text[start:]
+
+
+def _scan(text):
+    """
+    Rewrites `text` into stricter JSON in one pass: smart quotes, Python literals
+    and trailing commas are fixed and raw line breaks in strings are escaped.
+
+    Returns:
+        tuple: (rewritten text, brackets still open at the end, string still open
+               at the end, [(length of the output before a comma, brackets open there)]).
+    """
+    out, stack, commas = [], [], []
+    in_string = escaped = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            out.append(_STRING_ESCAPES.get(char, char))
+            i += 1
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in _CLOSERS:
+            stack.append(char)
+        elif char in "}]":
+            # Drop a trailing comma before the closing bracket
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if stack:
+                stack.pop()
+        elif char == ",":
+            commas.append((len(out), list(stack)))
+        elif char.isalpha():
+            match = _WORD.match(text, i)
+            if match is None:
+                raise OutputParseError(f"unexpected character {char!r} at position {i}")
+            word = match.group()
+            out.append(_LITERALS.get(word, word))
+            i += len(word)
+            continue
+        out.append(char)
+        i += 1
+    return "".join(out), stack, in_string, commas
+
+
+def _close(text, stack):
+    text = text.rstrip().rstrip(",:").rstrip()
+    return text + "".join(_CLOSERS[bracket] for bracket in reversed(stack))
+
+
+def repair_json(text):
+    """
+    Parses `text` after fixing common defects of model output. A response cut
+    off mid-way keeps everything up to the last complete value.
+
+    Raises:
+        OutputParseError: If no repair yields valid JSON.
+    """
+    text = extract_json(text.translate(_SMART_QUOTES))
+    rewritten, stack, in_string, commas = _scan(text)
+    candidates = [_close(rewritten + ('"' if in_string else ""), stack)]
+    # Cut back to an earlier comma to drop a half-written key or value
+    candidates += [_close(rewritten[:length], open_brackets)
+                   for length, open_brackets in reversed(commas[-MAX_TRUNCATION_CUTS:])]
+
+    error = None
+    for candidate in candidates:
+        try:
+            return json.loads(candidate)
+        except ValueError as e:
+            error = error or e
+    raise OutputParseError(f"invalid JSON: {error}")
+
+
+def loads(text):
+    """
+    Parses a model response as JSON, repairing it if needed.
+
+    Returns:
+        tuple: (parsed value, OK or REPAIRED)
+
+    Raises:
+        OutputParseError: If the response can't be parsed even after repair.
+    """
+    if not isinstance(text, str):
+        raise OutputParseError(f"expected text, got {type(text).__name__}")
+    try:
+        return json.loads(text), OK
+    except ValueError:
+        pass
+    try:
+        return repair_json(text), REPAIRED
+    except OutputParseError:
+        raise
+    except Exception as e:
+        # A defect the repair pass didn't anticipate is still just an unparseable response
+        raise OutputParseError(f"repair failed: {type(e).__name__}: {e}") from e
+
+
+def _text(value):
+    return value if isinstance(value, str) else ("" if value is None else str(value))
+
+
+def validate_analysis(value, filename):
+    """
+    Checks a parsed chunk analysis against the prompt's structure and normalizes
+    it: missing descriptions become "", methods without a signature and entries
+    that aren't objects are dropped.
+
+    Returns:
+        dict: filename, description and classes (name, description, methods with
+              signature and description).
+
+    Raises:
+        OutputParseError: If `value` isn't an analysis object.
+    """
+    if not isinstance(value, dict):
+        raise OutputParseError(f"expected a JSON object, got {type(value).__name__}")
+    if "description" not in value and "classes" not in value:
+        raise OutputParseError("the object has neither a description nor classes")
+    classes = value.get("classes") or []
+    if not isinstance(classes, list):
+        raise OutputParseError("classes is not a list")
+
+    result = {"filename": filename, "description": _text(value.get("description")), "classes": []}
+    for cls in classes:
+        if not isinstance(cls, dict) or not cls.get("name"):
+            continue
+        methods = cls.get("methods") or []
+        result["classes"].append({
+            "name": _text(cls["name"]),
+            "description": _text(cls.get("description")),
+            "methods": [{"signature": _text(m["signature"]), "description": _text(m.get("description"))}
+                        for m in (methods if isinstance(methods, list) else [])
+                        if isinstance(m, dict) and m.get("signature")]
+        })
+    return result
+
+
+def parse_analysis(text, filename):
+    """
+    Parses and validates the response to a chunk prompt.
+
+    Returns:
+        tuple: (analysis dict, OK or REPAIRED)
+
+    Raises:
+        OutputParseError: If the response isn't a valid analysis, even after repair.
+    """
+    value, status = loads(text)
+    return validate_analysis(value, filename), status
+
+
+def parse_batch(text, filenames):
+    """
+    Parses and validates the response to a batch prompt: a JSON array with one
+    analysis per file, in order.
+
+    Returns:
+        tuple: ([analysis dict per file], OK or REPAIRED)
+
+    Raises:
+        OutputParseError: If the response isn't such an array, even after repair.
+    """
+    value, status = loads(text)
+    if not isinstance(value, list) or len(value) != len(filenames):
+        raise OutputParseError(f"expected a JSON array of {len(filenames)} objects")
+    return [validate_analysis(item, filename) for item, filename in zip(value, filenames)], status
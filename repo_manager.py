@@ -0,0 +1,336 @@
+import os
+import re
+import json
+import time
+import shutil
+import subprocess
+import threading
+from contextlib import contextmanager
+
+# Where mirrors and checkouts of remote repositories are kept
+CLONE_DIR = os.getenv("CLONE_DIR", os.path.join(os.getcwd(), "temp", "repos"))
+
+# Least recently used checkouts (then unused mirrors) are removed above this total size
+CLONE_DISK_BUDGET = int(os.getenv("CLONE_DISK_BUDGET_MB", "2048")) * 1024 * 1024
+
+# Seconds before a git command is abandoned
+GIT_TIMEOUT = int(os.getenv("GIT_TIMEOUT", "600"))
+
+REMOTE_PREFIXES = ("http://", "https://", "file://", "ssh://", "git@")
+
+_GITHUB_URL = re.compile(r"https?://github\.com/([^/]+)/([^/#]+?)(?:\.git)?(?:/tree/(.+?))?/?$")
+
+
+class GitError(Exception):
+    """Raised when a git command fails or a branch/sub-directory can't be found."""
+
+
+def is_remote(path):
+    """Returns True if `path` is a repository URL rather than a local directory."""
+    return path.startswith(REMOTE_PREFIXES)
+
+
+def _git(*args, cwd=None):
+    try:
+        result = subprocess.run(["git", *args], cwd=cwd, capture_output=True, text=True, timeout=GIT_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise GitError(f"git {args[0]} failed: {e}")
+    if result.returncode != 0:
+        raise GitError(f"git {' '.join(args)} failed: {result.stderr.strip()}")
+    return result.stdout
+
+
+def _safe_name(name):
+    return re.sub(r"[^A-Za-z0-9._-]", "_", name)
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def parse_repo_url(url):
+    """
+    Splits a repository URL into its remote, owner, repository name and tree part
+    (branch and sub-directory, still joined since branch names may contain "/").
+
+    Supports GitHub URLs (`https://github.com/<owner>/<repo>[/tree/<branch>[/<subdir>]]`)
+    and any other git remote (e.g. `file:///srv/git/app.git`), optionally followed by
+    `#<branch>[/<subdir>]`.
+
+    Returns:
+        dict: remote, owner, repo and tree.
+    """
+    match = _GITHUB_URL.match(url)
+    if match:
+        owner, repo, tree = match.groups()
+        return {"remote": f"https://github.com/{owner}/{repo}.git", "owner": owner, "repo": repo,
+                "tree": tree or ""}
+    if not is_remote(url):
+        raise ValueError(f"'{url}' is not a repository URL")
+
+    remote, _, tree = url.partition("#")
+    parts = [p for p in re.split(r"[/:]", remote.rstrip("/")) if p]
+    repo = parts[-1][:-len(".git")] if parts[-1].endswith(".git") else parts[-1]
+    owner = parts[-2] if len(parts) > 2 else "_"
+    return {"remote": remote, "owner": owner, "repo": repo, "tree": tree.strip("/")}
+
+
+def project_key(spec):
+    """
+    Key the stored analysis of a resolved repository (see `RepoManager.resolve`)
+    is kept under: its remote, branch and sub-directory, but not the commit, so
+    every commit of a branch updates the same project.
+    """
+    return f"{spec['remote']}#{spec['branch']}" + (f"/{spec['subdir']}" if spec["subdir"] else "")
+
+
+class RepoManager:
+    """
+    Keeps local checkouts of remote repositories, shared by all analyses.
+
+    Each repository has one bare mirror, updated with shallow (and, where the
+    server supports it, blobless) fetches of the requested branch only. Each
+    owner/repo/branch/commit gets its own worktree of that mirror, so an update
+    never changes files under a running analysis. Worktrees for `/tree/<branch>/<subdir>`
+    URLs are sparse: only the sub-directory (and the files at the repository root)
+    are checked out, and other sub-directories are added on demand.
+
+    Checkouts are evicted least recently used first once the total size exceeds
+    `disk_budget`; checkouts leased by a running analysis are never evicted.
+    `on_evict` is called with the directory of each evicted checkout and the
+    keys (see `project_key`) of the projects checked out in it.
+    """
+
+    def __init__(self, base_dir=CLONE_DIR, disk_budget=CLONE_DISK_BUDGET, on_evict=None):
+        self.base_dir = base_dir
+        self.disk_budget = disk_budget
+        self.on_evict = on_evict
+        self._index_path = os.path.join(base_dir, "index.json")
+        self._lock = threading.Lock()  # Guards the index, the leases and the per-mirror locks
+        self._mirror_locks = {}
+        self._leases = {}  # checkout dir -> number of running analyses
+        os.makedirs(base_dir, exist_ok=True)
+
+    # === Index of mirrors and checkouts (size, last use) ===
+
+    def _load_index(self):
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"mirrors": {}, "checkouts": {}}
+
+    def _save_index(self, index):
+        tmp_path = f"{self._index_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self._index_path)
+
+    def _record(self, kind, path, project=None, **fields):
+        with self._lock:
+            index = self._load_index()
+            entry = index[kind].setdefault(path, {})
+            entry.update(fields, last_used=time.time())
+            if project is not None and project not in entry.setdefault("projects", []):
+                entry["projects"].append(project)
+            self._save_index(index)
+
+    def _mirror_lock(self, mirror):
+        with self._lock:
+            return self._mirror_locks.setdefault(mirror, threading.Lock())
+
+    # === Resolve, fetch and check out ===
+
+    def resolve(self, url):
+        """
+        Resolves `url` to the commit its branch points to right now, with a single
+        `git ls-remote` (nothing is downloaded).
+
+        Returns:
+            dict: remote, owner, repo, branch, subdir and commit.
+
+        Raises:
+            GitError: If the remote can't be reached or has no matching branch.
+        """
+        spec = parse_repo_url(url)
+        tree = spec.pop("tree")
+
+        heads, default_branch = {}, None
+        for line in _git("ls-remote", "--symref", spec["remote"], "HEAD", "refs/heads/*").splitlines():
+            target, _, ref = line.partition("\t")
+            if target.startswith("ref: refs/heads/") and ref == "HEAD":
+                default_branch = target[len("ref: refs/heads/"):]
+            elif ref.startswith("refs/heads/"):
+                heads[ref[len("refs/heads/"):]] = target
+
+        if tree:
+            # Branch names may contain "/": pick the longest branch the tree path starts with
+            branch = max((b for b in heads if tree == b or tree.startswith(b + "/")), key=len, default=None)
+            if branch is None:
+                raise GitError(f"No branch of {spec['remote']} matches '{tree}'")
+            subdir = tree[len(branch):].strip("/")
+        else:
+            branch, subdir = default_branch, ""
+            if branch not in heads:
+                raise GitError(f"{spec['remote']} has no default branch")
+
+        return dict(spec, branch=branch, subdir=subdir, commit=heads[branch])
+
+    def _paths(self, spec):
+        repo_dir = os.path.join(self.base_dir, _safe_name(spec["owner"]), _safe_name(spec["repo"]))
+        checkout_dir = os.path.join(repo_dir, f"{_safe_name(spec['branch'])}@{spec['commit'][:12]}")
+        return repo_dir + ".git", checkout_dir
+
+    def _fetch(self, mirror, spec):
+        if not os.path.isdir(mirror):
+            _git("init", "--quiet", "--bare", mirror)
+            _git("remote", "add", "origin", spec["remote"], cwd=mirror)
+        try:
+            _git("cat-file", "-e", f"{spec['commit']}^{{commit}}", cwd=mirror)
+            return  # Already fetched
+        except GitError:
+            pass
+
+        branch_ref = f"refs/heads/{spec['branch']}"
+        _git("fetch", "--quiet", "--depth", "1", "--filter=blob:none", "origin", f"+{branch_ref}:{branch_ref}",
+             cwd=mirror)
+        fetched = _git("rev-parse", branch_ref, cwd=mirror).strip()
+        if fetched != spec["commit"]:
+            # The branch moved since `resolve`: check out what was actually fetched
+            print(f"[REPO] {spec['remote']} {spec['branch']} moved to {fetched[:12]}")
+            spec["commit"] = fetched
+        self._record("mirrors", mirror, size=_dir_size(mirror))
+
+    def _cone(self, checkout_dir):
+        """Directories a sparse worktree has checked out, or None if it's a full checkout."""
+        try:
+            if _git("config", "--type=bool", "core.sparseCheckout", cwd=checkout_dir).strip() != "true":
+                return None
+        except GitError:
+            return None  # Not set: full checkout
+        return _git("sparse-checkout", "list", cwd=checkout_dir).splitlines()
+
+    def _ensure_checkout(self, mirror, checkout_dir, spec):
+        subdir = spec["subdir"]
+        if not os.path.isdir(checkout_dir):
+            _git("worktree", "prune", cwd=mirror)
+            _git("worktree", "add", "--quiet", "--no-checkout", "--detach", checkout_dir, spec["commit"], cwd=mirror)
+            if subdir:
+                _git("sparse-checkout", "set", "--cone", subdir, cwd=checkout_dir)
+            _git("checkout", "--quiet", "--detach", cwd=checkout_dir)
+        else:
+            # A checkout of the same commit for another sub-directory: widen its cone if needed
+            cone = self._cone(checkout_dir)
+            if cone is None:
+                return
+            if not subdir:
+                _git("sparse-checkout", "disable", cwd=checkout_dir)
+            elif not any(subdir == d or subdir.startswith(d + "/") for d in cone):
+                _git("sparse-checkout", "add", subdir, cwd=checkout_dir)
+            else:
+                return
+        self._record("checkouts", checkout_dir, mirror=mirror, size=_dir_size(checkout_dir))
+
+    def checkout(self, spec):
+        """
+        Returns the local directory of `spec["subdir"]` at `spec["commit"]` (see
+        `resolve`), fetching and checking out only what isn't there yet.
+
+        Raises:
+            GitError: If a git command fails or the sub-directory doesn't exist.
+        """
+        mirror, checkout_dir = self._paths(spec)
+        with self._mirror_lock(mirror):
+            self._fetch(mirror, spec)
+            mirror, checkout_dir = self._paths(spec)  # The commit may have moved
+            self._ensure_checkout(mirror, checkout_dir, spec)
+            self._record("checkouts", checkout_dir, project=project_key(spec), mirror=mirror)
+
+        path = os.path.join(checkout_dir, spec["subdir"]) if spec["subdir"] else checkout_dir
+        if not os.path.isdir(path):
+            raise GitError(f"'{spec['subdir']}' does not exist in {spec['branch']}")
+        self.evict(keep=checkout_dir)
+        return path
+
+    @contextmanager
+    def lease(self, spec):
+        """
+        Checks out `spec` and keeps it from being evicted until the block exits.
+
+        Yields:
+            str: The local directory of the requested sub-directory.
+        """
+        _, checkout_dir = self._paths(spec)
+        with self._lock:
+            self._leases[checkout_dir] = self._leases.get(checkout_dir, 0) + 1
+        try:
+            path = self.checkout(spec)
+            # `checkout` may have moved to a newer commit
+            _, actual_dir = self._paths(spec)
+            if actual_dir != checkout_dir:
+                with self._lock:
+                    self._leases[actual_dir] = self._leases.get(actual_dir, 0) + 1
+                    self._release(checkout_dir)
+                checkout_dir = actual_dir
+            yield path
+        finally:
+            with self._lock:
+                self._release(checkout_dir)
+
+    def _release(self, checkout_dir):
+        self._leases[checkout_dir] -= 1
+        if not self._leases[checkout_dir]:
+            del self._leases[checkout_dir]
+
+    # === Eviction ===
+
+    def evict(self, keep=None):
+        """
+        Removes least recently used checkouts, then mirrors left without checkouts,
+        until the total size fits the disk budget.
+        """
+        evicted = []
+        with self._lock:
+            index = self._load_index()
+            total = sum(e.get("size", 0) for kind in ("mirrors", "checkouts") for e in index[kind].values())
+            if total <= self.disk_budget:
+                return
+
+            candidates = sorted(((e["last_used"], path) for path, e in index["checkouts"].items()
+                                 if path != keep and path not in self._leases))
+            for _, path in candidates:
+                if total <= self.disk_budget:
+                    break
+                entry = index["checkouts"].pop(path)
+                try:
+                    _git("worktree", "remove", "--force", path, cwd=entry["mirror"])
+                except GitError:
+                    shutil.rmtree(path, ignore_errors=True)
+                total -= entry.get("size", 0)
+                evicted.append((path, entry.get("projects", [])))
+                print(f"[REPO] Evicted checkout {path}")
+
+            used_mirrors = {e["mirror"] for e in index["checkouts"].values()}
+            for _, path in sorted((e["last_used"], p) for p, e in index["mirrors"].items()):
+                if total <= self.disk_budget:
+                    break
+                if path in used_mirrors:
+                    continue
+                total -= index["mirrors"].pop(path).get("size", 0)
+                shutil.rmtree(path, ignore_errors=True)
+                shutil.rmtree(path[:-len(".git")], ignore_errors=True)  # Leftover worktree folder
+                print(f"[REPO] Evicted mirror {path}")
+
+            self._save_index(index)
+
+        # Outside the lock: dropping what was stored for a checkout may take a while
+        if self.on_evict is not None:
+            for path, projects in evicted:
+                self.on_evict(path, projects)
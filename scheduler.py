@@ -0,0 +1,377 @@
+import os
+import re
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Maximum number of LLM requests allowed in flight at the same time
+MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+
+# Per-minute budgets for the LLM provider (0 disables the limit)
+REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+
+# Rough number of tokens taken by the prompt template around each chunk
+PROMPT_OVERHEAD_TOKENS = 300
+
+# Retries of a failed LLM call, with exponential backoff and full jitter
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "1.0"))
+RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "30.0"))
+# Rate limits and timeouts clear up on their own, so they get more retries
+RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "6"))
+
+# Lowest concurrency the adaptive limiter backs off to
+MIN_IN_FLIGHT = int(os.getenv("LLM_MIN_IN_FLIGHT", "1"))
+
+# Jobs read ahead and dispatched largest first (0 keeps the input order)
+PRIORITY_WINDOW = int(os.getenv("LLM_PRIORITY_WINDOW", "32"))
+
+# Kinds of LLM errors; all but ERROR are transient and make the limiter back off
+RATE_LIMITED, TIMEOUT, UNAVAILABLE, ERROR = "rate_limit", "timeout", "unavailable", "error"
+TRANSIENT_ERRORS = (RATE_LIMITED, TIMEOUT, UNAVAILABLE)
+
+_RETRY_IN_MESSAGE = re.compile(r"try again in ([\d.]+)\s*(ms|s)\b", re.IGNORECASE)
+_DURATION_PART = re.compile(r"([\d.]+)(ms|s|m|h)")
+
+
+def estimate_tokens(text):
+    """
+    Cheap token estimate (about 4 characters per token) used for rate budgeting.
+
+    Args:
+        text (str): The text that will be sent to the model.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return len(text) // 4 + 1
+
+
+class RateBudget:
+    """
+    Sliding one-minute window over the number of requests and tokens sent.
+
+    `acquire` blocks the calling thread until the request fits in both budgets,
+    so it can be called from worker threads right before hitting the LLM.
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, window=60.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._events = deque()  # (timestamp, tokens) of requests inside the window
+        self._tokens_in_window = 0
+
+    @property
+    def enabled(self):
+        return bool(self.requests_per_minute or self.tokens_per_minute)
+
+    def _prune(self, now):
+        while self._events and now - self._events[0][0] >= self.window:
+            _, tokens = self._events.popleft()
+            self._tokens_in_window -= tokens
+
+    def _fits(self, tokens):
+        if self.requests_per_minute and len(self._events) >= self.requests_per_minute:
+            return False
+        if self.tokens_per_minute and self._events and \
+                self._tokens_in_window + tokens > self.tokens_per_minute:
+            # A single oversized request is still let through once the window is empty
+            return False
+        return True
+
+    def acquire(self, tokens=0):
+        """
+        Waits until a request of `tokens` tokens can be sent, then records it.
+
+        Args:
+            tokens (int): Estimated token cost of the request.
+        """
+        if not self.enabled:
+            return
+
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._prune(now)
+                if self._fits(tokens):
+                    self._events.append((now, tokens))
+                    self._tokens_in_window += tokens
+                    return
+                wait = self._events[0][0] + self.window - now
+            self._sleep(max(wait, 0.01))
+
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def classify_error(error):
+    """
+    Sorts an exception raised by the LLM client into RATE_LIMITED (429), TIMEOUT,
+    UNAVAILABLE (5xx, overloaded) or ERROR (anything retrying won't fix, including
+    an exhausted quota, which is also reported as a 429).
+    """
+    status = _status_code(error)
+    name = type(error).__name__.lower()
+    text = str(error).lower()
+    if "insufficient_quota" in text:
+        return ERROR
+    if status == 429 or "ratelimit" in name or "rate limit" in text:
+        return RATE_LIMITED
+    if isinstance(error, TimeoutError) or "timeout" in name or "timed out" in text:
+        return TIMEOUT
+    if (status is not None and status >= 500) or "overloaded" in text or "connection" in name:
+        return UNAVAILABLE
+    return ERROR
+
+
+def _duration(value):
+    """Seconds in a header value such as "20", "1.5s", "250ms" or "6m0s"."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+def retry_after(error):
+    """
+    Seconds the provider asked to wait before retrying, from the error's
+    `retry-after` headers or its message, or None.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    if headers.get("retry-after-ms") is not None:
+        return _duration(headers["retry-after-ms"]) / 1000
+    seconds = _duration(headers.get("retry-after"))
+    if seconds is None:
+        seconds = _duration(getattr(error, "retry_after", None))
+    if seconds is None:
+        match = _RETRY_IN_MESSAGE.search(str(error))
+        if match:
+            seconds = float(match.group(1)) * (0.001 if match.group(2).lower() == "ms" else 1)
+    return seconds
+
+
+def rate_limit_pause(headers):
+    """
+    Seconds to hold back new requests according to the provider's rate-limit
+    headers on a successful response: until the reset, once a remaining
+    request or token count hits zero. None when nothing is exhausted.
+    """
+    if not headers:
+        return None
+    pauses = []
+    for kind in ("requests", "tokens"):
+        remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+        if remaining is not None and str(remaining).strip() == "0":
+            pauses.append(_duration(headers.get(f"x-ratelimit-reset-{kind}")) or 1.0)
+    return max(pauses) if pauses else None
+
+
+class AdaptiveLimiter:
+    """
+    Bounds the LLM requests in flight with an AIMD (additive increase,
+    multiplicative decrease) limit, like TCP congestion control.
+
+    Every successful call raises the limit by `increase / limit` (about +1 per
+    limit's worth of successes, up to `max_limit`); a rate limit, timeout or
+    overloaded server multiplies it by `decrease` (down to `min_limit`), at most
+    once per `cooldown` seconds so one burst of errors only counts once. A
+    provider's `retry-after` (or exhausted rate-limit headers) pauses all new
+    requests until it has passed.
+    """
+
+    def __init__(self, max_limit=MAX_IN_FLIGHT, min_limit=MIN_IN_FLIGHT, increase=1.0, decrease=0.5,
+                 cooldown=1.0, clock=time.monotonic):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self._clock = clock
+        self._cond = threading.Condition()
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = float("-inf")
+        self.outcomes = {}  # outcome -> count
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        with self._cond:
+            while True:
+                wait = self._paused_until - self._clock()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                self._cond.wait(timeout=wait if wait > 0 else None)
+
+    def release(self, outcome="ok", pause=None):
+        """
+        Records how a request ended: "ok" or one of the error kinds of
+        `classify_error`, with an optional pause (seconds) before the next request.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            now = self._clock()
+            if outcome == "ok":
+                self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+            elif outcome in TRANSIENT_ERRORS and now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                self._last_decrease = now
+            if pause:
+                self._paused_until = max(self._paused_until, now + pause)
+            self._cond.notify_all()
+
+    def call(self, fn, headers_of=None):
+        """
+        Runs `fn()` within the limit, feeding its outcome back into it.
+
+        Args:
+            headers_of (callable): Returns the rate-limit headers of `fn`'s result, if any.
+        """
+        self.acquire()
+        try:
+            result = fn()
+        except Exception as e:
+            kind = classify_error(e)
+            self.release(kind, retry_after(e) if kind in TRANSIENT_ERRORS else None)
+            raise
+        self.release("ok", rate_limit_pause(headers_of(result)) if headers_of else None)
+        return result
+
+
+def backoff_delay(attempt, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+    """
+    Returns the wait before retry number `attempt` (0-based): a random delay between 0
+    and base_delay * 2**attempt, capped at max_delay ("full jitter"), so that many
+    workers failing together don't retry in lockstep.
+    """
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def retry_call(fn, is_failure, retries=LLM_MAX_RETRIES, base_delay=RETRY_BASE_DELAY,
+               max_delay=RETRY_MAX_DELAY, sleep=time.sleep, retries_for=None):
+    """
+    Calls `fn()` until `is_failure(result)` is False or `retries` retries are used up.
+
+    Args:
+        retries_for (callable): If given, returns the number of retries allowed
+            after a given failed result (e.g. more for rate limits), instead of `retries`.
+
+    Returns:
+        tuple: (last result, number of attempts made)
+    """
+    attempts = 0
+    while True:
+        result = fn()
+        attempts += 1
+        if not is_failure(result) or attempts > (retries_for(result) if retries_for else retries):
+            return result, attempts
+        sleep(backoff_delay(attempts - 1, base_delay, max_delay))
+
+
+def run_ordered(jobs, worker, max_in_flight=None, budget=None, cost=None, priority=None,
+                window=PRIORITY_WINDOW, on_wait=None):
+    """
+    Runs `worker` over `jobs` on a thread pool and yields results in input order.
+
+    Jobs are pulled lazily from the iterable, so the caller can keep producing
+    work (e.g. walking the repository) while earlier jobs are being analyzed.
+    At most `max_in_flight` workers run at once; a few more jobs are queued
+    ahead so a slow head-of-line job doesn't starve the pool.
+
+    With `priority`, jobs are read `window` at a time and each window is
+    dispatched highest priority first (e.g. largest first, so the longest
+    requests don't end up in the tail); results are still yielded in input order.
+
+    Args:
+        jobs (iterable): The jobs to process.
+        worker (callable): Function called with a single job.
+        max_in_flight (int): Maximum number of concurrent worker calls.
+        budget (RateBudget): Optional rate budget acquired before each call.
+        cost (callable): Returns the token cost of a job for the budget, or None
+            for jobs that won't call the LLM (e.g. cache hits) and bypass it.
+        priority (callable): Returns a sort key of a job; higher is dispatched first.
+        window (int): Number of jobs ordered by `priority` at a time.
+        on_wait (callable): Called with the seconds spent blocked on each result,
+            which excludes the time spent producing jobs.
+
+    Yields:
+        tuple: (job, result) pairs, in the same order as `jobs`.
+    """
+    max_in_flight = max(1, max_in_flight or MAX_IN_FLIGHT)
+    max_pending = max_in_flight * 2
+    window = max(1, window) if priority is not None else 1
+
+    def call(job):
+        if budget is not None:
+            tokens = cost(job) if cost else 0
+            if tokens is not None:
+                budget.acquire(tokens)
+        return worker(job)
+
+    def result_of(future):
+        if on_wait is None:
+            return future.result()
+        started = time.perf_counter()
+        try:
+            return future.result()
+        finally:
+            on_wait(time.perf_counter() - started)
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        pending = deque()  # [job, future] in input order
+        unsubmitted = []  # Entries of `pending` waiting for their window to fill up
+
+        def submit_window():
+            if priority is not None:
+                unsubmitted.sort(key=lambda entry: priority(entry[0]), reverse=True)
+            for entry in unsubmitted:
+                entry[1] = pool.submit(call, entry[0])
+            unsubmitted.clear()
+
+        try:
+            for job in jobs:
+                entry = [job, None]
+                pending.append(entry)
+                unsubmitted.append(entry)
+                if len(unsubmitted) >= window:
+                    submit_window()
+                while len(pending) - len(unsubmitted) >= max_pending:
+                    head_job, future = pending.popleft()
+                    yield head_job, result_of(future)
+
+            submit_window()
+            while pending:
+                head_job, future = pending.popleft()
+                yield head_job, result_of(future)
+        finally:
+            # If the caller stops early (cancellation or an error), drop queued work
+            for _, future in pending:
+                if future is not None:
+                    future.cancel()
+
+
+def default_budget():
+    """Builds a RateBudget from the LLM_*_PER_MINUTE environment variables."""
+    return RateBudget(REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE)
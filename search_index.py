@@ -0,0 +1,335 @@
+"""
+Local search over analyzed files, classes and methods.
+
+Every description, class name and method signature of a project is indexed
+in memory as results come in: an inverted index ranked with BM25, plus, when
+NumPy is installed, hashed embedding vectors searched by cosine similarity.
+Nothing leaves the process.
+"""
+import os
+import re
+import math
+import heapq
+import zlib
+import functools
+import threading
+from collections import Counter
+
+# Dimensions of the hashed embedding vectors (4 bytes per dimension per entry; 0 disables them)
+SEARCH_EMBEDDING_DIM = int(os.getenv("SEARCH_EMBEDDING_DIM", "128"))
+
+# Share of the embedding similarity in hybrid scores (the rest is the normalized BM25 score)
+SEARCH_SEMANTIC_WEIGHT = float(os.getenv("SEARCH_SEMANTIC_WEIGHT", "0.3"))
+
+KEYWORD, SEMANTIC, HYBRID = "keyword", "semantic", "hybrid"
+
+# BM25 parameters
+_K1, _B = 1.2, 0.75
+
+# Each mode ranks this many candidates per requested hit before merging and de-duplicating
+_CANDIDATES_PER_HIT = 5
+
+# Rows of the embedding matrix allocated with the first entry (doubled as needed)
+_INITIAL_CAPACITY = 1024
+
+# Embedding matches below this cosine similarity are left out
+_MIN_SIMILARITY = 0.3
+
+_WORD = re.compile(r"\w+")
+_SUBWORD = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+_STOPWORDS = frozenset("a an and are as at be by for from in into is it its of on or that the this to with".split())
+
+try:
+    import numpy as np
+except ImportError:  # Keyword search only
+    np = None
+
+
+def tokenize(text):
+    """
+    Lower-cased terms of `text`: words and the parts of camelCase and snake_case
+    identifiers, with a plural "s" stripped.
+    """
+    terms = []
+    for word in _WORD.findall(text):
+        parts = _SUBWORD.findall(word)
+        if len(parts) > 1:
+            terms.append(word.lower().replace("_", ""))
+        for part in parts:
+            part = part.lower()
+            if part in _STOPWORDS:
+                continue
+            if len(part) > 3 and part.endswith("s") and not part.endswith("ss"):
+                part = part[:-1]
+            terms.append(part)
+    return terms
+
+
+@functools.lru_cache(maxsize=100000)
+def _term_features(term, dim):
+    # Slots and signs of the term itself and its character trigrams
+    padded = f"#{term}#"
+    slots, signs = [], []
+    for feature in [term] + [padded[i:i + 3] for i in range(len(padded) - 2)]:
+        h = zlib.crc32(feature.encode("utf-8"))
+        slots.append(h % dim)
+        signs.append(1.0 if h & 0x80000000 else -1.0)
+    return slots, signs
+
+
+def embed(terms, dim=SEARCH_EMBEDDING_DIM):
+    """
+    Hashed bag-of-features vector of `terms` (the terms and their character
+    trigrams, so related word forms land close), L2-normalized.
+    """
+    slots, signs = [], []
+    for term in terms:
+        term_slots, term_signs = _term_features(term, dim)
+        slots += term_slots
+        signs += term_signs
+    vector = np.bincount(slots, weights=signs, minlength=dim).astype(np.float32) if slots \
+        else np.zeros(dim, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def entries_from_result(file_path, result):
+    """
+    Searchable entries of one chunk's analysis result: the file, each class and
+    each method.
+
+    Returns:
+        list: dicts with kind, file_path, class, signature and description.
+    """
+    entries = []
+    if result.get("description"):
+        entries.append({"kind": "file", "file_path": file_path, "class": None, "signature": None,
+                        "description": result["description"]})
+    for cls in result.get("classes", []):
+        name = cls.get("name") if cls.get("name") != "<module>" else None
+        if name:
+            entries.append({"kind": "class", "file_path": file_path, "class": name, "signature": None,
+                            "description": cls.get("description", "")})
+        for method in cls.get("methods", []):
+            entries.append({"kind": "method", "file_path": file_path, "class": name,
+                            "signature": method.get("signature", ""), "description": method.get("description", "")})
+    return entries
+
+
+def _entry_terms(entry):
+    # Names count twice, so an exact name match outranks a passing mention in a description
+    name = entry["signature"] or entry["class"] or os.path.basename(entry["file_path"])
+    return tokenize(name) * 2 + tokenize(entry["description"] or "")
+
+
+class SearchIndex:
+    """
+    In-memory index of one project's analysis results, updated per chunk.
+
+    Entries are grouped by the chunk they came from, so re-analyzing a chunk
+    replaces its entries and dropping a file's chunks removes them. Safe to
+    update and query from several threads.
+    """
+
+    def __init__(self, embedding_dim=SEARCH_EMBEDDING_DIM):
+        self._lock = threading.RLock()
+        self._entries = {}  # entry id -> entry
+        self._terms = {}  # entry id -> Counter of its terms
+        self._lengths = {}  # entry id -> number of terms
+        self._postings = {}  # term -> {entry id: term frequency}
+        self._by_chunk = {}  # chunk id -> [entry ids]
+        self._free_ids = []
+        self._next_id = 0
+        self._total_length = 0
+        self.loaded = False
+        self.embedding_dim = embedding_dim if np is not None else 0
+        self._vectors = None  # Allocated with the first entry
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def embeddings(self):
+        return self.embedding_dim > 0
+
+    def add(self, chunk_id, file_path, result):
+        """Indexes the analysis `result` of a chunk, replacing what was indexed for it before."""
+        entries = entries_from_result(file_path, result)
+        with self._lock:
+            self.remove([chunk_id])
+            self._by_chunk[str(chunk_id)] = [self._add_entry(entry) for entry in entries]
+
+    def _add_entry(self, entry):
+        entry_id = self._free_ids.pop() if self._free_ids else self._next_id
+        self._next_id = max(self._next_id, entry_id + 1)
+        terms = _entry_terms(entry)
+        counts = Counter(terms)
+        self._entries[entry_id] = entry
+        self._terms[entry_id] = counts
+        self._lengths[entry_id] = len(terms)
+        self._total_length += len(terms)
+        for term, count in counts.items():
+            self._postings.setdefault(term, {})[entry_id] = count
+        if self.embedding_dim:
+            if self._vectors is None:
+                self._vectors = np.zeros((_INITIAL_CAPACITY, self.embedding_dim), dtype=np.float32)
+            elif entry_id >= len(self._vectors):
+                grown = np.zeros((len(self._vectors) * 2, self.embedding_dim), dtype=np.float32)
+                grown[:len(self._vectors)] = self._vectors
+                self._vectors = grown
+            self._vectors[entry_id] = embed(terms, self.embedding_dim)
+        return entry_id
+
+    def remove(self, chunk_ids):
+        """Removes the entries indexed for `chunk_ids`."""
+        with self._lock:
+            for chunk_id in chunk_ids:
+                for entry_id in self._by_chunk.pop(str(chunk_id), []):
+                    del self._entries[entry_id]
+                    counts = self._terms.pop(entry_id)
+                    self._total_length -= self._lengths.pop(entry_id)
+                    for term in counts:
+                        postings = self._postings[term]
+                        del postings[entry_id]
+                        if not postings:
+                            del self._postings[term]
+                    if self._vectors is not None:
+                        self._vectors[entry_id] = 0.0
+                    self._free_ids.append(entry_id)
+
+    def _keyword_scores(self, terms, limit):
+        count = len(self._entries)
+        avg_length = self._total_length / count
+        lengths, base, per_term = self._lengths, _K1 * (1 - _B), _K1 * _B / avg_length
+        scores = {}
+        for term in set(terms):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            weight = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5)) * (_K1 + 1)
+            for entry_id, tf in postings.items():
+                scores[entry_id] = scores.get(entry_id, 0.0) + weight * tf / (tf + base + per_term * lengths[entry_id])
+        return dict(heapq.nlargest(limit, scores.items(), key=lambda item: item[1]))
+
+    def _semantic_scores(self, terms, limit):
+        if self._vectors is None:
+            return {}
+        query = embed(terms, self.embedding_dim)
+        similarities = self._vectors[:self._next_id] @ query
+        limit = min(limit, len(similarities))
+        top = np.argpartition(-similarities, limit - 1)[:limit]
+        return {int(i): float(similarities[i]) for i in top
+                if int(i) in self._entries and similarities[i] >= _MIN_SIMILARITY}
+
+    def search(self, query, k=10, mode=None):
+        """
+        Returns the `k` entries that best match `query`.
+
+        Args:
+            mode (str): KEYWORD (BM25), SEMANTIC (embedding cosine similarity) or
+                HYBRID (both, combined with SEARCH_SEMANTIC_WEIGHT). Defaults to
+                HYBRID when embeddings are available, else KEYWORD.
+
+        Returns:
+            list: Entries (kind, file_path, class, signature, description) with their score.
+        """
+        if mode is None:
+            mode = HYBRID if self.embeddings else KEYWORD
+        if mode not in (KEYWORD, SEMANTIC, HYBRID):
+            raise ValueError(f"Unknown search mode '{mode}'")
+        if mode != KEYWORD and not self.embeddings:
+            raise ValueError("Semantic search needs NumPy and SEARCH_EMBEDDING_DIM > 0")
+
+        terms = tokenize(query)
+        limit = k * _CANDIDATES_PER_HIT
+        with self._lock:
+            if not terms or not self._entries:
+                return []
+            keyword = self._keyword_scores(terms, limit) if mode != SEMANTIC else {}
+            semantic = self._semantic_scores(terms, limit) if mode != KEYWORD else {}
+
+            if mode == HYBRID:
+                best = max(keyword.values(), default=0.0) or 1.0
+                scores = {entry_id: (1 - SEARCH_SEMANTIC_WEIGHT) * keyword.get(entry_id, 0.0) / best
+                          + SEARCH_SEMANTIC_WEIGHT * semantic.get(entry_id, 0.0)
+                          for entry_id in keyword.keys() | semantic.keys()}
+            else:
+                scores = keyword or semantic
+
+            hits, seen = [], set()
+            for entry_id, score in sorted(scores.items(), key=lambda item: item[1], reverse=True):
+                entry = self._entries[entry_id]
+                # A file's description may be repeated by each of its chunks
+                key = (entry["kind"], entry["file_path"], entry["class"], entry["signature"], entry["description"])
+                if key in seen:
+                    continue
+                seen.add(key)
+                hits.append(dict(entry, score=round(score, 4)))
+                if len(hits) == k:
+                    break
+            return hits
+
+
+_indexes = {}  # project path -> SearchIndex
+_indexes_lock = threading.Lock()
+
+
+def get(project_path):
+    """Returns the index of `project_path` if this process has one, else None."""
+    with _indexes_lock:
+        return _indexes.get(project_path)
+
+
+def _fill(index, loader):
+    with index._lock:
+        if not index.loaded:
+            index.loaded = True
+            for chunk_id, file_path, result in (loader() if loader is not None else ()):
+                index.add(chunk_id, file_path, result)
+
+
+def index_for(project_path, loader=None):
+    """
+    Returns the index of `project_path` for an analysis run to update, creating
+    it on first use and filling it with `loader()`, an iterable of (chunk id,
+    file path, analysis result).
+    """
+    with _indexes_lock:
+        index = _indexes.get(project_path)
+        if index is None:
+            index = _indexes[project_path] = SearchIndex()
+    _fill(index, loader)
+    return index
+
+
+def load(project_path, loader):
+    """
+    Returns the index of `project_path` to query, building it with `loader()`
+    (see `index_for`) if this process has none, e.g. after a restart.
+
+    Returns:
+        SearchIndex: The index, or None (nothing is kept) if `loader()` yields no results.
+    """
+    index = get(project_path)
+    if index is not None:
+        return index
+    index = SearchIndex()
+    _fill(index, loader)
+    if not len(index):
+        return None
+    with _indexes_lock:
+        # A run may have created the project's index meanwhile
+        return _indexes.setdefault(project_path, index)
+
+
+def drop(project_path):
+    """Forgets the index of `project_path`."""
+    with _indexes_lock:
+        _indexes.pop(project_path, None)
+
+
+def clear():
+    """Forgets every index."""
+    with _indexes_lock:
+        _indexes.clear()
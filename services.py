@@ -0,0 +1,143 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables from a .env file
+load_dotenv()
+
+# Use the service name 'mongo' as the host when running inside Docker
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://mongo:27017/")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "code_analysis")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+
+# Connection and health-check timeout for MongoDB and Redis (seconds)
+SERVICE_TIMEOUT = float(os.getenv("SERVICE_TIMEOUT", "5.0"))
+
+MODEL_NAME = "gpt-3.5-turbo"
+
+
+class ServiceRegistry:
+    """
+    Creates shared clients on first use instead of at import time.
+
+    Each service is built once per process by its registered factory, under a
+    lock so concurrent first requests don't open several connection pools.
+    `override` installs a ready-made instance (e.g. an in-memory stand-in).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._factories = {}
+        self._instances = {}
+
+    def register(self, name, factory):
+        self._factories[name] = factory
+
+    def get(self, name):
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            if name not in self._instances:
+                self._instances[name] = self._factories[name]()
+            return self._instances[name]
+
+    def initialized(self, name):
+        return name in self._instances
+
+    def override(self, name, instance):
+        """
+        Replaces service `name` with `instance` (None drops it, so it's rebuilt on next use).
+
+        Returns:
+            The previous instance, or None if the service wasn't created yet.
+        """
+        with self._lock:
+            previous = self._instances.pop(name, None)
+            if instance is not None:
+                self._instances[name] = instance
+            return previous
+
+    def reset(self):
+        """Forgets every instance, e.g. in a forked worker that must not reuse its parent's sockets."""
+        with self._lock:
+            self._instances.clear()
+
+
+def _create_mongo_db():
+    from pymongo import MongoClient
+    client = MongoClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL_SIZE,
+                         serverSelectionTimeoutMS=int(SERVICE_TIMEOUT * 1000))
+    return client[MONGO_DB_NAME]
+
+
+def _create_redis():
+    import redis
+    pool = redis.ConnectionPool(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True,
+                                max_connections=REDIS_MAX_CONNECTIONS, socket_timeout=SERVICE_TIMEOUT)
+    return redis.StrictRedis(connection_pool=pool)
+
+
+def _create_llm():
+    # Deferred so importing the pipeline doesn't load LangChain and the OpenAI client
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        openai_api_key=os.getenv("OPENAI_API_KEY"),
+        temperature=0.3,
+        model_name=MODEL_NAME
+    )
+
+
+registry = ServiceRegistry()
+registry.register("mongo", _create_mongo_db)
+registry.register("redis", _create_redis)
+registry.register("llm", _create_llm)
+
+# Sockets can't be shared with a forked child; it opens its own pools on first use
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=registry.reset)
+
+
+def mongo_db():
+    """The `code_analysis` MongoDB database, sharing one pooled client per process."""
+    return registry.get("mongo")
+
+
+def redis_client():
+    """The shared Redis client (string responses), backed by a connection pool."""
+    return registry.get("redis")
+
+
+def llm():
+    """The chat model used for chunk analysis and summaries."""
+    return registry.get("llm")
+
+
+def _check(ping):
+    start = time.perf_counter()
+    try:
+        ping()
+        return {"ok": True, "latency_ms": round((time.perf_counter() - start) * 1000, 1)}
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+
+def health():
+    """
+    Pings MongoDB and Redis. The LLM is only reported as created or not, since
+    checking it would cost a request.
+
+    Returns:
+        dict: {"ok": bool, "services": {name: status}}.
+    """
+    services = {
+        "mongo": _check(lambda: mongo_db().client.admin.command("ping")),
+        "redis": _check(lambda: redis_client().ping()),
+    }
+    services["llm"] = {"ok": True, "initialized": registry.initialized("llm")}
+    return {"ok": all(status["ok"] for status in services.values()), "services": services}
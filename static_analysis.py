@@ -0,0 +1,486 @@
+import os
+import re
+import ast
+
+from chunker import declarations, line_depths
+
+# Files without logic (constants, DTOs, empty modules) up to this many lines are described
+# from their structure alone, without an LLM request
+STATIC_TRIVIAL_MAX_LINES = int(os.getenv("STATIC_TRIVIAL_MAX_LINES", "150"))
+
+# Set to 0 to send trivial files to the LLM anyway
+STATIC_SKIP_TRIVIAL = os.getenv("STATIC_SKIP_TRIVIAL", "1") == "1"
+
+# Class entry holding the functions that are not inside any class
+MODULE_CLASS = "<module>"
+
+# Complexity level of methods only the LLM reported
+UNKNOWN_COMPLEXITY = "Unknown"
+
+# Imports, per language: (pattern over the whole file, whether a matching line can be left out of prompts)
+_IMPORT_PATTERNS = {
+    '.java': [r'^\s*import\s+(?:static\s+)?([\w.*]+)\s*;'],
+    '.js': [r'^\s*import\s+(?:[^\'";]*?\s+from\s+)?[\'"]([^\'"]+)[\'"]',
+            r'^\s*(?:const|let|var)\s+[^=\n]+=\s*require\(\s*[\'"]([^\'"]+)[\'"]\s*\)'],
+    '.go': [r'^\s*import\s+(?:[\w.]+\s+)?"([^"]+)"', r'^\s*(?:[\w.]+\s+)?"([^"]+)"\s*$'],
+    '.c': [r'^\s*#\s*include\s*[<"]([^>"]+)[>"]'],
+    '.cs': [r'^\s*using\s+(?:static\s+)?([\w.]+)\s*;'],
+    '.rb': [r'^\s*require(?:_relative)?\s*\(?\s*[\'"]([^\'"]+)[\'"]'],
+    '.php': [r'^\s*use\s+([\w\\]+)', r'^\s*(?:require|include)(?:_once)?\s*\(?\s*[\'"]([^\'"]+)[\'"]'],
+    '.py': [r'^\s*import\s+([\w.]+)', r'^\s*from\s+([\w.]+)\s+import\b'],
+}
+_IMPORT_PATTERNS['.ts'] = _IMPORT_PATTERNS['.js']
+_IMPORT_PATTERNS['.cpp'] = _IMPORT_PATTERNS['.c']
+
+# Lines that carry no information beyond the imports (package/namespace statements, Go import blocks)
+_IMPORT_NOISE = re.compile(r'^\s*(?:package\s+[\w.]+\s*;?|import\s*\(|\)|namespace\s+[\w\\]+\s*;)\s*$')
+
+_CLASS_DECLARATION = re.compile(r'\b(?:class|interface|enum|struct|record|trait|module)\s+([\w:.]+)'
+                                r'|^type\s+(\w+)\s+(?:struct|interface)\b')
+_GO_TYPE = re.compile(r'^type\s')
+_NAMESPACE = re.compile(r'^\s*namespace\b')
+_GO_RECEIVER = re.compile(r'^func\s*\(\s*\w*\s*\*?\s*(\w+)[^)]*\)\s*')
+_METHOD_NAME = re.compile(r'(?:\bdef|\bfunction|\bconst|\blet|\bvar)\s+([\w.?!$]+)|(\w+)\s*\(')
+
+# Annotations/attributes written above a declaration
+_ANNOTATION = re.compile(r'^\s*(@[\w.]+(?:\(.*\))?|\[[\w.]+(?:\(.*\))?\]|#\[.*\])\s*$')
+_COMMENT = re.compile(r'^\s*(?:#(?!\[)|//|/\*|\*)')
+
+# Decision points, for a cyclomatic-complexity estimate
+_DECISIONS = re.compile(r'\b(?:if|elif|elsif|for|foreach|while|until|unless|case|when|catch|except)\b'
+                        r'|&&|\|\||\?(?![?.:])')
+
+# Bodies made of these lines only are accessors (return a field, assign a field, call super)
+_TRIVIAL_LINE = re.compile(r'^(?:return\s+(?:this\.|self\.|@|\$this->)?[\w.$]+;?|'
+                           r'(?:this\.|self\.|@|\$this->)?[\w$]+\s*=\s*[\w.$]+;?|super\s*\(.*\);?|end|pass)$')
+_TRIVIAL_MAX_BODY_LINES = 4
+
+# Module-level Python statements that aren't logic: imports, assignments, docstrings, `pass`
+_PYTHON_DECLARATIVE = (ast.Import, ast.ImportFrom, ast.Assign, ast.AnnAssign, ast.Pass)
+
+# A call outside any function or class (e.g. a script's top-level statements), in the
+# languages that allow statements there
+_TOP_LEVEL_CALL = re.compile(r'[\w$.\]\)]\s*\(')
+_SCRIPT_LANGUAGES = {'.py', '.rb', '.js', '.ts', '.php'}
+
+_STRINGS_AND_COMMENTS = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|//.*$|#.*$', re.MULTILINE)
+
+
+def _complexity_level(decisions):
+    complexity = decisions + 1
+    return "Low" if complexity <= 5 else "Medium" if complexity <= 10 else "High"
+
+
+def _line_offsets(lines):
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    return offsets
+
+
+def _method(signature, name, start, end, decisions, trivial):
+    return {"signature": " ".join(signature.split()), "name": name, "start": start, "end": end,
+            "complexity": _complexity_level(decisions), "trivial": trivial}
+
+
+def _class(name, annotations, start, end):
+    return {"name": name, "annotations": annotations, "start": start, "end": end, "methods": []}
+
+
+# === Python (ast) ===
+
+def _python_decisions(node):
+    decisions = 0
+    for child in ast.walk(node):
+        if isinstance(child, (ast.If, ast.For, ast.AsyncFor, ast.While, ast.IfExp, ast.ExceptHandler,
+                              ast.comprehension, ast.Assert)):
+            decisions += 1
+        elif isinstance(child, ast.BoolOp):
+            decisions += len(child.values) - 1
+        elif hasattr(ast, "match_case") and isinstance(child, ast.match_case):
+            decisions += 1
+    return decisions
+
+
+def _python_trivial(node):
+    body = node.body
+    if body and isinstance(body[0], ast.Expr) and isinstance(getattr(body[0], "value", None), ast.Constant):
+        body = body[1:]  # Docstring
+    for stmt in body:
+        if isinstance(stmt, ast.Pass):
+            continue
+        if isinstance(stmt, ast.Return) and (stmt.value is None or
+                                             isinstance(stmt.value, (ast.Name, ast.Attribute, ast.Constant))):
+            continue
+        if isinstance(stmt, (ast.Assign, ast.AnnAssign)):
+            targets = stmt.targets if isinstance(stmt, ast.Assign) else [stmt.target]
+            if all(isinstance(t, ast.Attribute) and isinstance(t.value, ast.Name) and t.value.id == "self"
+                   for t in targets):
+                continue
+        return False
+    return len(body) <= _TRIVIAL_MAX_BODY_LINES
+
+
+def _python_signature(node):
+    prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+    returns = f" -> {ast.unparse(node.returns)}" if node.returns is not None else ""
+    return f"{prefix} {node.name}({ast.unparse(node.args)}){returns}"
+
+
+def _extract_python(text, lines):
+    tree = ast.parse(text)
+    offsets = _line_offsets(lines)
+
+    def span(node):
+        first = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+        return offsets[first - 1], offsets[min(node.end_lineno, len(lines))]
+
+    def method(node):
+        start, end = span(node)
+        return _method(_python_signature(node), node.name, start, end, _python_decisions(node), _python_trivial(node))
+
+    imports, import_ranges, classes, module_functions = [], [], [], []
+    module_logic = 0
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            import_ranges.append(span(node))
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            module_functions.append(method(node))
+        elif isinstance(node, ast.ClassDef):
+            cls = _class(node.name, ["@" + ast.unparse(d) for d in node.decorator_list], *span(node))
+            cls["methods"] = [method(n) for n in node.body if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))]
+            classes.append(cls)
+        else:
+            # Branches, and statements other than declarations (a script's calls), are logic
+            module_logic += _python_decisions(node)
+            docstring = isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant)
+            if not isinstance(node, _PYTHON_DECLARATIVE) and not docstring:
+                module_logic += 1
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            imports.append("." * node.level + (node.module or ""))
+
+    if module_functions:
+        classes.append(dict(_class(MODULE_CLASS, [], module_functions[0]["start"], module_functions[-1]["end"]),
+                            methods=module_functions))
+    return imports, import_ranges, classes, module_logic
+
+
+# === Other languages (declaration patterns shared with the chunker) ===
+
+def _unit_end(lines, depths, i, ext):
+    """Index of the line after the unit declared on line `i`."""
+    depth = depths[i]
+    if ext in ('.py', '.rb'):
+        for j in range(i + 1, len(lines)):
+            if lines[j].strip() and depths[j] <= depth:
+                return j
+        return len(lines)
+
+    seen_body = False
+    for j in range(i + 1, len(lines)):
+        if depths[j] > depth:
+            seen_body = True
+        elif seen_body or "{" in lines[j - 1] or lines[j - 1].rstrip().endswith(";"):
+            # Closed again, a one-line body, or a declaration without body
+            return j
+    return len(lines)
+
+
+def _signature(lines, i):
+    # Parameter lists may continue over a few lines
+    parts = []
+    for line in lines[i:i + 6]:
+        parts.append(line.split("{", 1)[0])
+        joined = "".join(parts)
+        if "{" in line or joined.count("(") <= joined.count(")"):
+            break
+    return re.sub(r'[\s:;]+$', "", " ".join("".join(parts).split()))
+
+
+def _method_name(signature):
+    match = _METHOD_NAME.search(_GO_RECEIVER.sub("func ", signature))
+    return (match.group(1) or match.group(2)) if match else signature
+
+
+def _preamble(lines, i):
+    """
+    Returns the annotations written above line `i` and the index of the first
+    annotation/comment line belonging to the declaration.
+    """
+    found = []
+    j = i - 1
+    while j >= 0 and lines[j].strip() and (_ANNOTATION.match(lines[j]) or _COMMENT.match(lines[j])):
+        match = _ANNOTATION.match(lines[j])
+        if match:
+            found.append(match.group(1))
+        j -= 1
+    return found[::-1], j + 1
+
+
+def _decisions(text):
+    return len(_DECISIONS.findall(_STRINGS_AND_COMMENTS.sub("", text)))
+
+
+def _trivial_body(lines, i, end, ext):
+    body = " ".join(lines[i:end])
+    if "{" not in body and ext not in ('.py', '.rb'):
+        return False  # Abstract or interface method: its contract is worth describing
+    body = body.split("{", 1)[1] if "{" in body else "".join(lines[i + 1:end])
+    statements = [s.strip() for s in re.split(r'[;\n]', body.replace("}", "\n")) if s.strip()]
+    return len(statements) <= _TRIVIAL_MAX_BODY_LINES and all(_TRIVIAL_LINE.match(s) for s in statements)
+
+
+def _extract_generic(text, lines, ext):
+    offsets = _line_offsets(lines)
+    depths = line_depths(lines, ext)
+
+    classes, module_functions = [], []
+    by_name = {}
+    stack = []  # Open units: (depth, kind, entry)
+    covered = []  # Line ranges of methods, excluded from the module-level complexity
+    units = []  # Line ranges of classes and methods
+    for i, depth in declarations(lines, ext, max_depth=None, depths=depths):
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        if stack and stack[-1][1] == "method":
+            continue  # Nested function or callback: part of its enclosing method
+
+        end = _unit_end(lines, depths, i, ext)
+        annotations, first = _preamble(lines, i)
+        match = _CLASS_DECLARATION.search(lines[i])
+        if match:
+            cls = _class(match.group(1) or match.group(2), annotations, offsets[first], offsets[end])
+            classes.append(cls)
+            by_name[cls["name"]] = cls
+            stack.append((depth, "class", cls))
+            units.append((i, end))
+            continue
+        if ext == '.go' and _GO_TYPE.match(lines[i]) or _NAMESPACE.match(lines[i]):
+            continue  # Type alias, named basic type or namespace block
+
+        signature = _signature(lines, i)
+        unit_text = "".join(lines[i:end])
+        method = _method(signature, _method_name(signature), offsets[first], offsets[end],
+                         _decisions(unit_text), _trivial_body(lines, i, end, ext))
+        covered.append((i, end))
+        units.append((i, end))
+
+        receiver = _GO_RECEIVER.match(lines[i]) if ext == '.go' else None
+        if receiver:
+            owner = by_name.get(receiver.group(1))
+            if owner is None:
+                owner = by_name[receiver.group(1)] = _class(receiver.group(1), [], offsets[i], offsets[end])
+                classes.append(owner)
+            owner["methods"].append(method)
+        elif stack and stack[-1][1] == "class":
+            stack[-1][2]["methods"].append(method)
+        else:
+            module_functions.append(method)
+        stack.append((depth, "method", method))
+
+    imports, import_ranges = [], []
+    for pattern in _IMPORT_PATTERNS.get(ext, []):
+        for match in re.finditer(pattern, text, re.MULTILINE):
+            imports.append(match.group(1))
+    for i, line in enumerate(lines):
+        if _IMPORT_NOISE.match(line) or any(re.match(p, line) for p in _IMPORT_PATTERNS.get(ext, [])):
+            import_ranges.append((offsets[i], offsets[i + 1]))
+
+    in_methods, in_units = set(), set()
+    for lo, hi in covered:
+        in_methods.update(range(lo, hi))
+    for lo, hi in units:
+        in_units.update(range(lo, hi))
+    module_logic = _decisions("".join(line for i, line in enumerate(lines) if i not in in_methods))
+    if ext in _SCRIPT_LANGUAGES:
+        # Calls outside any class or function (a script's statements) are logic too
+        imported = {lo for lo, _ in import_ranges}
+        module_logic += sum(1 for i, line in enumerate(lines)
+                            if i not in in_units and offsets[i] not in imported and not _COMMENT.match(line)
+                            and _TOP_LEVEL_CALL.search(_STRINGS_AND_COMMENTS.sub('""', line)))
+
+    if module_functions:
+        classes.append(dict(_class(MODULE_CLASS, [], module_functions[0]["start"], module_functions[-1]["end"]),
+                            methods=module_functions))
+    return imports, import_ranges, classes, module_logic
+
+
+def extract(text, filename):
+    """
+    Extracts everything in the analysis schema that doesn't need the LLM:
+    line count, imports, classes with their annotations, method signatures and a
+    complexity level estimated from the number of decision points.
+
+    Python is parsed with `ast`; the other languages use the chunker's
+    declaration patterns, brace/indent depth and per-language import patterns.
+
+    Returns:
+        dict: filename, lines_of_code, key_imports, classes (each with name,
+              annotations and methods, with character offsets) and the offsets of
+              import lines (`import_ranges`), plus `module_logic` (branches outside
+              any function, and statements other than imports and assignments at
+              module level).
+    """
+    lines = text.splitlines(keepends=True)
+    ext = os.path.splitext(filename)[1].lower()
+
+    result = None
+    if ext == '.py':
+        try:
+            result = _extract_python(text, lines)
+        except (SyntaxError, ValueError):
+            pass  # Python 2 or broken code: fall back to the patterns
+    if result is None:
+        result = _extract_generic(text, lines, ext)
+    imports, import_ranges, classes, module_logic = result
+
+    return {
+        "filename": os.path.basename(filename),
+        "lines_of_code": len(lines),
+        "key_imports": list(dict.fromkeys(imports)),
+        "classes": classes,
+        "import_ranges": import_ranges,
+        "module_logic": module_logic
+    }
+
+
+def is_trivial(facts):
+    """
+    True for files without logic worth describing: no functions beyond accessors,
+    no branches or statements other than declarations at module level and at most
+    STATIC_TRIVIAL_MAX_LINES lines (constants, DTOs, empty modules).
+    """
+    return (facts["lines_of_code"] <= STATIC_TRIVIAL_MAX_LINES and not facts["module_logic"]
+            and all(m["trivial"] for cls in facts["classes"] for m in cls["methods"]))
+
+
+def llm_view(text, start, end, facts, skip_trivial_methods=True):
+    """
+    Returns the part of `text[start:end]` the LLM needs to see: the chunk without
+    its import lines and (unless `skip_trivial_methods` is False) its accessors,
+    which are described from their structure instead.
+    """
+    skipped = list(facts["import_ranges"])
+    if skip_trivial_methods:
+        skipped.extend((m["start"], m["end"]) for cls in facts["classes"] for m in cls["methods"] if m["trivial"])
+
+    pieces, position = [], start
+    for lo, hi in sorted(skipped):
+        lo, hi = max(lo, start), min(hi, end)
+        if hi <= position or lo >= end:
+            continue
+        if lo > position:
+            pieces.append(text[position:lo])
+        position = max(position, hi)
+    pieces.append(text[position:end])
+    return re.sub(r'\n{3,}', "\n\n", "".join(pieces))
+
+
+def facts_for_span(facts, start, end):
+    """
+    Restricts `facts` to one chunk: the classes it overlaps and the methods that
+    start in it. Imports and the line count are the whole file's.
+    """
+    classes = []
+    for cls in facts["classes"]:
+        methods = [m for m in cls["methods"] if start <= m["start"] < end]
+        overlaps = cls["start"] < end and cls["end"] > start and cls["name"] != MODULE_CLASS
+        if methods or overlaps:
+            classes.append(dict(cls, methods=methods))
+    return dict(facts, classes=classes)
+
+
+def _template_description(method, class_name):
+    name = method["name"]
+    field = re.sub(r'^(?:get|set|is|has)_?', "", name) or name
+    field = field[0].lower() + field[1:]
+    if name in ("__init__", "constructor", "initialize", "__construct", class_name):
+        return "Initializes the instance fields."
+    if name in ("toString", "__repr__", "__str__", "ToString"):
+        return "Returns a string representation."
+    if name in ("equals", "__eq__", "hashCode", "__hash__", "Equals", "GetHashCode"):
+        return "Compares or hashes the instance fields."
+    if re.match(r'set_?[A-Z_a-z]', name):
+        return f"Sets {field}."
+    return f"Returns {field}."
+
+
+def describe_trivial(facts):
+    """Description of a trivial file (see `is_trivial`), built from its structure."""
+    named = [cls["name"] for cls in facts["classes"] if cls["name"] != MODULE_CLASS]
+    if named:
+        return f"Defines {', '.join(named)}: data fields with simple accessors and no other logic."
+    if facts["classes"]:
+        return "Defines simple accessor functions and no other logic."
+    return "Declarations only (constants, configuration or type definitions); contains no functions."
+
+
+def _llm_method(method):
+    # Same keys as the statically found methods; the complexity wasn't measured
+    return {"signature": " ".join(str(method.get("signature", "")).split()),
+            "description": method.get("description", ""), "complexity": {"level": UNKNOWN_COMPLEXITY}}
+
+
+def combine(facts, described, trivial=False):
+    """
+    Builds the analysis result of a chunk from its static `facts` (see
+    `facts_for_span`) and the descriptions the LLM returned for it.
+
+    Methods are matched by normalized signature, then by name. Accessors the LLM
+    didn't describe get a description from their name. Classes and methods only
+    the LLM reported (patterns can miss declarations) are kept as the LLM
+    described them, with the same keys and an unknown complexity.
+    """
+    llm_classes = {c.get("name"): c for c in described.get("classes", []) if isinstance(c, dict)}
+    by_signature, by_name = {}, {}
+    for cls in llm_classes.values():
+        for method in cls.get("methods", []):
+            if isinstance(method, dict) and method.get("description"):
+                signature = " ".join(str(method.get("signature", "")).split())
+                by_signature.setdefault(signature, method["description"])
+                by_name.setdefault(_method_name(signature), method["description"])
+
+    static_signatures = {m["signature"] for cls in facts["classes"] for m in cls["methods"]}
+    static_names = {m["name"] for cls in facts["classes"] for m in cls["methods"]}
+
+    def llm_only(cls):
+        methods = [_llm_method(m) for m in (cls or {}).get("methods", []) if isinstance(m, dict)]
+        return [m for m in methods
+                if m["signature"] not in static_signatures and _method_name(m["signature"]) not in static_names]
+
+    classes = []
+    for cls in facts["classes"]:
+        methods = []
+        for method in cls["methods"]:
+            description = by_signature.get(method["signature"]) or by_name.get(method["name"])
+            if not description and method["trivial"]:
+                description = _template_description(method, cls["name"])
+            methods.append({"signature": method["signature"], "description": description or "",
+                            "complexity": {"level": method["complexity"]}})
+        methods.extend(llm_only(llm_classes.get(cls["name"])))
+        description = (llm_classes.get(cls["name"]) or {}).get("description", "")
+        if not description and trivial and cls["name"] != MODULE_CLASS:
+            description = "Data holder with simple accessors."
+        classes.append({"name": cls["name"], "annotations": cls["annotations"], "description": description,
+                        "methods": methods})
+
+    known = {cls["name"] for cls in facts["classes"]}
+    for name, cls in llm_classes.items():
+        if name in known:
+            continue
+        methods = llm_only(cls)
+        if name != MODULE_CLASS or methods:
+            classes.append({"name": name, "annotations": [], "description": cls.get("description", ""),
+                            "methods": methods})
+
+    return {
+        "filename": facts["filename"],
+        "description": described.get("description") or (describe_trivial(facts) if trivial else ""),
+        "lines_of_code": facts["lines_of_code"],
+        "key_imports": facts["key_imports"],
+        "classes": classes
+    }
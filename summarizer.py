@@ -0,0 +1,198 @@
+import os
+import hashlib
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from chunker import count_tokens
+
+# Maximum size of any single summarization prompt, in tokens
+SUMMARY_MAX_PROMPT_TOKENS = int(os.getenv("SUMMARY_MAX_PROMPT_TOKENS", "6000"))
+
+# Directories of the same depth are summarized in parallel with this many workers
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "8"))
+
+DEFAULT_PROJECT_PURPOSE = ("This project provides backend functionality for a domain-specific application, "
+                           "including business logic and authentication.")
+
+DIRECTORY_PROMPT = """
+You are an expert software analyst. Given the following metadata for the source files and sub-packages
+of the directory "{path}", write a concise 2–4 sentence summary of what this part of the codebase does.
+
+Only describe responsibilities and behavior — don't list file names.
+
+Metadata:
+{context}
+
+Directory Summary:
+"""
+
+PROJECT_PROMPT = """
+You are an expert software analyst. Given the following structured metadata from source code files, write a clear, natural, 2–3 line project purpose description.
+
+Only describe what this project is about — don't explain structure or implementation.
+
+Metadata:
+{context}
+
+Project Purpose:
+"""
+
+
+def _response_text(response):
+    # Chat models return a message object, plain LLMs a string
+    return getattr(response, "content", response).strip()
+
+
+def file_context(file):
+    """
+    Renders the descriptions of one merged file entry (file, classes, methods) as text.
+    """
+    parts = [f"File: {file['filename']}\n{file.get('description', '')}"]
+    for cls in file.get("classes", []):
+        parts.append(f"Class: {cls['name']}\n{cls.get('description', '')}")
+        for method in cls.get("methods", []):
+            if method.get("description"):
+                parts.append(method["description"])
+    return "\n".join(parts)
+
+
+class HierarchicalSummarizer:
+    """
+    Builds the project purpose with a map-reduce over the directory tree.
+
+    Each directory is summarized from its files and the summaries of its
+    sub-directories, deepest directories first and siblings in parallel. No prompt
+    exceeds `max_prompt_tokens`: oversized inputs are split into groups that are
+    summarized separately and then reduced. Intermediate summaries are cached by a
+    hash of their exact input, so unchanged directories aren't re-summarized.
+    """
+
+    def __init__(self, llm, cache=None, max_prompt_tokens=SUMMARY_MAX_PROMPT_TOKENS,
+                 max_workers=SUMMARY_WORKERS, model_name=""):
+        self.llm = llm
+        self.cache = cache
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_workers = max_workers
+        self.model_name = model_name
+        self.llm_calls = 0
+        self._lock = threading.Lock()
+
+    def _cache_key(self, template, context):
+        digest = hashlib.sha256()
+        for part in (template, self.model_name, context):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return f"summary:{digest.hexdigest()}"
+
+    def _complete(self, template, context, **fields):
+        """
+        Fills `template` with `context` and asks the LLM, going through the cache.
+        """
+        key = self._cache_key(template, context)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        with self._lock:
+            self.llm_calls += 1
+        summary = _response_text(self.llm.invoke(template.format(context=context, **fields)))
+        if self.cache is not None and summary:
+            self.cache.put(key, summary)
+        return summary
+
+    def _reduce(self, template, parts, **fields):
+        """
+        Summarizes `parts` with `template`, splitting them into several prompts
+        (and summarizing those summaries) when they don't fit in one.
+        """
+        budget = self.max_prompt_tokens - count_tokens(template)
+        groups, current, current_tokens = [], [], 0
+        for part in parts:
+            tokens = count_tokens(part) + 1
+            if tokens > budget:
+                # A single oversized part is cut down to what fits
+                part = part[:max(budget, 1) * 4]
+                tokens = budget
+            if current and current_tokens + tokens > budget:
+                groups.append(current)
+                current, current_tokens = [], 0
+            current.append(part)
+            current_tokens += tokens
+        if current:
+            groups.append(current)
+
+        if len(groups) <= 1:
+            return self._complete(template, "\n".join(groups[0] if groups else []), **fields)
+        if len(groups) >= len(parts):
+            # Every part fills a prompt on its own, so splitting can't shrink the input: send what fits
+            return self._complete(template, "\n".join(parts)[:max(budget, 1) * 4], **fields)
+
+        partials = [self._complete(DIRECTORY_PROMPT, "\n".join(group), path=fields.get("path", "project"))
+                    for group in groups]
+        return self._reduce(template, partials, **fields)
+
+    def _summarize_directory(self, path, parts):
+        try:
+            return self._reduce(DIRECTORY_PROMPT, parts, path=path or ".")
+        except Exception as e:
+            print(f"[ERROR] Summary of directory '{path}' failed: {str(e)}")
+            return "\n".join(parts)[:2000]
+
+    def summarize(self, file_summaries):
+        """
+        Returns a 2-3 line project purpose for the merged file entries.
+        """
+        contexts = [file_context(file) for file in file_summaries]
+        try:
+            # Small projects fit in a single prompt, exactly as before
+            whole = "\n".join(contexts)
+            if count_tokens(PROJECT_PROMPT) + count_tokens(whole) <= self.max_prompt_tokens:
+                return self._complete(PROJECT_PROMPT, whole)
+
+            root_parts = self._summarize_tree(file_summaries, contexts)
+            return self._reduce(PROJECT_PROMPT, root_parts)
+        except Exception as e:
+            print(f"[ERROR] LLM purpose generation failed: {str(e)}")
+            return DEFAULT_PROJECT_PURPOSE
+
+    def _summarize_node(self, directory, parts, children):
+        # A directory holding a single sub-directory and no files just passes its summary up
+        if len(parts) == 1 and children:
+            return parts[0]
+        return self._summarize_directory(directory, parts)
+
+    def _summarize_tree(self, file_summaries, contexts):
+        """
+        Summarizes every directory bottom-up and returns the parts describing the root.
+        """
+        parts = defaultdict(list)  # directory -> file contexts, then sub-directory summaries
+        children = defaultdict(set)
+        for file, context in zip(file_summaries, contexts):
+            directory = os.path.dirname(file.get("file_path") or file["filename"]).replace(os.sep, "/")
+            parts[directory].append(context)
+
+        # Register every ancestor so summaries can flow up to the root ("")
+        for directory in list(parts):
+            while directory:
+                parent = os.path.dirname(directory)
+                children[parent].add(directory)
+                parts.setdefault(directory, [])
+                directory = parent
+        parts.setdefault("", [])
+
+        by_depth = defaultdict(list)
+        for directory in parts:
+            by_depth[directory.count("/") + 1 if directory else 0].append(directory)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for depth in sorted(by_depth, reverse=True):
+                if depth == 0:
+                    break
+                directories = sorted(by_depth[depth])
+                summaries = pool.map(lambda d: self._summarize_node(d, parts[d], children[d]), directories)
+                for directory, summary in zip(directories, summaries):
+                    parts[os.path.dirname(directory)].append(f"Directory {directory}:\n{summary}")
+
+        return parts[""]
@@ -0,0 +1,36 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from offline import FakeLLM, offline_services, synthetic_repo  # noqa: E402
+
+
+@pytest.fixture
+def llm():
+    return FakeLLM(latency=0)
+
+
+@pytest.fixture
+def database(llm):
+    """In-memory MongoDB/Redis stand-ins and the fake LLM for the duration of a test."""
+    with offline_services(llm) as (database, _):
+        yield database
+
+
+@pytest.fixture
+def workdir():
+    # Not under pytest's tmp_path: code_loader skips every path containing "test"
+    with tempfile.TemporaryDirectory(prefix="analyzer-") as path:
+        yield path
+
+
+@pytest.fixture
+def project(workdir):
+    path = os.path.join(workdir, "project")
+    synthetic_repo(path, num_files=12, lines_per_file=120)
+    return path
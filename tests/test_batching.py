@@ -0,0 +1,73 @@
+import json
+
+import main
+from llm_analyzer import analyze_batch, error_kind
+from metrics import RunMetrics
+from offline import FakeLLM, FakeRateLimitError, offline_services
+from output_parser import OK
+from scheduler import RATE_LIMITED
+
+ITEMS = [("a.py", "def a():\n    return 1\n"), ("b.py", "def b():\n    return 2\n")]
+
+
+class BatchFailingLLM(FakeLLM):
+    """Answers batch prompts with `batch_response` (or raises it) and single prompts normally."""
+
+    def __init__(self, batch_response):
+        super().__init__(latency=0)
+        self.batch_response = batch_response
+        self.prompts = []
+
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        if "=== FILE 1:" in prompt:
+            if isinstance(self.batch_response, Exception):
+                raise self.batch_response
+            return self.batch_response
+        return super().invoke(prompt)
+
+
+def _job(filename, tokens=10, single_chunk=True, cached=None):
+    return {"filename": filename, "tokens": tokens, "single_chunk": single_chunk, "cached": cached}
+
+
+def test_one_request_for_several_files():
+    llm = FakeLLM(latency=0)
+    metrics = RunMetrics(registry=None)
+    with offline_services(llm):
+        results, status = analyze_batch(ITEMS, metrics=metrics)
+    assert llm.calls == 1 and status == OK
+    assert [json.loads(r)["filename"] for r in results] == ["a.py", "b.py"]
+    assert metrics.counter("batch_prompt_tokens_saved") > 0
+
+
+def test_unparseable_batch_falls_back_to_single_requests():
+    llm = BatchFailingLLM("Sorry, I can only analyze one file at a time.")
+    metrics = RunMetrics(registry=None)
+    with offline_services(llm):
+        results, status = analyze_batch(ITEMS, metrics=metrics)
+    assert status is None
+    assert len(llm.prompts) == 3
+    assert [json.loads(r)["filename"] for r in results] == ["a.py", "b.py"]
+    assert metrics.counter("batch_fallbacks") == 1
+
+
+def test_rate_limited_batch_is_not_split():
+    llm = BatchFailingLLM(FakeRateLimitError())
+    with offline_services(llm):
+        results, status = analyze_batch(ITEMS)
+    assert len(llm.prompts) == 1
+    assert status is None
+    assert all(error_kind(r) == RATE_LIMITED for r in results)
+
+
+def test_only_small_single_chunk_files_are_batched(monkeypatch):
+    monkeypatch.setattr(main, "BATCH_MAX_TOKENS", 25)
+    monkeypatch.setattr(main, "BATCH_MAX_FILES", 8)
+    monkeypatch.setattr(main, "BATCH_FILE_MAX_TOKENS", 20)
+    jobs = [_job("a"), _job("b"), _job("big", tokens=100), _job("part", single_chunk=False),
+            _job("c"), _job("d"), _job("cached", cached="{}")]
+    grouped = [[j["filename"] for j in job["batch"]] if "batch" in job else job["filename"]
+               for job in main._batch_jobs(jobs)]
+    # Other jobs pass through as they come; a batch is sent once it's full
+    assert grouped == ["big", "part", ["a", "b"], "cached", ["c", "d"]]
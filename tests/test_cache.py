@@ -0,0 +1,74 @@
+import os
+
+from cache import (ChunkCache, DiskCacheBackend, MemoryCacheBackend, RedisCacheBackend, chunk_cache_key,
+                   compress_value, decompress_value)
+from metrics import RunMetrics
+from offline import MemoryRedis
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_key_depends_only_on_what_the_model_sees():
+    key = chunk_cache_key("prompt", "model", "code")
+    assert key.startswith("chunk:")
+    assert key == chunk_cache_key("prompt", "model", "code")
+    assert key != chunk_cache_key("prompt", "other-model", "code")
+    assert chunk_cache_key("ab", "c", "d") != chunk_cache_key("a", "bc", "d")
+
+
+def test_large_values_are_compressed():
+    value = '{"description": "' + "x" * 2000 + '"}'
+    packed = compress_value(value, min_size=512)
+    assert packed.startswith("gz:") and len(packed) < len(value)
+    assert decompress_value(packed) == value
+    assert compress_value("{}", min_size=512) == "{}"
+    assert decompress_value("{}") == "{}"
+
+
+def test_memory_backend_is_an_lru_with_ttl():
+    clock = Clock()
+    backend = MemoryCacheBackend(max_entries=2, ttl=10, clock=clock)
+    backend.set("a", "1")
+    backend.set("b", "2")
+    backend.get("a")
+    backend.set("c", "3")
+    assert backend.get("b") is None  # Least recently used
+    assert backend.get("a") == "1"
+    clock.now = 11
+    assert backend.get("c") is None
+
+
+def test_disk_backend_evicts_least_recently_used(tmp_path):
+    backend = DiskCacheBackend(str(tmp_path), max_entries=10, ttl=0, headroom=0.2)
+    for i in range(25):
+        backend.set(f"chunk:{i}", str(i))
+        os.utime(backend._path(f"chunk:{i}"), (i, i))
+    entries = [name for name in os.listdir(tmp_path) if name.endswith(".json")]
+    assert len(entries) <= 10
+    assert backend.get("chunk:24") == "24"
+    assert backend.get("chunk:0") is None
+
+
+def test_chunk_cache_counts_per_run():
+    cache = ChunkCache(RedisCacheBackend(client=MemoryRedis()), compress_min_size=16)
+    first, second = RunMetrics(registry=None), RunMetrics(registry=None)
+    assert cache.get("chunk:a", first) is None
+    cache.put("chunk:a", '{"description": "' + "y" * 100 + '"}')
+    assert cache.get("chunk:a", second).endswith('"}')
+    assert (first.counter("cache_hits"), first.counter("cache_misses")) == (0, 1)
+    assert (second.counter("cache_hits"), second.counter("cache_misses")) == (1, 0)
+    assert cache.stats()["hits"] == 1
+
+
+def test_corrupt_entries_are_deleted():
+    backend = MemoryCacheBackend()
+    cache = ChunkCache(backend)
+    backend.set("chunk:a", "gz:not base64!")
+    assert cache.get("chunk:a") is None
+    assert backend.get("chunk:a") is None
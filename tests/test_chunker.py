@@ -0,0 +1,57 @@
+from chunker import chunk_code, chunk_spans, code_units, count_tokens
+
+JAVA = """package demo;
+
+public class Shapes {
+    public int area(int w, int h) {
+        return w * h;
+    }
+
+    public int perimeter(int w, int h) {
+        return 2 * (w + h);
+    }
+
+    public int one() { return 1; }
+}
+"""
+
+
+def _python(functions, body_lines=3):
+    return "".join(f"def f{i}(x):\n" + "".join(f"    x = x + {j}\n" for j in range(body_lines)) + "    return x\n\n"
+                   for i in range(functions))
+
+
+def test_chunks_cover_the_file_without_overlap():
+    text = _python(40)
+    spans = chunk_spans(text, "a.py", max_tokens=100)
+    assert len(spans) > 1
+    assert spans[0][0] == 0 and spans[-1][1] == len(text)
+    assert all(a[1] == b[0] for a, b in zip(spans, spans[1:]))
+    assert "".join(chunk_code(text, "a.py", max_tokens=100)) == text
+
+
+def test_small_files_are_one_chunk():
+    assert chunk_spans(JAVA, "Shapes.java") == [(0, len(JAVA))]
+    assert chunk_spans("", "empty.py") == []
+
+
+def test_units_are_not_split_while_they_fit():
+    text = _python(30)
+    units = code_units(text, "a.py")
+    assert len(units) == 30
+    spans = chunk_spans(text, "a.py", max_tokens=120)
+    assert all(any(lo <= start and end <= hi for lo, hi in spans) for start, end in units)
+    assert all(count_tokens(text[lo:hi]) <= 120 for lo, hi in spans)
+
+
+def test_oversized_units_are_split_within_the_budget():
+    text = _python(1, body_lines=300)
+    spans = chunk_spans(text, "big.py", max_tokens=200)
+    assert len(spans) > 1
+    assert all(count_tokens(text[lo:hi]) <= 200 for lo, hi in spans)
+
+
+def test_java_methods_including_one_liners_are_units():
+    units = [JAVA[start:end] for start, end in code_units(JAVA, "Shapes.java")]
+    assert any("area(" in unit for unit in units)
+    assert any("one()" in unit for unit in units)
@@ -0,0 +1,41 @@
+import db
+from db import BulkWriter
+
+
+def test_writes_are_sent_in_batches(database):
+    with BulkWriter(batch_size=10, flush_interval=60) as writer:
+        ids = [writer.insert(db.chunks(), {"n": i}) for i in range(25)]
+        assert database["chunks"].count_documents({}) == 20
+    assert database["chunks"].count_documents({}) == 25
+    assert writer.round_trips == 3
+    assert {doc["_id"] for doc in database["chunks"].find()} == set(ids)
+
+
+def test_updates_to_buffered_documents_are_merged(database):
+    with BulkWriter(batch_size=100, flush_interval=60) as writer:
+        doc_id = writer.insert(db.chunks(), {"status": "pending"})
+        writer.set_fields(db.chunks(), doc_id, {"status": "processed"})
+    assert writer.round_trips == 1
+    assert database["chunks"].find_one({"_id": doc_id})["status"] == "processed"
+
+    with BulkWriter() as writer:
+        writer.set_fields(db.chunks(), doc_id, {"status": "failed"})
+    assert database["chunks"].find_one({"_id": doc_id})["status"] == "failed"
+
+
+def test_upserts_keep_one_document_per_key(database):
+    for attempt in range(2):
+        with BulkWriter() as writer:
+            writer.upsert(db.analysis_results(), {"chunk_id": "c1"}, {"attempt": attempt})
+    assert [doc["attempt"] for doc in database["analysis_results"].find({"chunk_id": "c1"})] == [1]
+
+
+def test_content_is_sent_once_and_referenced_per_file(database):
+    with BulkWriter(batch_size=100, flush_interval=60) as writer:
+        for _ in range(3):
+            writer.store_content("h1", "print(1)\n")
+        writer.flush()
+        writer.store_content("h1", "print(1)\n")
+    doc = database["file_contents"].find_one({"_id": "h1"})
+    assert doc["content"] == "print(1)\n"
+    assert doc["refs"] == 4
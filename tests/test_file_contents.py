@@ -0,0 +1,29 @@
+import os
+
+import db
+import main
+
+
+def _code_files(project):
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(project) for name in names
+                  if name.startswith("module_"))
+
+
+def test_shared_content_is_kept_until_its_last_file_is_dropped(database, workdir, project):
+    copy = os.path.join(workdir, "copy")
+    os.makedirs(copy)
+    for path in _code_files(project):
+        target = os.path.join(copy, os.path.relpath(path, project))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(path, encoding="utf-8") as src, open(target, "w", encoding="utf-8") as dst:
+            dst.write(src.read())
+
+    main.run_analysis(project)
+    main.run_analysis(copy)
+    contents = db.file_contents().count_documents({})
+    assert contents == len(_code_files(project))
+
+    main._drop_project(project)
+    assert db.file_contents().count_documents({}) == contents
+    main._drop_project(copy)
+    assert db.file_contents().count_documents({}) == 0
@@ -0,0 +1,109 @@
+import os
+import shutil
+
+import code_loader
+import db
+import main
+import search_index
+
+
+def _files(project):
+    return {os.path.relpath(doc["file_path"], project): doc for doc in db.codebase_files().find({"project": project})}
+
+
+def _code_files(project):
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(project) for name in names
+                  if name.startswith("module_"))
+
+
+def test_incremental_run_drops_deleted_and_modified_files(database, llm, project):
+    main.run_analysis(project)
+    deleted, modified, unchanged = _code_files(project)[:3]
+    stored = _files(project)
+    os.remove(deleted)
+    with open(modified, "a", encoding="utf-8") as f:
+        f.write("\n# changed\n")
+    calls = llm.calls
+
+    main.run_analysis(project, incremental=True)
+
+    after = _files(project)
+    assert os.path.relpath(deleted, project) not in after
+    assert after[os.path.relpath(unchanged, project)]["_id"] == stored[os.path.relpath(unchanged, project)]["_id"]
+    assert after[os.path.relpath(modified, project)]["_id"] != stored[os.path.relpath(modified, project)]["_id"]
+    # Only the modified file went back to the LLM (plus the summaries)
+    assert llm.calls - calls < len(stored)
+
+    file_ids = [doc["_id"] for doc in after.values()]
+    assert db.chunks().count_documents({"project": project}) == sum(doc["chunk_count"] for doc in after.values())
+    assert all(doc["file_id"] in file_ids for doc in db.analysis_results().find({"project": project}))
+
+    # The search index no longer returns the deleted file
+    index = search_index.get(project)
+    paths = {entry["file_path"] for entry in index._entries.values()}
+    assert os.path.relpath(deleted, project) not in paths
+    assert os.path.relpath(modified, project) in paths
+
+
+def test_new_checkout_of_a_branch_reuses_the_stored_project(database, llm, project, workdir):
+    key = "file:///srv/git/app.git#main"
+    main.run_analysis(project, project_key=key, commit="a" * 40)
+    stored = {os.path.relpath(doc["file_path"], project): doc["_id"] for doc in db.codebase_files().find()}
+
+    # The next commit is checked out in a directory of its own, with one file changed
+    checkout = os.path.join(workdir, "main@bbbbbbbbbbbb")
+    shutil.copytree(project, checkout)
+    modified = _code_files(checkout)[0]
+    with open(modified, "a", encoding="utf-8") as f:
+        f.write("\n# changed\n")
+    calls = llm.calls
+
+    main.run_analysis(checkout, incremental=True, project_key=key, commit="b" * 40)
+
+    assert llm.calls - calls < len(stored)
+    after = {os.path.relpath(doc["file_path"], checkout): doc["_id"]
+             for doc in db.codebase_files().find({"project": key})}
+    assert after.keys() == stored.keys()
+    assert [path for path in after if after[path] != stored[path]] == [os.path.relpath(modified, checkout)]
+    assert all(doc["file_path"].startswith(checkout + os.sep) for doc in db.analysis_results().find())
+    assert db.runs().find_one({"project_path": key}, sort=[("started_at", -1)])["commit"] == "b" * 40
+    assert main.project_root(key) == checkout and main.project_for_root(checkout) == key
+
+    index = search_index.get(key)
+    assert {entry["file_path"] for entry in index._entries.values()} == set(after)
+    assert {path for _, path, _ in main.load_search_entries(key)} == set(after)
+
+
+def test_forgotten_project_keeps_no_data(database, project):
+    main.run_analysis(project)
+    main.forget_project(project)
+    assert search_index.get(project) is None
+    for name in ("codebase_files", "chunks", "analysis_results", "file_contents"):
+        assert database[name].count_documents({}) == 0
+
+
+def test_only_files_with_a_new_size_or_mtime_are_read(monkeypatch, database, project):
+    main.run_analysis(project)
+    stored = _files(project)
+    touched, rewritten = _code_files(project)[:2]
+    os.utime(touched, (os.path.getatime(touched), os.path.getmtime(touched) + 10))
+    with open(rewritten, "r+", encoding="utf-8") as f:
+        content = f.read()
+        f.seek(0)
+        f.write(content.replace("value", "VALUE", 1))  # Same size, new content and mtime
+    os.utime(rewritten, (os.path.getatime(rewritten), os.path.getmtime(rewritten) + 10))
+
+    read = []
+    read_text = code_loader._read_text
+
+    def recording_read(path, *args):
+        read.append(path)
+        return read_text(path, *args)
+
+    monkeypatch.setattr(code_loader, "_read_text", recording_read)
+    main.run_analysis(project, incremental=True)
+
+    assert sorted(read) == sorted([touched, rewritten])
+    after = _files(project)
+    assert after[os.path.relpath(touched, project)]["_id"] == stored[os.path.relpath(touched, project)]["_id"]
+    assert after[os.path.relpath(rewritten, project)]["_id"] != stored[os.path.relpath(rewritten, project)]["_id"]
@@ -0,0 +1,86 @@
+import threading
+
+from jobs import CANCELLED, COMPLETE, RUNNING, JobManager, MemoryJobStore, SingleFlight
+from main import AnalysisCancelled
+
+
+def _wait(manager, job_id, state=COMPLETE, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if manager.get(job_id)["state"] == state:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError(f"job {job_id} did not reach {state}")
+
+
+def test_concurrent_requests_join_one_job():
+    manager = JobManager(MemoryJobStore())
+    release = threading.Event()
+    runs = []
+
+    def analyze(path, progress=None):
+        runs.append(path)
+        release.wait(5)
+        return path
+
+    first, joined = manager.submit_once("project", analyze, "project")
+    assert not joined
+    for _ in range(3):
+        assert manager.submit_once("project", analyze, "project") == (first, True)
+    other, joined = manager.submit_once("other", analyze, "other")
+    assert other != first and not joined
+
+    release.set()
+    _wait(manager, first)
+    _wait(manager, other)
+    assert sorted(runs) == ["other", "project"]
+
+    # Once the job is done, the next request starts a new one
+    again, joined = manager.submit_once("project", analyze, "project")
+    assert again != first and not joined
+    _wait(manager, again)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_claims_are_leases_renewed_by_their_owner():
+    clock = FakeClock()
+    flights = SingleFlight(use_redis=False, ttl=10, clock=clock)
+    assert flights.claim("project", "a") == "a"
+
+    clock.now += 8
+    flights.renew()
+    clock.now += 7
+    assert flights.claim("project", "b") == "a"
+
+    # The owner stopped renewing (its process died): the lease runs out and is taken over
+    clock.now += 4
+    assert flights.claim("project", "b") == "b"
+
+
+def test_cancel_is_not_lost_to_a_stale_progress_write():
+    store = MemoryJobStore()
+    owner, other = JobManager(store), JobManager(store)
+    proceed = threading.Event()
+
+    def analyze(progress=None):
+        proceed.wait(5)
+        if progress.cancelled():
+            raise AnalysisCancelled()
+
+    job_id = owner.submit(analyze)
+    _wait(owner, job_id, RUNNING)
+    stale = store.load(job_id)
+
+    other.cancel(job_id)  # Through another app instance
+    # The owner rewrites the record from what it read before the cancel
+    store.save(job_id, dict(stale, progress={"chunks_done": 1}))
+    assert owner.get(job_id)["cancel_requested"]
+
+    proceed.set()
+    _wait(owner, job_id, CANCELLED)
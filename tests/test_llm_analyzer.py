@@ -0,0 +1,24 @@
+import threading
+import time
+
+from llm_analyzer import analyze_chunk
+from metrics import RunMetrics
+from offline import FakeLLM, offline_services
+from scheduler import AdaptiveLimiter
+
+
+def test_latency_excludes_the_wait_for_the_limiter():
+    limiter = AdaptiveLimiter(max_limit=1)
+    metrics = RunMetrics(registry=None)
+    with offline_services(FakeLLM(latency=0.01)):
+        limiter.acquire()  # Another request holds the only slot
+        worker = threading.Thread(target=analyze_chunk, args=("a.py", "x = 1\n"),
+                                  kwargs={"metrics": metrics, "limiter": limiter})
+        worker.start()
+        time.sleep(0.1)
+        limiter.release("ok")
+        worker.join()
+
+    observations = metrics.report()["observations"]
+    assert observations["llm_queue_seconds"]["max"] >= 0.09
+    assert observations["llm_latency_seconds"]["max"] < 0.09
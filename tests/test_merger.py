@@ -0,0 +1,34 @@
+from merger import ResultMerger
+
+
+def _chunk(methods, imports=(), description=""):
+    return {
+        "filename": "utils.py",
+        "description": description,
+        "key_imports": list(imports),
+        "classes": [{"name": "Helper", "description": "", "annotations": ["@dataclass"],
+                     "methods": [{"signature": s} for s in methods]}],
+    }
+
+
+def test_chunks_of_a_file_are_merged_without_duplicates():
+    merger = ResultMerger()
+    merger.add("/repo/a/utils.py", _chunk(["def run(self, x)"], imports=["os"]))
+    merger.add("/repo/a/utils.py", _chunk(["def  run(self,  x)", "def stop(self)"], imports=["os", "re"],
+                                          description="Helpers"))
+
+    [entry] = merger.results()
+    assert entry["description"] == "Helpers"
+    assert entry["key_imports"] == ["os", "re"]
+    [cls] = entry["classes"]
+    assert cls["annotations"] == ["@dataclass"]
+    assert [m["signature"] for m in cls["methods"]] == ["def run(self, x)", "def stop(self)"]
+
+
+def test_files_with_the_same_name_stay_separate():
+    merger = ResultMerger()
+    merger.add("/repo/a/utils.py", _chunk(["def a(self)"]))
+    merger.add("/repo/b/utils.py", _chunk(["def b(self)"]))
+
+    assert len(merger) == 2
+    assert [e["file_path"] for e in merger.results(relative_to="/repo")] == ["a/utils.py", "b/utils.py"]
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from output_parser import OK, REPAIRED, OutputParseError, loads, parse_analysis, parse_batch
+
+ANALYSIS = {"filename": "a.py", "description": "Parses config",
+            "classes": [{"name": "Config", "description": "Settings",
+                         "methods": [{"signature": "load(path)", "description": "Reads a file"}]}]}
+
+
+def test_valid_json_is_ok():
+    assert parse_analysis(json.dumps(ANALYSIS), "a.py") == (ANALYSIS, OK)
+
+
+@pytest.mark.parametrize("text", [
+    "```json\n" + json.dumps(ANALYSIS) + "\n```",
+    "Here is the analysis:\n" + json.dumps(ANALYSIS) + "\nHope this helps.",
+    json.dumps(ANALYSIS).replace("]}]}", "],}],}"),
+    json.dumps(ANALYSIS).replace('"Parses config"', '“Parses config”'),
+    json.dumps(ANALYSIS).replace("Reads a file", "Reads\na file"),
+])
+def test_common_defects_are_repaired(text):
+    value, status = parse_analysis(text, "a.py")
+    assert status == REPAIRED
+    assert value["classes"][0]["methods"][0]["signature"] == "load(path)"
+
+
+def test_python_literals_are_repaired():
+    assert loads('{"a": True, "b": None, "c": False}') == ({"a": True, "b": None, "c": False}, REPAIRED)
+
+
+def test_truncated_output_keeps_complete_values():
+    text = json.dumps(ANALYSIS)
+    value, status = parse_analysis(text[:text.index("Reads") + 3], "a.py")
+    assert status == REPAIRED
+    assert value["description"] == "Parses config"
+    assert value["classes"][0]["name"] == "Config"
+
+
+def test_prose_is_rejected():
+    with pytest.raises(OutputParseError):
+        parse_analysis("Sorry, I can't produce JSON for this file.", "a.py")
+
+
+def test_missing_fields_are_normalized():
+    value, _ = parse_analysis('{"classes": [{"name": "A", "methods": [{"description": "no signature"}]}, 3]}', "a.py")
+    assert value == {"filename": "a.py", "description": "",
+                     "classes": [{"name": "A", "description": "", "methods": []}]}
+
+
+def test_batch_must_match_the_files():
+    text = json.dumps([ANALYSIS, dict(ANALYSIS, filename="b.py")]) + ","
+    values, status = parse_batch(text, ["a.py", "b.py"])
+    assert status == REPAIRED
+    assert [v["filename"] for v in values] == ["a.py", "b.py"]
+    with pytest.raises(OutputParseError):
+        parse_batch(json.dumps([ANALYSIS]), ["a.py", "b.py"])
+
+
+def test_non_ascii_bare_words_are_rejected_not_crashing():
+    with pytest.raises(OutputParseError):
+        parse_analysis('{"description": café, "classes": []}', "a.py")
+    assert loads('{"description": "café", "ok": True,}') == ({"description": "café", "ok": True}, REPAIRED)
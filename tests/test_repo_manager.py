@@ -0,0 +1,72 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from repo_manager import RepoManager, project_key
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+
+
+def _git(*args, cwd=None):
+    subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+                   cwd=cwd, check=True, capture_output=True)
+
+
+@pytest.fixture
+def remote(tmp_path):
+    work = tmp_path / "work"
+    for path in ("a/b/x.py", "a/y.py", "d/z.py", "README.md"):
+        os.makedirs(work / os.path.dirname(path), exist_ok=True)
+        (work / path).write_text(f"# {path}\n")
+    _git("init", "--quiet", "-b", "main", str(work))
+    _git("add", "-A", cwd=work)
+    _git("commit", "--quiet", "-m", "init", cwd=work)
+    bare = tmp_path / "remote.git"
+    _git("clone", "--quiet", "--bare", str(work), str(bare))
+    return f"file://{bare}"
+
+
+def _files(path):
+    return sorted(os.path.relpath(os.path.join(root, name), path)
+                  for root, dirs, names in os.walk(path) if ".git" not in root.split(os.sep)
+                  for name in names if name != ".git")
+
+
+def test_reused_sparse_checkout_is_widened(tmp_path, remote):
+    manager = RepoManager(base_dir=str(tmp_path / "clones"))
+
+    path = manager.checkout(manager.resolve(f"{remote}#main/a/b"))
+    assert _files(path) == ["x.py"]
+    checkout_dir = os.path.dirname(os.path.dirname(path))
+    assert not os.path.exists(os.path.join(checkout_dir, "d"))
+
+    # Same commit, wider sub-directory: the worktree is reused and its cone widened
+    path = manager.checkout(manager.resolve(f"{remote}#main/a"))
+    assert path == os.path.join(checkout_dir, "a")
+    assert _files(path) == ["b/x.py", "y.py"]
+
+    path = manager.checkout(manager.resolve(f"{remote}#main/d"))
+    assert _files(path) == ["z.py"]
+
+    # The whole repository disables the sparse checkout
+    path = manager.checkout(manager.resolve(f"{remote}#main"))
+    assert path == checkout_dir
+    assert _files(path) == ["README.md", "a/b/x.py", "a/y.py", "d/z.py"]
+
+
+def test_evicted_checkouts_report_their_projects(tmp_path, remote):
+    evicted = []
+    manager = RepoManager(base_dir=str(tmp_path / "clones"), on_evict=lambda *args: evicted.append(args))
+
+    spec = manager.resolve(f"{remote}#main/a")
+    assert project_key(spec) == f"{remote}#main/a"
+    path = manager.checkout(spec)
+    checkout_dir = os.path.dirname(path)
+    assert evicted == []
+
+    manager.disk_budget = 0
+    manager.evict()
+    assert evicted == [(checkout_dir, [f"{remote}#main/a"])]
+    assert not os.path.exists(checkout_dir)
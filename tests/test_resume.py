@@ -0,0 +1,128 @@
+import functools
+
+import db
+import main
+import scheduler
+
+
+class Crash(Exception):
+    pass
+
+
+def _crash_on_chunk_insert(monkeypatch, database, flushes):
+    """
+    Lets `flushes` chunk inserts through, then stores only part of the next
+    batch and raises, as if the process died in the middle of a flush.
+    """
+    collection = database["chunks"]
+    insert_many = collection.insert_many
+    remaining = [flushes]
+
+    def crashing(docs, ordered=True):
+        if remaining[0] == 0:
+            insert_many(docs[:2], ordered)
+            raise Crash("connection lost")
+        remaining[0] -= 1
+        insert_many(docs, ordered)
+
+    monkeypatch.setattr(collection, "insert_many", crashing)
+    return lambda: monkeypatch.setattr(collection, "insert_many", insert_many)
+
+
+def _stored_state(project):
+    files = list(db.codebase_files().find({"project": project}))
+    return {
+        "files": len(files),
+        "expected_chunks": sum(f["chunk_count"] for f in files),
+        "chunks": db.chunks().count_documents({"project": project}),
+        "unprocessed": db.chunks().count_documents({"project": project, "status": {"$ne": "processed"}}),
+        "results": db.analysis_results().count_documents({"project": project}),
+    }
+
+
+def test_resume_after_partial_flush(monkeypatch, database, project):
+    monkeypatch.setattr(main, "BulkWriter", functools.partial(db.BulkWriter, batch_size=5))
+    restore = _crash_on_chunk_insert(monkeypatch, database, flushes=3)
+    try:
+        main.run_analysis(project)
+    except Crash:
+        pass
+    else:
+        raise AssertionError("the run should have crashed")
+    restore()
+
+    assert main._incomplete_files(project)
+    run_id = main.find_resumable_run(project)
+    assert run_id is not None
+
+    main.run_analysis(project, resume_run_id=run_id)
+
+    state = _stored_state(project)
+    assert state["files"] == 12
+    assert state["chunks"] == state["expected_chunks"] == state["results"]
+    assert state["unprocessed"] == 0
+    assert not main._incomplete_files(project)
+    assert main.find_resumable_run(project) is None
+
+
+def test_reanalyzed_chunk_keeps_one_result(database, project):
+    main.run_analysis(project)
+    before = _stored_state(project)
+    # A lost status update leaves processed chunks pending
+    for doc in db.chunks().find({"project": project}):
+        db.chunks().update_one({"_id": doc["_id"]}, {"$set": {"status": "pending"}})
+    run_id = db.runs().find_one({"project_path": project})["_id"]
+    db.runs().update_one({"_id": run_id}, {"$set": {"status": "failed"}})
+
+    main.run_analysis(project, resume_run_id=run_id)
+
+    assert _stored_state(project)["results"] == before["results"]
+
+
+def test_only_the_latest_run_is_resumable(database, project):
+    main.run_analysis(project)
+    run_id = db.runs().find_one({"project_path": project})["_id"]
+    db.runs().update_one({"_id": run_id}, {"$set": {"status": "failed"}})
+    assert main.find_resumable_run(project) == run_id
+
+    # A newer complete run supersedes the failed one
+    main.run_analysis(project)
+    assert main.find_resumable_run(project) is None
+
+
+def _break_llm(monkeypatch, llm):
+    """Makes every LLM call fail with a permanent error, without backoff sleeps."""
+    def failing(prompt):
+        raise ValueError("model refused")
+
+    monkeypatch.setattr(scheduler, "backoff_delay", lambda *args, **kwargs: 0)
+    monkeypatch.setattr(llm, "invoke", failing)
+    return monkeypatch.undo
+
+
+def test_incremental_run_retries_chunks_failed_by_an_earlier_run(monkeypatch, database, llm, project):
+    restore = _break_llm(monkeypatch, llm)
+    main.run_analysis(project)
+    restore()
+    failed = db.chunks().count_documents({"project": project, "status": "failed"})
+    assert failed
+    first_run = main.find_resumable_run(project)
+    assert db.runs().find_one({"_id": first_run})["chunks_failed"] == failed
+
+    # No file changed, but the failed chunks are sent again
+    main.run_analysis(project, incremental=True)
+
+    state = _stored_state(project)
+    assert state["unprocessed"] == 0
+    assert state["chunks"] == state["results"]
+    assert main.find_resumable_run(project) is None
+
+
+def test_failures_left_by_an_earlier_run_keep_the_project_resumable(monkeypatch, database, llm, project):
+    _break_llm(monkeypatch, llm)
+    main.run_analysis(project)
+    main.run_analysis(project, incremental=True)
+
+    latest = db.runs().find_one({"project_path": project, "incremental": True})
+    assert latest["chunks_failed"] == db.chunks().count_documents({"project": project, "status": "failed"}) > 0
+    assert main.find_resumable_run(project) == latest["_id"]
@@ -0,0 +1,127 @@
+import random
+import threading
+import time
+
+import pytest
+
+from scheduler import RATE_LIMITED, TIMEOUT, AdaptiveLimiter, classify_error, retry_after, run_ordered
+
+
+def test_results_come_back_in_input_order():
+    rng = random.Random(0)
+    delays = [rng.uniform(0, 0.01) for _ in range(40)]
+
+    def worker(i):
+        time.sleep(delays[i])
+        return i * 2
+
+    results = list(run_ordered(range(40), worker, max_in_flight=8))
+    assert results == [(i, i * 2) for i in range(40)]
+
+
+def test_in_flight_calls_are_bounded():
+    lock = threading.Lock()
+    in_flight, peak = [0], [0]
+
+    def worker(i):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.005)
+        with lock:
+            in_flight[0] -= 1
+        return i
+
+    assert [r for _, r in run_ordered(range(30), worker, max_in_flight=3)] == list(range(30))
+    assert peak[0] <= 3
+
+
+def test_jobs_are_pulled_lazily():
+    pulled = []
+
+    def jobs():
+        for i in range(100):
+            pulled.append(i)
+            yield i
+
+    results = run_ordered(jobs(), lambda i: i, max_in_flight=2)
+    assert next(results) == (0, 0)
+    assert len(pulled) < 100
+    results.close()
+
+
+def test_jobs_are_dispatched_by_priority_within_a_window():
+    started = []
+
+    def worker(i):
+        started.append(i)
+        return i
+
+    results = list(run_ordered([1, 5, 3, 2, 9, 4], worker, max_in_flight=1, priority=lambda i: i, window=4))
+    assert started == [5, 3, 2, 1, 9, 4]
+    assert [job for job, _ in results] == [1, 5, 3, 2, 9, 4]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_limiter_backs_off_multiplicatively_and_recovers_additively():
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(max_limit=8, min_limit=2, cooldown=1.0, clock=clock)
+
+    limiter.acquire()
+    limiter.release(RATE_LIMITED)
+    assert limiter.limit == 4
+    limiter.acquire()
+    limiter.release(TIMEOUT)
+    assert limiter.limit == 4  # Same burst of errors, within the cooldown
+
+    for _ in range(2):
+        clock.now += 1.0
+        limiter.acquire()
+        limiter.release(RATE_LIMITED)
+    assert limiter.limit == 2  # Never below min_limit
+
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release("ok")
+    assert 2.9 < limiter.limit < 4
+    assert limiter.outcomes == {RATE_LIMITED: 3, TIMEOUT: 1, "ok": 4}
+
+
+def test_limiter_bounds_calls_in_flight():
+    limiter = AdaptiveLimiter(max_limit=2)
+    limiter.acquire()
+    limiter.acquire()
+    blocked = threading.Thread(target=limiter.acquire)
+    blocked.start()
+    blocked.join(0.05)
+    assert blocked.is_alive()
+    limiter.release("ok")
+    blocked.join(1)
+    assert not blocked.is_alive() and limiter.in_flight == 2
+
+
+class RateLimitError(Exception):
+    status_code = 429
+    retry_after = "0.1"
+
+
+def _rate_limited():
+    raise RateLimitError("slow down")
+
+
+def test_retry_after_pauses_new_requests():
+    limiter = AdaptiveLimiter(max_limit=4)
+    with pytest.raises(RateLimitError) as raised:
+        limiter.call(_rate_limited)
+    assert classify_error(raised.value) == RATE_LIMITED and retry_after(raised.value) == 0.1
+
+    started = time.monotonic()
+    assert limiter.call(lambda: "ok") == "ok"
+    assert time.monotonic() - started >= 0.08
@@ -0,0 +1,57 @@
+import pytest
+
+import search_index
+from search_index import KEYWORD, SearchIndex
+
+PARSER = {"description": "Reads configuration files",
+          "classes": [{"name": "ConfigParser", "description": "Parses settings",
+                       "methods": [{"signature": "parse_file(path)", "description": "Loads one file"}]}]}
+SERVER = {"description": "HTTP server",
+          "classes": [{"name": "RequestHandler", "description": "Handles requests",
+                       "methods": [{"signature": "handle(request)", "description": "Dispatches a request"}]}]}
+
+
+@pytest.fixture(autouse=True)
+def clear_indexes():
+    search_index.clear()
+    yield
+    search_index.clear()
+
+
+def test_keyword_search_ranks_names_first():
+    index = SearchIndex()
+    index.add("c1", "config.py", PARSER)
+    index.add("c2", "server.py", SERVER)
+
+    hits = index.search("config parser", k=3, mode=KEYWORD)
+    assert hits[0]["class"] == "ConfigParser"
+    assert index.search("request handler", k=1, mode=KEYWORD)[0]["file_path"] == "server.py"
+
+
+def test_readding_a_chunk_replaces_its_entries():
+    index = SearchIndex()
+    index.add("c1", "config.py", PARSER)
+    size = len(index)
+    index.add("c1", "config.py", PARSER)
+    assert len(index) == size
+
+    index.remove(["c1"])
+    assert len(index) == 0
+    assert index.search("config", mode=KEYWORD) == []
+
+
+def test_hybrid_search_when_embeddings_are_available():
+    pytest.importorskip("numpy")
+    index = SearchIndex()
+    index.add("c1", "config.py", PARSER)
+    index.add("c2", "server.py", SERVER)
+    assert index.search("configuration", k=1)[0]["file_path"] == "config.py"
+
+
+def test_empty_loads_are_not_kept():
+    assert search_index.load("/nowhere", lambda: iter(())) is None
+    assert search_index.get("/nowhere") is None
+
+    index = search_index.load("/project", lambda: [("c1", "config.py", PARSER)])
+    assert search_index.get("/project") is index
+    assert len(index)
@@ -0,0 +1,119 @@
+import static_analysis
+from static_analysis import MODULE_CLASS, combine, extract, is_trivial, llm_view
+
+PYTHON = '''import os
+from collections import Counter
+
+
+@dataclass
+class Point:
+    def __init__(self, x):
+        self.x = x
+
+    def get_x(self):
+        return self.x
+
+    def scale(self, factor):
+        if factor < 0 or factor > 10:
+            raise ValueError(factor)
+        return Point(self.x * factor)
+
+
+def helper(values):
+    return Counter(values)
+'''
+
+JAVA = '''package app;
+
+import java.util.List;
+
+@Entity
+public class User {
+    private String name;
+
+    public String getName() { return this.name; }
+
+    public void setName(String name) {
+        this.name = name;
+    }
+
+    public int score(List<Integer> values) {
+        int total = 0;
+        for (int v : values) {
+            if (v > 0 && v < 100) { total += v; }
+        }
+        return total;
+    }
+}
+'''
+
+
+def _methods(facts, class_name):
+    [cls] = [c for c in facts["classes"] if c["name"] == class_name]
+    return {m["name"]: m for m in cls["methods"]}
+
+
+def test_python_structure_comes_from_the_ast():
+    facts = extract(PYTHON, "pkg/point.py")
+    assert facts["filename"] == "point.py"
+    assert facts["key_imports"] == ["os", "collections"]
+    point = _methods(facts, "Point")
+    assert point["get_x"]["trivial"] and point["__init__"]["trivial"]
+    assert not point["scale"]["trivial"]
+    assert point["scale"]["signature"] == "def scale(self, factor)"
+    assert "helper" in _methods(facts, MODULE_CLASS)
+    assert [c["annotations"] for c in facts["classes"] if c["name"] == "Point"] == [["@dataclass"]]
+
+
+def test_other_languages_use_the_declaration_patterns():
+    facts = extract(JAVA, "User.java")
+    assert facts["key_imports"] == ["java.util.List"]
+    user = _methods(facts, "User")
+    assert set(user) == {"getName", "setName", "score"}
+    assert user["getName"]["trivial"] and user["setName"]["trivial"]
+    assert not user["score"]["trivial"]
+    assert user["score"]["complexity"] == "Low"
+
+
+def test_one_line_methods_end_on_their_line():
+    facts = extract(JAVA, "User.java")
+    get_name = _methods(facts, "User")["getName"]
+    assert JAVA[get_name["start"]:get_name["end"]].strip() == "public String getName() { return this.name; }"
+
+
+def test_trivial_files_are_recognized():
+    dto = "class Config:\n    def __init__(self, url):\n        self.url = url\n\nTIMEOUT = 5\n"
+    assert is_trivial(extract(dto, "config.py"))
+    assert not is_trivial(extract(PYTHON, "point.py"))
+    assert not is_trivial(extract("import sys\n\nmain(sys.argv)\n", "run.py"))
+
+    [config] = combine(extract(dto, "config.py"), {}, trivial=True)["classes"]
+    assert config["description"] == "Data holder with simple accessors."
+    assert config["methods"][0]["description"] == "Initializes the instance fields."
+
+
+def test_llm_view_leaves_out_imports_and_accessors():
+    facts = extract(PYTHON, "point.py")
+    view = llm_view(PYTHON, 0, len(PYTHON), facts)
+    assert "import os" not in view and "def get_x" not in view
+    assert "def scale" in view and "def helper" in view
+
+
+def test_combine_keeps_methods_only_the_llm_reported():
+    facts = extract(PYTHON, "point.py")
+    described = {"description": "Points.", "classes": [
+        {"name": "Point", "description": "A point.", "methods": [
+            {"signature": "def scale(self,  factor)", "description": "Scales the point."},
+            {"signature": "def __add__(self, other)", "description": "Adds two points."}]}]}
+
+    result = combine(facts, described)
+    [point] = [c for c in result["classes"] if c["name"] == "Point"]
+    methods = {m["signature"]: m for m in point["methods"]}
+    assert methods["def scale(self, factor)"]["description"] == "Scales the point."
+    assert methods["def scale(self, factor)"]["complexity"] == {"level": "Low"}
+    assert methods["def get_x(self)"]["description"] == "Returns x."
+    assert methods["def __add__(self, other)"] == {
+        "signature": "def __add__(self, other)", "description": "Adds two points.",
+        "complexity": {"level": static_analysis.UNKNOWN_COMPLEXITY}}
+    assert result["description"] == "Points."
+    assert result["key_imports"] == ["os", "collections"]
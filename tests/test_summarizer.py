@@ -0,0 +1,47 @@
+from cache import ChunkCache, MemoryCacheBackend
+from chunker import count_tokens
+from summarizer import HierarchicalSummarizer
+
+
+class RecordingLLM:
+    def __init__(self):
+        self.prompts = []
+
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        return "A short summary."
+
+
+def _files(directories, per_directory=4):
+    return [{"filename": f"mod{i}.py", "file_path": f"{d}/mod{i}.py", "description": "Does things. " * 40,
+             "classes": [{"name": "Worker", "description": "Works.", "methods": [{"description": "Runs."}]}]}
+            for d in directories for i in range(per_directory)]
+
+
+def test_small_projects_use_a_single_prompt():
+    llm = RecordingLLM()
+    summary = HierarchicalSummarizer(llm).summarize(_files(["pkg"], per_directory=1))
+    assert summary == "A short summary."
+    assert len(llm.prompts) == 1
+
+
+def test_large_projects_are_summarized_within_the_prompt_budget():
+    llm = RecordingLLM()
+    summarizer = HierarchicalSummarizer(llm, max_prompt_tokens=600, max_workers=2)
+    assert summarizer.summarize(_files(["app/api", "app/models", "lib"])) == "A short summary."
+    assert len(llm.prompts) > 3
+    assert all(count_tokens(prompt) <= 600 for prompt in llm.prompts)
+    assert any('"app/api"' in prompt for prompt in llm.prompts)
+
+
+def test_unchanged_directories_come_from_the_cache():
+    files = _files(["app/api", "app/models", "lib"])
+    cache = ChunkCache(MemoryCacheBackend())
+    first = RecordingLLM()
+    HierarchicalSummarizer(first, cache=cache, max_prompt_tokens=600).summarize(files)
+
+    second = RecordingLLM()
+    summarizer = HierarchicalSummarizer(second, cache=cache, max_prompt_tokens=600)
+    summarizer.summarize(files)
+    assert first.prompts and not second.prompts
+    assert summarizer.llm_calls == 0